@@ -0,0 +1,105 @@
+"""
+Admission control for the chatbot's model-backed tiers.
+
+Each backend gets an ``AdmissionController``: at most ``concurrency``
+requests run at once, and at most ``queue`` more wait, each for no longer
+than ``queue_timeout`` seconds. Authenticated sessions are served first when
+a slot frees up, and anonymous requests may only fill half of the queue.
+Anything beyond that raises ``Overloaded`` at once. The caller then answers
+503 with ``Retry-After``, or a degraded keyword reply.
+
+Queue depth, active requests, wait time and shed counts are exported on
+``/metrics`` as ``admission.<backend>.*``.
+"""
+import contextlib
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+
+from metrics import metrics
+
+
+class Overloaded(RuntimeError):
+    """The backend is at its concurrency limit and the wait queue is full or timed out"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, name, concurrency, queue, queue_timeout, clock=time.monotonic):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.anonymous_queue = queue // 2
+        self.queue_timeout = queue_timeout
+        self.retry_after = max(1, math.ceil(queue_timeout))
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = []  # heap of (0 for priority / 1 for anonymous, arrival order)
+        self._arrivals = itertools.count()
+
+    def _publish(self):
+        metrics.set_gauge(f"admission.{self.name}.active", self._active)
+        metrics.set_gauge(f"admission.{self.name}.queued", len(self._waiting))
+
+    def _shed(self, reason):
+        metrics.incr(f"admission.{self.name}.shed")
+        raise Overloaded(f"{self.name} backend overloaded: {reason}", self.retry_after)
+
+    @contextlib.contextmanager
+    def admit(self, priority=False):
+        """Hold one of the backend's slots for the duration of the block"""
+        started = self.clock()
+        with self._cond:
+            if self._active < self.concurrency and not self._waiting:
+                self._active += 1
+            else:
+                self._wait_for_slot(priority, started)
+            self._publish()
+        metrics.observe(f"admission.{self.name}.wait", self.clock() - started)
+        metrics.incr(f"admission.{self.name}.admitted")
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._publish()
+                self._cond.notify_all()
+
+    def _wait_for_slot(self, priority, started):
+        if len(self._waiting) >= (self.queue if priority else self.anonymous_queue):
+            self._shed("queue full")
+        ticket = (0 if priority else 1, next(self._arrivals))
+        heapq.heappush(self._waiting, ticket)
+        self._publish()
+        deadline = started + self.queue_timeout
+        while not (self._active < self.concurrency and self._waiting[0] == ticket):
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._publish()
+                # The next waiter may be able to go now
+                self._cond.notify_all()
+                self._shed("queue wait deadline passed")
+            self._cond.wait(remaining)
+        heapq.heappop(self._waiting)
+        self._active += 1
+        self._cond.notify_all()
+
+
+def controller_from_env(name, concurrency, queue):
+    """Controller sized by ADMISSION_<NAME>_CONCURRENCY / _QUEUE and ADMISSION_QUEUE_TIMEOUT"""
+    prefix = f"ADMISSION_{name.upper()}"
+    return AdmissionController(
+        name,
+        concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency))),
+        queue=int(os.getenv(f"{prefix}_QUEUE", str(queue))),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2")),
+    )
@@ -1,13 +1,35 @@
 import os
-import csv
+import hmac
+import time
+import uuid
 import requests
-import ipaddress
+import click
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort
+from flask import Response, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from pagination import keyset_page, page_size
+from user_export import UserCsvExporter
+from password_hashing import hashing_pool, needs_rehash, HashingBusy
+from db_config import database_config, configure_engine, run_with_busy_retry, replica_reads, RoutingSession
+import bulk_export
+import bulk_import
+from batch_api import parse_batch, wants_stream, batch_response
+from intent_router import IntentRouter
+from metrics import metrics
+from ip_allowlist import IPAllowlist
+from admission import Overloaded, controller_from_env
+from rate_limit import limiter_from_env
+import progressive
+from job_queue import JobQueue
+from query_normalizer import normalize as normalize_query
+from conversation_memory import ConversationMemory, MEMORY_TTL
+from shared_state import SQLiteStore
+from query_log import QueryLogger
 try:
-    from evaluate_different_modules import process_query5,process_query2,process_query4,process_query,process_query3
+    from evaluate_different_modules import process_query5,process_query2,process_query4,process_query,process_query3,process_query_batch
+    from evaluate_different_modules import GEMINI_READY, triage_summary
     ADVANCED_MODULES_AVAILABLE = True
 except ImportError as e:
     print(f"Warning: Advanced modules not available: {e}")
@@ -23,7 +45,7 @@ except ImportError:
 
 # Define safe stubs to satisfy linters and ensure symbols exist
 if not ADVANCED_MODULES_AVAILABLE:
-    def process_query5(query, symptoms=None):
+    def process_query5(query, symptoms=None, intent=None, history=None):
         return None
     def process_query2(query, symptoms=None):
         return None
@@ -33,6 +55,9 @@ if not ADVANCED_MODULES_AVAILABLE:
         return None
     def process_query3(query, symptoms=None):
         return None
+    def process_query_batch(items):
+        return [None for _ in items]
+    GEMINI_READY = False
 
 if not FAQ_AVAILABLE:
     def get_simple_faq_response(query):
@@ -46,32 +71,63 @@ except ImportError:
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-fallback-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///docify.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# DATABASE_URL, plus DATABASE_REPLICA_URL for read routing
+app.config.update(database_config())
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+
+# Reverse proxies in front of the app; only then is X-Forwarded-For trusted, and
+# only the entries those proxies added
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '0'))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+# Sends greetings, out-of-scope and platform FAQ queries to cheap tiers
+intent_router = IntentRouter()
+
+# Per-session chat history, kept server-side and expired when idle; the SQLite
+# file is shared by all worker processes, so a turn may land on any of them
+chat_state_path = os.getenv('CHAT_STATE_DB') or os.path.join(app.instance_path, 'chat_state.db')
+conversation_memory = ConversationMemory(store=SQLiteStore(chat_state_path, 'conversations', ttl=MEMORY_TTL))
+
+# Chat queries, written to query_dataset.csv in batches by a background thread
+query_logger = QueryLogger()
+
+# Bounded concurrency and a short wait queue per model-backed tier
+admission = {
+    'llm': controller_from_env('llm', concurrency=4, queue=8),
+    'retrieval': controller_from_env('retrieval', concurrency=8, queue=16),
+}
+# "degrade" answers overflow with a keyword FAQ reply, "reject" with 503
+ADMISSION_OVERLOAD_MODE = os.getenv('ADMISSION_OVERLOAD_MODE', 'degrade')
+BUSY_REPLY = "The assistant is busy right now. Please try again in a moment."
+
+# LLM answers computed after a quick retrieval/FAQ reply has been sent; results
+# go to the shared chat state file so a poll can reach any worker
+progressive_answers = progressive.ProgressiveAnswers(
+    store=SQLiteStore(chat_state_path, 'progressive_results', ttl=progressive.RESULT_TTL))
+PENDING_REPLY = "Let me look into that for you..."
 
 # Configure allowed IP addresses/CIDR ranges
 ALLOWED_IPS = os.getenv('ALLOWED_IPS', '127.0.0.1/32').split(',')
+# Compiled once; ALLOWED_IPS_FILE entries are added and reloaded when the file changes
+ip_allowlist = IPAllowlist(ALLOWED_IPS, path=os.getenv('ALLOWED_IPS_FILE') or None)
 
 def is_ip_allowed(ip_address):
     """Check if the IP address is in the allowed list"""
-    try:
-        client_ip = ipaddress.ip_address(ip_address)
-        for allowed_range in ALLOWED_IPS:
-            if client_ip in ipaddress.ip_network(allowed_range, strict=False):
-                return True
-        return False
-    except ValueError:
-        return False
+    # ALLOWED_IPS may be reassigned at runtime; recompile when that happens
+    if ip_allowlist.static_entries is not ALLOWED_IPS:
+        ip_allowlist.set_static(ALLOWED_IPS)
+    return ip_allowlist.allows(ip_address)
+
+def get_client_ip():
+    """Client IP; behind TRUSTED_PROXIES proxies, ProxyFix has already taken it from X-Forwarded-For"""
+    return request.remote_addr
 
 @app.before_request
 def limit_remote_addr():
     """Middleware to check IP address before processing requests"""
-    # Get client IP (handle proxy headers if behind load balancer)
-    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-    if client_ip:
-        # If behind proxy, get the first IP
-        client_ip = client_ip.split(',')[0].strip()
+    client_ip = get_client_ip()
     
     # Skip IP check for health check endpoints (optional)
     if request.endpoint in ['health', 'status']:
@@ -81,12 +137,53 @@ def limit_remote_addr():
         abort(403)  # Forbidden
 
 
+# Token buckets per client: RATE_LIMIT_CHATBOT / RATE_LIMIT_LOGIN / RATE_LIMIT_LOGIN_ACCOUNT ("30/minute", or "off").
+# RATE_LIMIT_CHATBOT_BATCH counts batch items rather than requests.
+rate_limiter = limiter_from_env({'chatbot': '30/minute', 'chatbot_batch': '1000/minute', 'login': '10/minute',
+                                 'login_account': '5/minute'})
+
+@app.before_request
+def limit_request_rate():
+    """Answer 429 when this client has used up its requests for the route"""
+    if request.method != 'POST' or request.endpoint not in ('chatbot', 'chatbot_batch', 'login'):
+        return
+    # Signed-in chat users get their own bucket; everyone else shares their IP's
+    if request.endpoint in ('chatbot', 'chatbot_batch') and 'user_id' in session:
+        client = f"user:{session['user_id']}"
+    else:
+        client = f"ip:{get_client_ip()}"
+    cost = 1
+    if request.endpoint == 'chatbot_batch':
+        items = (request.get_json(silent=True) or {}).get('items') if request.is_json else None
+        cost = max(1, len(items)) if isinstance(items, list) else 1
+    retry_after = rate_limiter.retry_after(request.endpoint, client, cost)
+    if request.endpoint == 'login' and not retry_after:
+        # Repeated guesses at one account from one IP; keyed on the IP too, so
+        # nobody else can lock the owner out by failing logins from elsewhere
+        email = request.form.get('email', '').strip().lower()
+        if email:
+            retry_after = rate_limiter.retry_after('login_account', f"account:{email}|{client}")
+    if retry_after:
+        headers = {'Retry-After': str(retry_after)}
+        if request.endpoint == 'chatbot':
+            return jsonify({"reply": "You are sending messages too quickly. Please wait a moment."}), 429, headers
+        if request.endpoint == 'chatbot_batch':
+            return jsonify({"error": "Too many batch items, please try again later."}), 429, headers
+        return "Too many sign-in attempts, please try again later.", 429, headers
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Simple health check endpoint"""
     return jsonify(status="ok"), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Routing decisions, timings and backend counters of this worker process"""
+    return jsonify(metrics.snapshot()), 200
+
+
 # Database Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -100,30 +197,99 @@ class Consultation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     symptoms = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     user = db.relationship('User', backref=db.backref('consultations', lazy=True))
 
+    # Serves "latest consultation of a user"; SQLite appends the rowid (id) to every index entry
+    __table_args__ = (db.Index('ix_consultation_user_created', 'user_id', 'created_at'),)
+
+
+class TriageSummary(db.Model):
+    """Chatbot triage summary of a consultation, written by a background job"""
+    consultation_id = db.Column(db.Integer, db.ForeignKey('consultation.id'), primary_key=True)
+    summary = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 
 # Initialize Database
 with app.app_context():
+    for engine in db.engines.values():
+        configure_engine(engine)
     db.create_all()
+    # create_all() skips indexes of tables that already exist
+    for index in Consultation.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+
+# Latest symptoms per user for the chatbot; written through by consultation writes.
+# Entries are [symptoms] so "no consultation yet" can be cached as [None]. Kept in the
+# shared chat state file, so a write in one worker is seen by all of them.
+latest_symptoms_cache = SQLiteStore(chat_state_path, 'latest_symptoms', ttl=int(os.getenv('LATEST_SYMPTOMS_TTL', '60')))
+
+# Consultations shown per dashboard page
+DASHBOARD_PAGE_SIZE = page_size(os.getenv('DASHBOARD_PAGE_SIZE', '20'))
+
 
+def get_latest_symptoms(user_id):
+    cached = latest_symptoms_cache.get(str(user_id))
+    if cached is None:
+        with replica_reads():
+            latest_consultation = Consultation.query.filter_by(user_id=user_id).order_by(
+                Consultation.created_at.desc()).first()
+        cached = [latest_consultation.symptoms if latest_consultation else None]
+        latest_symptoms_cache.set(str(user_id), cached)
+    return cached[0]
 
-# Export User Details to CSV
-def export_users_to_csv():
-    users = User.query.all()
-    with open('users.csv', 'w', newline='') as csvfile:
-        fieldnames = ['id', 'name', 'phone', 'email']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for user in users:
-            writer.writerow({
-                'id': user.id,
-                'name': user.name,
-                'phone': user.phone,
-                'email': user.email
 
-            })
+# Export User Details to CSV, incrementally and in the background
+def load_users_after(last_id, limit):
+    with app.app_context():
+        users = User.query.filter(User.id > last_id).order_by(User.id).limit(limit).all()
+        return [{'id': u.id, 'name': u.name, 'phone': u.phone, 'email': u.email} for u in users]
+
+
+user_exporter = UserCsvExporter(os.getenv('USERS_CSV_PATH', 'users.csv'), load_users_after)
+
+
+# Work derived from consultation writes, run after the response by background threads.
+# Jobs are kept in their own SQLite file so they survive restarts.
+job_queue = JobQueue(os.getenv('JOB_QUEUE_DB') or os.path.join(app.instance_path, 'jobs.db'))
+
+
+@app.before_request
+def start_job_workers():
+    """Start this worker process's job threads, which also pick up jobs left from before a restart"""
+    job_queue.start()
+
+
+def enqueue_triage_summary(consultation_id):
+    """Queue a triage summary; without an LLM backend there is nothing worth precomputing"""
+    if ADVANCED_MODULES_AVAILABLE and GEMINI_READY:
+        job_queue.enqueue('triage_summary', {'consultation_id': consultation_id})
+
+
+@job_queue.register('triage_summary')
+def triage_summary_job(payload):
+    """Precompute the triage summary of a new or edited consultation"""
+    if not (ADVANCED_MODULES_AVAILABLE and GEMINI_READY):
+        return
+    with app.app_context():
+        consultation = db.session.get(Consultation, payload['consultation_id'])
+        if consultation is None:
+            return
+        symptoms = consultation.symptoms
+        # Overloaded and Gemini errors propagate, and the job is retried later
+        with admission['llm'].admit():
+            summary = triage_summary(symptoms)
+        if not summary or not summary.strip():
+            raise RuntimeError("empty triage summary")
+
+        def save_summary():
+            db.session.merge(TriageSummary(consultation_id=consultation.id, summary=summary.strip(),
+                                           created_at=datetime.utcnow()))
+            db.session.commit()
+
+        run_with_busy_retry(db.session, save_summary)
 
 
 # Routes
@@ -139,30 +305,54 @@ def register():
         phone = request.form['phone']
         email = request.form['email']
         password = request.form['password']
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
 
         existing_user = User.query.filter_by(email=email).first()
         if existing_user:
             flash('Email already registered.', 'error')
             return redirect(url_for('register'))
+        hashed_password = hashing_pool.hash(password)
 
-        new_user = User(name=name, phone=phone, email=email, password=hashed_password)
-        db.session.add(new_user)
-        db.session.commit()
-        export_users_to_csv()
+        def save_user():
+            db.session.add(User(name=name, phone=phone, email=email, password=hashed_password))
+            db.session.commit()
+
+        run_with_busy_retry(db.session, save_user)
+        user_exporter.notify()
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
 
 
+def rehash_password(user, password):
+    """Upgrade a hash made with old parameters; the login succeeds either way"""
+    try:
+        hashed_password = hashing_pool.hash(password)
+    except HashingBusy:
+        return
+
+    def save_hash():
+        user.password = hashed_password
+        db.session.commit()
+
+    run_with_busy_retry(db.session, save_hash)
+
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    return "Too many sign-ins right now, please try again in a moment.", 503, {'Retry-After': '2'}
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
-        user = User.query.filter_by(email=email).first()
+        with replica_reads():
+            user = User.query.filter_by(email=email).first()
 
-        if user and check_password_hash(user.password, password):
+        if user and hashing_pool.verify(user.password, password):
+            if needs_rehash(user.password):
+                rehash_password(user, password)
             session['user_id'] = user.id
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard'))
@@ -185,17 +375,58 @@ def dashboard():
         flash('Please log in to access the dashboard.', 'error')
         return redirect(url_for('login'))
 
-    user = User.query.get(session['user_id'])
+    with replica_reads():
+        user = User.query.get(session['user_id'])
     if request.method == 'POST':
         symptoms = request.form['symptoms']
+
         consultation = Consultation(user_id=user.id, symptoms=symptoms)
-        db.session.add(consultation)
-        db.session.commit()
+
+        def save_consultation():
+            db.session.add(consultation)
+            db.session.commit()
+
+        run_with_busy_retry(db.session, save_consultation)
+        latest_symptoms_cache.set(str(user.id), [symptoms])
+        enqueue_triage_summary(consultation.id)
         flash('Consultation form submitted successfully!', 'success')
         return redirect(url_for('dashboard'))
 
-    consultations = Consultation.query.filter_by(user_id=user.id).all()
-    return render_template('dash.html', user=user, consultations=consultations)
+    try:
+        with replica_reads():
+            consultations, next_cursor = keyset_page(Consultation.query.filter_by(user_id=user.id), Consultation,
+                                                     DASHBOARD_PAGE_SIZE, request.args.get('cursor'))
+    except ValueError:
+        return redirect(url_for('dashboard'))
+    return render_template('dash.html', user=user, consultations=consultations, next_cursor=next_cursor)
+
+
+@app.route('/api/consultations')
+def api_consultations():
+    """The user's consultations, newest first, one cursor page at a time"""
+    if 'user_id' not in session:
+        return jsonify({"error": "Please log in."}), 401
+    try:
+        with replica_reads():
+            consultations, next_cursor = keyset_page(Consultation.query.filter_by(user_id=session['user_id']),
+                                                     Consultation, page_size(request.args.get('limit')),
+                                                     request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with replica_reads():
+        summaries = dict(db.session.query(TriageSummary.consultation_id, TriageSummary.summary).filter(
+            TriageSummary.consultation_id.in_([c.id for c in consultations])).all())
+    response = jsonify({
+        "items": [{"id": c.id, "symptoms": c.symptoms, "created_at": c.created_at.isoformat() if c.created_at else None,
+                   "triage_summary": summaries.get(c.id)}
+                  for c in consultations],
+        "next_cursor": next_cursor,
+    })
+    # Unchanged pages are answered with 304 Not Modified
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 
 @app.route('/update_consultation/<int:id>', methods=['GET', 'POST'])
@@ -210,15 +441,87 @@ def update_consultation(id):
         return redirect(url_for('dashboard'))
 
     if request.method == 'POST':
-        consultation.symptoms = request.form['symptoms']
-        consultation.created_at = datetime.utcnow()
-        db.session.commit()
+        def save_update():
+            consultation.symptoms = request.form['symptoms']
+            consultation.created_at = datetime.utcnow()
+            db.session.commit()
+
+        run_with_busy_retry(db.session, save_update)
+        # The edited consultation is now the newest one
+        latest_symptoms_cache.set(str(consultation.user_id), [consultation.symptoms])
+        enqueue_triage_summary(consultation.id)
         flash('Consultation updated successfully!', 'success')
         return redirect(url_for('dashboard'))
 
     return render_template('update_consultation.html', consultation=consultation)
 
 
+# Columns streamed by /admin/export and `flask export`; password hashes are never exported
+EXPORT_TABLES = {
+    'users': (User.id, User.name, User.phone, User.email),
+    'consultations': (Consultation.id, Consultation.user_id, Consultation.symptoms, Consultation.created_at),
+}
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+
+@app.route('/admin/export/<table>')
+def admin_export(table):
+    """Stream a whole table as CSV or NDJSON (?format=ndjson), gzipped with ?gzip=1"""
+    token = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        abort(403)
+    if table not in EXPORT_TABLES:
+        abort(404)
+    fmt = request.args.get('format', 'csv')
+    if fmt not in bulk_export.FORMATS:
+        return jsonify({"error": f"format must be one of {sorted(bulk_export.FORMATS)}"}), 400
+    compress = request.args.get('gzip') == '1'
+
+    body = bulk_export.export(db.session, EXPORT_TABLES[table], fmt, compress)
+    response = Response(stream_with_context(body),
+                        mimetype='application/gzip' if compress else bulk_export.FORMATS[fmt])
+    filename = f"{table}.{fmt}" + ('.gz' if compress else '')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(sorted(EXPORT_TABLES)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(bulk_export.FORMATS)), default='csv')
+@click.option('--output', '-o', required=True, help='File to write; a .gz suffix gzips it.')
+def export_command(table, fmt, output):
+    """Stream TABLE to a CSV or NDJSON file."""
+    partial = output + '.partial'
+    with open(partial, 'wb') as f:
+        for data in bulk_export.export(db.session, EXPORT_TABLES[table], fmt, output.endswith('.gz')):
+            f.write(data)
+    os.replace(partial, output)
+    click.echo(f"Exported {table} to {output}")
+
+
+@app.cli.command('import')
+@click.argument('table', type=click.Choice(['users', 'consultations']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=bulk_import.BATCH_SIZE, show_default=True)
+@click.option('--workers', default=bulk_import.HASH_WORKERS, show_default=True, help='Password hashing processes.')
+def import_command(table, path, batch_size, workers):
+    """Bulk-load users or consultations from a CSV file; rerun to resume."""
+    def progress(stats):
+        click.echo(f"{stats['resumed_at'] + stats['read']} rows: {stats['inserted']} inserted, "
+                   f"{stats['skipped']} skipped ({stats['rows_per_second']:.0f} rows/s)")
+
+    try:
+        if table == 'users':
+            stats = bulk_import.import_users(db.session, User.__table__, path, batch_size, workers, progress)
+            user_exporter.flush()
+        else:
+            stats = bulk_import.import_consultations(db.session, User.__table__, Consultation.__table__, path,
+                                                     batch_size, progress)
+    except bulk_import.ImportFileError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Imported {stats['inserted']} {table}, skipped {stats['skipped']}.")
+
+
 @app.route('/faq')
 def faq():
     return render_template('faq.html')
@@ -228,51 +531,135 @@ def faq():
 @app.route('/chatbot', methods=['POST'])
 def chatbot():
 
+    started = time.perf_counter()
     data = request.json
-    query = data.get('message')
-    print("user query=",query)
-    if not query:
+    raw_query = data.get('message')
+    print("user query=",raw_query)
+    if not raw_query:
         return jsonify({"reply": "Please provide a message."}), 400
-    try:
-        with open("query_dataset.csv", "a") as file:
-            file.write(query + "\n")
-    except Exception as e:
-        print(f"Error while writing to file: {e}")
+    # Folded, typo-corrected form for routing and FAQ keys; the models get the user's own words
+    query = raw_query.strip()
+    intent_key = normalize_query(query)
     # Get latest symptoms from user's consultations
     if 'user_id' in session:
-        latest_consultation = Consultation.query.filter_by(user_id=session['user_id']).order_by(
-            Consultation.created_at.desc()).first()
-        symptoms = latest_consultation.symptoms if latest_consultation else None
+        symptoms = get_latest_symptoms(session['user_id'])
     else:
         symptoms = None
 
 
+    # Server-side history for this browser session, bounded to a token budget
+    conversation_id = session.setdefault('conversation_id', uuid.uuid4().hex)
+    history = conversation_memory.history(conversation_id)
+
+    priority = 'user_id' in session
+    route = intent_router.route(intent_key, llm_available=GEMINI_READY)
+    if route[1] == "llm" and ADVANCED_MODULES_AVAILABLE and progressive.wants_progressive(request, data):
+        return progressive_chat(raw_query, query, symptoms, history, priority, route, conversation_id, started)
+
+    try:
+        reply = answer_chat(query, symptoms, history, priority=priority, route=route)
+    except Overloaded as e:
+        return jsonify({"reply": BUSY_REPLY}), 503, {'Retry-After': str(e.retry_after)}
+    conversation_memory.add_turn(conversation_id, query, reply)
+    query_logger.log(raw_query, session.get('user_id'), time.perf_counter() - started)
+    return jsonify({"reply": reply})
+
+
+def progressive_chat(raw_query, query, symptoms, history, priority, route, conversation_id, started):
+    """Reply with the quick local answer now and compute the LLM answer in the background"""
+    quick = quick_answer(query, symptoms, priority)
+
+    def refine():
+        try:
+            final = answer_chat(query, symptoms, history, priority=priority, route=route)
+        except Overloaded:
+            final = quick
+        conversation_memory.add_turn(conversation_id, query, final)
+        return final
+
+    request_id = progressive_answers.submit(conversation_id, refine, fallback=quick)
+    # Logged with the latency the user sees, up to the quick reply
+    query_logger.log(raw_query, session.get('user_id'), time.perf_counter() - started)
+    if progressive.wants_stream(request):
+        return Response(progressive_answers.stream(request_id, quick), mimetype="application/x-ndjson")
+    return jsonify({"reply": quick, "request_id": request_id, "pending": True}), 202
+
+
+def quick_answer(query, symptoms=None, priority=False):
+    """Best answer available without the LLM: retrieval, else the FAQ reply"""
     try:
-        # Try advanced chatbot function first
+        with admission['retrieval'].admit(priority=priority):
+            response = process_query(query, symptoms)
+        if response and response.strip():
+            return response
+    except Overloaded:
+        metrics.incr("admission.degraded")
+    except Exception as e:
+        print(f"Error in quick answer: {e}")
+    return (get_simple_faq_response(normalize_query(query)) if FAQ_AVAILABLE else None) or PENDING_REPLY
+
+
+@app.route('/chatbot/result/<request_id>')
+def chatbot_result(request_id):
+    """The LLM answer of a progressive /chatbot request, once it is ready"""
+    found, done, reply = progressive_answers.result(request_id, session.get('conversation_id'))
+    if not found:
+        return jsonify({"error": "Unknown or expired request id."}), 404
+    if not done:
+        return jsonify({"request_id": request_id, "pending": True}), 202, {'Retry-After': '1'}
+    return jsonify({"request_id": request_id, "reply": reply, "pending": False})
+
+
+def answer_chat(query, symptoms=None, history=None, priority=False, route=None):
+    """Answer query from the cheapest capable tier, falling back to FAQ replies
+
+    route is the (category, tier, intent) decision when the caller already routed the query.
+    Raises Overloaded when the tier is saturated and ADMISSION_OVERLOAD_MODE is "reject".
+    """
+    # Keyword lookups use the normalized form; the backends get query as the user wrote it
+    intent_key = normalize_query(query)
+    try:
+        # Route to the cheapest tier that can answer the query
+        if route is None:
+            route = intent_router.route(intent_key, llm_available=GEMINI_READY)
+        category, tier, intent = route
+        if tier in ("canned", "faq"):
+            return intent["response"]
+
         if ADVANCED_MODULES_AVAILABLE:
-            response = process_query5(query, symptoms)
+            try:
+                with admission[tier].admit(priority=priority):
+                    if tier == "llm":
+                        response = process_query5(query, symptoms, intent=category, history=history)
+                    else:
+                        response = process_query(query, symptoms)
+            except Overloaded:
+                if ADMISSION_OVERLOAD_MODE == 'reject':
+                    raise
+                metrics.incr("admission.degraded")
+                return get_simple_faq_response(intent_key) if FAQ_AVAILABLE else BUSY_REPLY
             print("Chatbot response:", response)
             
             # Check if response is valid
             if response and response.strip():
-                return jsonify({"reply": response})
+                return response
         
         # Fall back to simple FAQ responses
         if FAQ_AVAILABLE:
-            response = get_simple_faq_response(query)
-            return jsonify({"reply": response})
+            return get_simple_faq_response(intent_key)
         else:
             # Last resort fallback
-            return jsonify({"reply": "I'm sorry, I couldn't generate a response. Please try asking about Docify Online services."})
+            return "I'm sorry, I couldn't generate a response. Please try asking about Docify Online services."
             
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error in chatbot endpoint: {e}")
         
         # Try FAQ fallback
         if FAQ_AVAILABLE:
             try:
-                response = get_simple_faq_response(query)
-                return jsonify({"reply": response})
+                return get_simple_faq_response(intent_key)
             except Exception as e2:
                 print(f"Error in FAQ fallback: {e2}")
         
@@ -286,8 +673,36 @@ def chatbot():
         
         What would you like to know about Docify Online?
         """
-        return jsonify({"reply": fallback_response.strip()})
+        return fallback_response.strip()
+
+
+@app.route('/chatbot/batch', methods=['POST'])
+def chatbot_batch():
+    """Retrieval-only answers for many queries; NDJSON-streamed for large batches"""
+    items, error = parse_batch(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+
+    priority = 'user_id' in session
+
+    def answer_chunk(chunk):
+        # Each chunk takes a retrieval slot like a chat request; a streamed response cannot
+        # switch to 503 half way, so a saturated tier degrades the chunk to FAQ replies
+        try:
+            with admission['retrieval'].admit(priority=priority):
+                replies = process_query_batch(chunk)
+        except Overloaded:
+            metrics.incr("admission.degraded")
+            replies = [None if FAQ_AVAILABLE else BUSY_REPLY] * len(chunk)
+        if FAQ_AVAILABLE:
+            replies = [reply or get_simple_faq_response(normalize_query(item["message"]))
+                       for item, reply in zip(chunk, replies)]
+        return replies
+
+    return batch_response(items, answer_chunk, wants_stream(request, items))
 
 
 if __name__ == '__main__':
+    # Fork the hashing processes now, before any request thread exists
+    hashing_pool.start()
     app.run(host='0.0.0.0', debug=False, port=5000)
@@ -1,16 +1,61 @@
 import os
-import csv
 import requests
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from pagination import keyset_page, page_size
+from user_export import UserCsvExporter
+from password_hashing import hashing_pool, needs_rehash, HashingBusy
+from db_config import database_config, configure_engine, run_with_busy_retry, replica_reads, RoutingSession
+from retrieval_client import RetrievalClient, RetrievalServiceBusy
+from rate_limit import limiter_from_env
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///docify.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# DATABASE_URL, plus DATABASE_REPLICA_URL for read routing
+app.config.update(database_config())
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+
+# Reverse proxies in front of the app; only then is X-Forwarded-For trusted, and
+# only the entries those proxies added
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '0'))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+# Shared, pooled client for the chatbot service on port 5003
+retrieval_client = RetrievalClient()
+
+# Consultations shown per dashboard page
+DASHBOARD_PAGE_SIZE = page_size(os.getenv('DASHBOARD_PAGE_SIZE', '20'))
+
+# Token buckets per client: RATE_LIMIT_CHATBOT / RATE_LIMIT_LOGIN / RATE_LIMIT_LOGIN_ACCOUNT ("30/minute", or "off")
+rate_limiter = limiter_from_env({'chatbot': '30/minute', 'login': '10/minute', 'login_account': '5/minute'})
+
+
+@app.before_request
+def limit_request_rate():
+    """Answer 429 when this client has used up its requests for the route"""
+    if request.method != 'POST' or request.endpoint not in ('chatbot', 'login'):
+        return
+    # Signed-in chat users get their own bucket; everyone else shares their IP's
+    if request.endpoint == 'chatbot' and 'user_id' in session:
+        client = f"user:{session['user_id']}"
+    else:
+        client = f"ip:{request.remote_addr}"
+    retry_after = rate_limiter.retry_after(request.endpoint, client)
+    if request.endpoint == 'login' and not retry_after:
+        # Repeated guesses at one account from one IP; keyed on the IP too, so
+        # nobody else can lock the owner out by failing logins from elsewhere
+        email = request.form.get('email', '').strip().lower()
+        if email:
+            retry_after = rate_limiter.retry_after('login_account', f"account:{email}|{client}")
+    if retry_after:
+        headers = {'Retry-After': str(retry_after)}
+        if request.endpoint == 'chatbot':
+            return jsonify({"reply": "You are sending messages too quickly. Please wait a moment."}), 429, headers
+        return "Too many sign-in attempts, please try again later.", 429, headers
 
 
 # Database Models
@@ -26,29 +71,31 @@ class Consultation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     symptoms = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     user = db.relationship('User', backref=db.backref('consultations', lazy=True))
 
+    # Serves "latest consultation of a user"; SQLite appends the rowid (id) to every index entry
+    __table_args__ = (db.Index('ix_consultation_user_created', 'user_id', 'created_at'),)
+
 
 # Initialize Database
 with app.app_context():
+    for engine in db.engines.values():
+        configure_engine(engine)
     db.create_all()
+    # create_all() skips indexes of tables that already exist
+    for index in Consultation.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
 
+# Export User Details to CSV, incrementally and in the background
+def load_users_after(last_id, limit):
+    with app.app_context():
+        users = User.query.filter(User.id > last_id).order_by(User.id).limit(limit).all()
+        return [{'id': u.id, 'name': u.name, 'phone': u.phone, 'email': u.email} for u in users]
 
-# Export User Details to CSV
-def export_users_to_csv():
-    users = User.query.all()
-    with open('users.csv', 'w', newline='') as csvfile:
-        fieldnames = ['id', 'name', 'phone', 'email']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for user in users:
-            writer.writerow({
-                'id': user.id,
-                'name': user.name,
-                'phone': user.phone,
-                'email': user.email
-            })
+
+user_exporter = UserCsvExporter(os.getenv('USERS_CSV_PATH', 'users.csv'), load_users_after)
 
 
 # Routes
@@ -64,30 +111,54 @@ def register():
         phone = request.form['phone']
         email = request.form['email']
         password = request.form['password']
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
 
         existing_user = User.query.filter_by(email=email).first()
         if existing_user:
             flash('Email already registered.', 'error')
             return redirect(url_for('register'))
+        hashed_password = hashing_pool.hash(password)
 
-        new_user = User(name=name, phone=phone, email=email, password=hashed_password)
-        db.session.add(new_user)
-        db.session.commit()
-        export_users_to_csv()
+        def save_user():
+            db.session.add(User(name=name, phone=phone, email=email, password=hashed_password))
+            db.session.commit()
+
+        run_with_busy_retry(db.session, save_user)
+        user_exporter.notify()
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
 
 
+def rehash_password(user, password):
+    """Upgrade a hash made with old parameters; the login succeeds either way"""
+    try:
+        hashed_password = hashing_pool.hash(password)
+    except HashingBusy:
+        return
+
+    def save_hash():
+        user.password = hashed_password
+        db.session.commit()
+
+    run_with_busy_retry(db.session, save_hash)
+
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    return "Too many sign-ins right now, please try again in a moment.", 503, {'Retry-After': '2'}
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
-        user = User.query.filter_by(email=email).first()
+        with replica_reads():
+            user = User.query.filter_by(email=email).first()
 
-        if user and check_password_hash(user.password, password):
+        if user and hashing_pool.verify(user.password, password):
+            if needs_rehash(user.password):
+                rehash_password(user, password)
             session['user_id'] = user.id
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard'))
@@ -110,17 +181,26 @@ def dashboard():
         flash('Please log in to access the dashboard.', 'error')
         return redirect(url_for('login'))
 
-    user = User.query.get(session['user_id'])
+    with replica_reads():
+        user = User.query.get(session['user_id'])
     if request.method == 'POST':
         symptoms = request.form['symptoms']
-        consultation = Consultation(user_id=user.id, symptoms=symptoms)
-        db.session.add(consultation)
-        db.session.commit()
+
+        def save_consultation():
+            db.session.add(Consultation(user_id=user.id, symptoms=symptoms))
+            db.session.commit()
+
+        run_with_busy_retry(db.session, save_consultation)
         flash('Consultation form submitted successfully!', 'success')
         return redirect(url_for('dashboard'))
 
-    consultations = Consultation.query.filter_by(user_id=user.id).all()
-    return render_template('dash.html', user=user, consultations=consultations)
+    try:
+        with replica_reads():
+            consultations, next_cursor = keyset_page(Consultation.query.filter_by(user_id=user.id), Consultation,
+                                                     DASHBOARD_PAGE_SIZE, request.args.get('cursor'))
+    except ValueError:
+        return redirect(url_for('dashboard'))
+    return render_template('dash.html', user=user, consultations=consultations, next_cursor=next_cursor)
 
 
 @app.route('/update_consultation/<int:id>', methods=['GET', 'POST'])
@@ -135,9 +215,12 @@ def update_consultation(id):
         return redirect(url_for('dashboard'))
 
     if request.method == 'POST':
-        consultation.symptoms = request.form['symptoms']
-        consultation.created_at = datetime.utcnow()
-        db.session.commit()
+        def save_update():
+            consultation.symptoms = request.form['symptoms']
+            consultation.created_at = datetime.utcnow()
+            db.session.commit()
+
+        run_with_busy_retry(db.session, save_update)
         flash('Consultation updated successfully!', 'success')
         return redirect(url_for('dashboard'))
 
@@ -159,24 +242,24 @@ def chatbot():
 
     # Get latest symptoms from user's consultations
     if 'user_id' in session:
-        latest_consultation = Consultation.query.filter_by(user_id=session['user_id']).order_by(
-            Consultation.created_at.desc()).first()
+        with replica_reads():
+            latest_consultation = Consultation.query.filter_by(user_id=session['user_id']).order_by(
+                Consultation.created_at.desc()).first()
         symptoms = latest_consultation.symptoms if latest_consultation else None
     else:
         symptoms = None
 
     try:
         # Forward request to chatbot service
-        response = requests.post(
-            'http://127.0.0.1:5003/chatbot',
-            json={"message": user_message, "symptoms": symptoms}
-        )
-        print(response)
-        response_data = response.json()
+        response_data = retrieval_client.chat(user_message, symptoms)
         return jsonify(response_data)
+    except RetrievalServiceBusy:
+        return jsonify({"reply": "The chatbot is busy right now. Please try again in a moment."}), 503
     except requests.RequestException:
         return jsonify({"reply": "Error connecting to chatbot service."}), 500
 
 
 if __name__ == '__main__':
+    # Fork the hashing processes now, before any request thread exists
+    hashing_pool.start()
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+Per-process background worker for work that should not run on the request path.
+
+The daemon thread is started on first use in each process, not at import
+time: gunicorn's ``preload_app`` imports the app in the master and forks the
+workers afterwards, and threads do not survive a fork.
+"""
+import atexit
+import os
+import threading
+
+
+class BackgroundWorker:
+    """Runs task() when woken, and at least every interval seconds"""
+
+    def __init__(self, task, interval, name):
+        self.task = task
+        self.interval = interval
+        self.name = name
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        atexit.register(self.stop)
+
+    def start(self):
+        """Start the thread in this process, if it is not running yet"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Events inherited through a fork may hold the parent's state
+                self._wake, self._stop = threading.Event(), threading.Event()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            # Read before running so a stop() during the run still gets a final run
+            stopping = self._stop.is_set()
+            self.run_once()
+            if stopping:
+                return
+
+    def run_once(self):
+        try:
+            self.task()
+        except Exception as e:
+            print(f"Warning: background task {self.name} failed: {e}")
+
+    def wake(self):
+        """Ask the worker to run task() soon"""
+        self.start()
+        self._wake.set()
+
+    def stop(self):
+        """Stop the thread; it runs task() once more so nothing pending is lost at exit"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=10)
+        self._pid = None
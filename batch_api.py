@@ -0,0 +1,61 @@
+"""
+Shared request parsing and response streaming for the /chatbot/batch endpoints.
+
+A batch is ``{"items": [{"message": ..., "symptoms": ...}, ...]}``. Items are
+answered in chunks so embedding and retrieval run vectorized per chunk, and
+large batches are streamed back as NDJSON while later chunks are still running.
+"""
+import json
+import os
+
+from flask import Response, jsonify, stream_with_context
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "64"))
+BATCH_STREAM_THRESHOLD = int(os.getenv("BATCH_STREAM_THRESHOLD", "100"))
+
+
+def parse_batch(data):
+    """Validate a batch body; returns (items, error message)"""
+    items = (data or {}).get("items")
+    if not isinstance(items, list) or not items:
+        return None, "Please provide a non-empty 'items' list."
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, f"A batch can hold at most {BATCH_MAX_ITEMS} items."
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("message"), str) or not item["message"].strip():
+            return None, "Every item needs a non-empty string 'message'."
+        if item.get("symptoms") is not None and not isinstance(item["symptoms"], str):
+            return None, "'symptoms' must be a string."
+        parsed.append({"message": item["message"], "symptoms": item.get("symptoms")})
+    return parsed, None
+
+
+def wants_stream(request, items):
+    if "stream" in request.args:
+        return request.args.get("stream") not in ("0", "false")
+    if "application/x-ndjson" in request.headers.get("Accept", ""):
+        return True
+    return len(items) > BATCH_STREAM_THRESHOLD
+
+
+def batch_response(items, answer_chunk, stream):
+    """Answer items chunk by chunk with answer_chunk(list of items) -> list of replies"""
+    def chunks():
+        for start in range(0, len(items), BATCH_CHUNK_SIZE):
+            chunk = items[start:start + BATCH_CHUNK_SIZE]
+            yield start, answer_chunk(chunk)
+
+    if not stream:
+        replies = []
+        for _, chunk_replies in chunks():
+            replies.extend(chunk_replies)
+        return jsonify({"replies": replies})
+
+    def generate():
+        for start, chunk_replies in chunks():
+            for offset, reply in enumerate(chunk_replies):
+                yield json.dumps({"index": start + offset, "reply": reply}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
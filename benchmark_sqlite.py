@@ -0,0 +1,98 @@
+"""
+Concurrency benchmark for the SQLite profile in db_config.py.
+
+Runs writer threads (insert + commit, like /register and /dashboard POST)
+next to reader threads (latest-consultation lookups, like /chatbot) against
+a fresh database file, once with SQLAlchemy defaults and once with the
+production profile, and prints throughput and lock errors for both.
+
+    python benchmark_sqlite.py --writers 4 --readers 8 --seconds 5
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from db_config import engine_options, configure_engine, is_busy_error
+
+SCHEMA = (
+    "CREATE TABLE consultation (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+    "symptoms TEXT NOT NULL, created_at REAL NOT NULL)",
+    "CREATE INDEX ix_consultation_user_created ON consultation (user_id, created_at)",
+)
+USERS = 200
+
+
+def _worker(engine, write, stop, counts, index):
+    ops = errors = 0
+    n = index
+    while not stop.is_set():
+        n += 1
+        try:
+            if write:
+                with engine.begin() as conn:
+                    conn.execute(text("INSERT INTO consultation (user_id, symptoms, created_at) "
+                                      "VALUES (:u, :s, :t)"),
+                                 {"u": n % USERS, "s": f"symptoms {n}", "t": time.time()})
+            else:
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT symptoms FROM consultation WHERE user_id = :u "
+                                      "ORDER BY created_at DESC LIMIT 1"), {"u": n % USERS}).fetchall()
+            ops += 1
+        except OperationalError as e:
+            if not is_busy_error(e):
+                raise
+            errors += 1
+    counts.append((write, ops, errors))
+
+
+def run(profile, writers, readers, seconds):
+    directory = tempfile.mkdtemp(prefix="docify-bench-")
+    uri = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    if profile == "tuned":
+        engine = create_engine(uri, **engine_options(uri))
+        configure_engine(engine)
+    else:
+        engine = create_engine(uri, connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(text(statement))
+
+    stop, counts = threading.Event(), []
+    threads = [threading.Thread(target=_worker, args=(engine, i < writers, stop, counts, i))
+               for i in range(writers + readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    engine.dispose()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    result = {"profile": profile}
+    for kind, write in (("write", True), ("read", False)):
+        result[f"{kind}s/s"] = sum(ops for w, ops, _ in counts if w is write) / seconds
+        result[f"{kind} lock errors"] = sum(errors for w, _, errors in counts if w is write)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args(argv)
+    for profile in ("default", "tuned"):
+        r = run(profile, args.writers, args.readers, args.seconds)
+        print(f"{r['profile']:>8}: {r['writes/s']:8.0f} writes/s ({r['write lock errors']} locked)  "
+              f"{r['reads/s']:8.0f} reads/s ({r['read lock errors']} locked)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Bulk import of users and consultations from CSV files (``flask import``).
+
+Rows are read in batches of ``IMPORT_BATCH_SIZE``. Each batch is written
+with a single executemany INSERT and one commit. Users are de-duplicated by
+email in memory: the existing emails are read once from the unique email
+index, and emails seen earlier in the file are skipped too. Plain-text
+passwords are hashed in a process pool, and the next batch is hashed while
+the current one is being inserted. Rows that already carry a werkzeug
+``password_hash`` skip hashing.
+
+Each batch commits together with the number of input rows handled so far,
+stored in the ``import_checkpoint`` table under the file's path. A rerun
+after an interruption therefore continues right after the last committed
+batch, never inserting a batch twice. The checkpoint is removed once the
+file is fully imported.
+"""
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, select
+
+from password_hashing import hash_password
+
+BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "2000"))
+HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+USER_COLUMNS = ("name", "phone", "email")
+CONSULTATION_COLUMNS = ("email", "symptoms")
+# Prefixes of werkzeug hashes that can be stored as they are
+HASH_PREFIXES = ("pbkdf2:", "scrypt:")
+
+checkpoint_table = Table(
+    "import_checkpoint", MetaData(),
+    Column("source", String(1024), primary_key=True),
+    Column("rows_done", Integer, nullable=False),
+)
+
+
+class ImportFileError(ValueError):
+    """The input file is missing columns the import needs"""
+
+
+class Checkpoint:
+    """Rows of a source file already imported, kept in the target database"""
+
+    def __init__(self, session, source_path):
+        self.session = session
+        self.source = os.path.abspath(source_path)
+        checkpoint_table.create(session.get_bind(), checkfirst=True)
+
+    def load(self):
+        rows_done = self.session.execute(select(checkpoint_table.c.rows_done).where(
+            checkpoint_table.c.source == self.source)).scalar()
+        return rows_done or 0
+
+    def save(self, rows_done):
+        """Stage the new position; it is written by the caller's next commit"""
+        self.session.execute(delete(checkpoint_table).where(checkpoint_table.c.source == self.source))
+        self.session.execute(checkpoint_table.insert(), {"source": self.source, "rows_done": rows_done})
+
+    def clear(self):
+        self.session.execute(delete(checkpoint_table).where(checkpoint_table.c.source == self.source))
+        self.session.commit()
+
+
+def read_batches(path, required, batch_size, skip=0):
+    """Lists of up to batch_size CSV row dicts, after the first skip rows"""
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in required if column not in (reader.fieldnames or ())]
+        if missing:
+            raise ImportFileError(f"{path} is missing columns: {', '.join(missing)}")
+        batch = []
+        for index, row in enumerate(reader):
+            if index < skip:
+                continue
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _run(session, table, path, required, prepare, batch_size, progress):
+    """Shared batch loop: prepare(batch) returns a callable giving the rows to insert"""
+    checkpoint = Checkpoint(session, path)
+    rows_done = checkpoint.load()
+    stats = {"read": 0, "inserted": 0, "skipped": 0, "resumed_at": rows_done}
+    started = time.monotonic()
+
+    def finish(batch, pending):
+        nonlocal rows_done
+        rows = pending()
+        if rows:
+            session.execute(table.insert(), rows)
+        rows_done += len(batch)
+        # Same transaction as the rows: a crash cannot leave them without the checkpoint
+        checkpoint.save(rows_done)
+        session.commit()
+        stats["read"] += len(batch)
+        stats["inserted"] += len(rows)
+        stats["skipped"] += len(batch) - len(rows)
+        stats["rows_per_second"] = stats["read"] / max(time.monotonic() - started, 1e-9)
+        progress(stats)
+
+    # Prepare batch N+1 (e.g. start hashing it) before inserting batch N
+    previous = None
+    for batch in read_batches(path, required, batch_size, rows_done):
+        pending = prepare(batch)
+        if previous:
+            finish(*previous)
+        previous = (batch, pending)
+    if previous:
+        finish(*previous)
+    checkpoint.clear()
+    return stats
+
+
+def import_users(session, user_table, path, batch_size=BATCH_SIZE, workers=HASH_WORKERS, progress=lambda stats: None):
+    """Import a CSV with name, phone, email and password (or password_hash) columns"""
+    # Full scan of the unique email index, once
+    known_emails = set(session.execute(select(user_table.c.email)).scalars())
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        def prepare(batch):
+            rows, plain = [], []
+            for row in batch:
+                email = (row.get("email") or "").strip()
+                password_hash = (row.get("password_hash") or "").strip()
+                password = row.get("password") or ""
+                # Without a werkzeug hash (none, or e.g. bcrypt) the row needs a plain password to hash
+                if not email or email in known_emails or not (password or password_hash.startswith(HASH_PREFIXES)):
+                    continue
+                known_emails.add(email)
+                user = {"name": (row.get("name") or "").strip(), "phone": (row.get("phone") or "").strip(),
+                        "email": email, "password": password_hash}
+                if not password_hash.startswith(HASH_PREFIXES):
+                    plain.append((user, password))
+                rows.append(user)
+            chunksize = max(1, len(plain) // (workers * 4))
+            hashes = pool.map(hash_password, [password for _, password in plain], chunksize=chunksize)
+
+            def rows_to_insert():
+                for (user, _), hashed in zip(plain, hashes):
+                    user["password"] = hashed
+                return rows
+
+            return rows_to_insert
+
+        return _run(session, user_table, path, USER_COLUMNS, prepare, batch_size, progress)
+
+
+def import_consultations(session, user_table, consultation_table, path, batch_size=BATCH_SIZE,
+                         progress=lambda stats: None):
+    """Import a CSV with email, symptoms and optional ISO created_at columns"""
+    user_ids = dict(session.execute(select(user_table.c.email, user_table.c.id)).all())
+
+    def prepare(batch):
+        rows = []
+        for row in batch:
+            user_id = user_ids.get((row.get("email") or "").strip())
+            symptoms = (row.get("symptoms") or "").strip()
+            if user_id is None or not symptoms:
+                continue
+            try:
+                created_at = datetime.fromisoformat(row["created_at"]) if row.get("created_at") else datetime.utcnow()
+            except ValueError:
+                continue
+            rows.append({"user_id": user_id, "symptoms": symptoms, "created_at": created_at})
+        return lambda: rows
+
+    return _run(session, consultation_table, path, CONSULTATION_COLUMNS, prepare, batch_size, progress)
@@ -1,4 +1,5 @@
 import os
+import time
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
 from flask import Flask, request, jsonify
@@ -9,6 +10,7 @@ from langchain.chains import RetrievalQA
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, pipeline
 import torch
+from prompt_builder import build_prompt
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -327,85 +329,62 @@ qa_chain = RetrievalQA.from_chain_type(
 )
 
 
-# Step 5: Process Query and Generate Structured Response
-def process_query(user_query, symptoms=None):
-    # Retrieve relevant FAQ documents
-    context = qa_chain({"query": user_query,"Symptoms":symptoms})['result']
-
-    # Construct prompt with symptoms (if provided) and FAQ context
-    prompt = f"""
-    You are a medical chatbot for Docify Online. Answer the user's query in a structured, clear, and concise manner.
-    Use the following FAQ context to inform your response:
-    {context}
-
-    User Query: {user_query}
-    """
-    if symptoms:
-        prompt += f"\nUser Symptoms: {symptoms}\nPlease incorporate the symptoms into your response if relevant."
-
-    prompt += """
-    Provide the response in the following format:
-    **Answer**: [Your answer here]
-    **Additional Info**: [Any relevant details or suggestions]
-    """
-
-    # Generate response
-    response = text2text_pipeline(prompt)[0]["generated_text"]
-    print(response)
-    return response
-# Step 3: Initialize Small LLM (google/flan-t5-small)
-model_name = "google/flan-t5-small"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-text2text_pipeline = pipeline(
-    "text2text-generation",
-    model=model,
-    tokenizer=tokenizer,
-    max_length=200,
-    device=-1  # CPU
-)
+INSTRUCTIONS = """You are a medical chatbot for Docify Online. Answer the user's query in a structured, clear, and concise manner.
+Use the FAQ context to inform your response and incorporate the user's symptoms if relevant.
+Provide the response in the following format:
+**Answer**: [Your answer here]
+**Additional Info**: [Any relevant details or suggestions]"""
 
-llm = HuggingFacePipeline(pipeline=text2text_pipeline)
 
-# Step 4: RAG Setup with LangChain
-retriever = vector_store.as_retriever(search_kwargs={"k": 3})
-print(retriever)
-qa_chain = RetrievalQA.from_chain_type(
-    llm=llm,
-    chain_type="stuff",
-    retriever=retriever,
-    return_source_documents=True
-)
+def count_model_tokens(text):
+    return len(tokenizer.encode(text))
+
+
+# "single" retrieves and generates once; "two_pass" is the old RetrievalQA answer
+# fed into a second generation; "compare" runs both, logs them and returns single
+RAG_MODE = os.getenv("RAG_MODE", "single")
+
+
+def generate_single_pass(user_query, symptoms=None):
+    scored_docs = vector_store.similarity_search_with_score(user_query, k=5)
+    prompt = build_prompt(INSTRUCTIONS, user_query, scored_docs, "flan_t5",
+                          symptoms=symptoms, count=count_model_tokens)
+    return text2text_pipeline(prompt)[0]["generated_text"]
+
+
+def generate_two_pass(user_query, symptoms=None):
+    # First generation: RetrievalQA answers from the retrieved FAQ documents
+    context = qa_chain({"query": user_query, "Symptoms": symptoms})['result']
+    # Second generation over that answer
+    prompt = build_prompt(INSTRUCTIONS, user_query, [(context, 0.0)], "flan_t5",
+                          symptoms=symptoms, count=count_model_tokens)
+    return text2text_pipeline(prompt)[0]["generated_text"]
 
 
 # Step 5: Process Query and Generate Structured Response
-def process_query3(user_query, symptoms=None):
-    # Retrieve relevant FAQ documents
-    context = qa_chain({"query": user_query,"Symptoms":symptoms})['result']
-
-    # Construct prompt with symptoms (if provided) and FAQ context
-    prompt = f"""
-    You are a medical chatbot for Docify Online. Answer the user's query in a structured, clear, and concise manner.
-    Use the following FAQ context to inform your response:
-    {context}
-
-    User Query: {user_query}
-    """
-    if symptoms:
-        prompt += f"\nUser Symptoms: {symptoms}\nPlease incorporate the symptoms into your response if relevant."
-
-    prompt += """
-    Provide the response in the following format:
-    **Answer**: [Your answer here]
-    **Additional Info**: [Any relevant details or suggestions]
-    """
-
-    # Generate response
-    response = text2text_pipeline(prompt)[0]["generated_text"]
+def process_query(user_query, symptoms=None, mode=None):
+    mode = mode or RAG_MODE
+    if mode == "two_pass":
+        response = generate_two_pass(user_query, symptoms)
+    elif mode == "compare":
+        started = time.perf_counter()
+        response = generate_single_pass(user_query, symptoms)
+        single_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        two_pass_response = generate_two_pass(user_query, symptoms)
+        two_pass_seconds = time.perf_counter() - started
+        print(f"[rag compare] single {single_seconds:.2f}s: {response}")
+        print(f"[rag compare] two_pass {two_pass_seconds:.2f}s: {two_pass_response}")
+    else:
+        response = generate_single_pass(user_query, symptoms)
     print(response)
     return response
 
 
+def process_query3(user_query, symptoms=None):
+    return process_query(user_query, symptoms, mode="two_pass")
+
+
 # Flask Route for Chatbot
 @app.route('/chatbot', methods=['POST'])
 def chatbot():
@@ -416,7 +395,7 @@ def chatbot():
     if not user_query:
         return jsonify({"reply": "Please provide a query."}), 400
 
-    response = process_query(user_query, symptoms)
+    response = process_query(user_query, symptoms, mode=data.get('rag_mode'))
     if response is None:
         return jsonify("hello how are you please ask a relevant query regarding the site")
     return jsonify({"reply": response})
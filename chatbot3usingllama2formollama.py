@@ -1,5 +1,5 @@
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_ollama import OllamaLLM
@@ -7,6 +7,8 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from langchain.chains import StuffDocumentsChain
+from ollama_coustomllm import get_ollama_client, OllamaBusy
+from prompt_builder import build_prompt
 
 
 # Suppress TensorFlow and duplicate library issues
@@ -57,6 +59,7 @@ retriever = vector_store.as_retriever(search_kwargs={"k": 3})
 
 # ======== LLM & Prompt Setup ========
 llm = OllamaLLM(model="docify", base_url="http://localhost:11434")
+ollama_client = get_ollama_client()
 
 prompt_template = PromptTemplate(
     input_variables=["context", "question", "symptoms_section"],
@@ -80,25 +83,24 @@ combine_documents_chain = StuffDocumentsChain(
     document_variable_name="context"
 )
 
+INSTRUCTIONS = (
+    "Answer the user's question based on the retrieved information. Give a short and summarized answer. "
+    "Do not recommend any medication; ask them to fill the form and consult a doctor."
+)
+
 # ======== Query Processor ========
 def process_query(user_query, symptoms=None):
-    # Prepare the symptoms section if provided
-    symptoms_section = f"User Symptoms: {symptoms}\nIncorporate these symptoms into your response if relevant." if symptoms else ""
-
-    # Retrieve the top 3 relevant documents
-    top_docs = retriever.get_relevant_documents(user_query)[:3]
+    # Retrieve candidates with scores; the prompt builder packs what fits the budget
+    scored_docs = vector_store.similarity_search_with_score(user_query, k=5)
 
     # Debug: Print the retrieved documents
     print("--- Retrieved Documents ---")
-    for i, doc in enumerate(top_docs):
-        print(f"Doc {i+1}: {doc.page_content}")
+    for i, (doc, score) in enumerate(scored_docs):
+        print(f"Doc {i+1} ({score:.3f}): {doc.page_content}")
         print("-" * 50)
 
-    # Pass the relevant documents to the chain for processing
-    from langchain.llms import Ollama
-    ollama = Ollama(base_url='http://localhost:11434', model="docify")
-    result=ollama(f"answer user query base on retrived information{user_query}+{top_docs} give short and summerized answer"
-                  f"do not recomand and medication ask them to fill the form and consult a doc")
+    # Generate with the shared, keep-alive Ollama client
+    result = ollama_client.generate(build_prompt(INSTRUCTIONS, user_query, scored_docs, "ollama", symptoms=symptoms))
     print(result)
     return result
 
@@ -113,7 +115,15 @@ def chatbot():
     if not user_query:
         return jsonify({"reply": "Please provide a query."}), 400
 
-    response = process_query(user_query, symptoms)
+    try:
+        if data.get('stream'):
+            scored_docs = vector_store.similarity_search_with_score(user_query, k=5)
+            # Takes the generation slot now, so a busy server answers 503 rather than a cut-off 200
+            tokens = ollama_client.stream(build_prompt(INSTRUCTIONS, user_query, scored_docs, "ollama", symptoms=symptoms))
+            return Response(tokens, mimetype='text/plain')
+        response = process_query(user_query, symptoms)
+    except OllamaBusy:
+        return jsonify({"reply": "The chatbot is busy right now. Please try again in a moment."}), 503
     return jsonify({"reply": response})
 
 # ======== Manual Evaluation ========
@@ -138,4 +148,8 @@ def manual_evaluation():
 if __name__ == '__main__':
     # Comment this out in production
     #manual_evaluation()
+    try:
+        ollama_client.warm_up()
+    except Exception as e:
+        print(f"Warning: could not preload the Ollama model: {e}")
     app.run(debug=True, port=5003)
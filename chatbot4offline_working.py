@@ -1,6 +1,7 @@
 import os
 from flask import Flask, request, jsonify
-from vector_creator import get_vector_store
+from vector_creator import get_vector_store, batch_similarity_search
+from batch_api import parse_batch, wants_stream, batch_response
 
 # Suppress TensorFlow and duplicate library issues
 os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
@@ -49,6 +50,25 @@ def chatbot():
     response = process_query(user_query, symptoms)
     return jsonify({"reply": response})
 
+
+@app.route('/chatbot/batch', methods=['POST'])
+def chatbot_batch():
+    items, error = parse_batch(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+
+    def answer_chunk(chunk):
+        results = batch_similarity_search(vector_store, [item["message"] for item in chunk], k=3)
+        replies = []
+        for scored_docs in results:
+            result = ""
+            for i, (doc, _) in enumerate(scored_docs):
+                result += f"Doc {i + 1}: {doc.page_content}\n" + "-" * 50 + "\n"
+            replies.append(result)
+        return replies
+
+    return batch_response(items, answer_chunk, wants_stream(request, items))
+
 # ======== Manual Evaluation ========
 def manual_evaluation():
     test_queries = [
@@ -0,0 +1,99 @@
+"""
+Server-side, per-session conversation memory for /chatbot.
+
+Each conversation keeps its last few turns verbatim. Turns that fall out of
+that window are compacted into a one-line-per-turn rolling summary, and the
+history handed to a backend is cut to a fixed token budget, so prompts stop
+growing with the conversation. Idle conversations expire.
+
+Conversations live in a ``shared_state`` store. The app uses a SQLite one, so
+every gunicorn worker sees the same history whichever worker served the
+previous turn.
+"""
+import os
+import re
+
+from prompt_builder import count_tokens
+from shared_state import MemoryStore
+
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "4"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "300"))
+MEMORY_TTL = int(os.getenv("MEMORY_TTL", "1800"))
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "10000"))
+
+# Longest stretch of one message kept in the verbatim history or the summary
+TURN_TOKEN_LIMIT = 60
+SUMMARY_TOKEN_LIMIT = 20
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def truncate_tokens(text, limit):
+    """Cut text to roughly limit tokens on a word boundary"""
+    words = " ".join(text.split()).split(" ")
+    kept, used = [], 0
+    for word in words:
+        used += count_tokens(word)
+        if used > limit:
+            return " ".join(kept) + " ..."
+        kept.append(word)
+    return " ".join(kept)
+
+
+class ConversationMemory:
+    def __init__(self, max_turns=MEMORY_MAX_TURNS, token_budget=MEMORY_TOKEN_BUDGET,
+                 ttl=MEMORY_TTL, max_sessions=MEMORY_MAX_SESSIONS, store=None):
+        """store defaults to an in-process MemoryStore; pass a SQLiteStore to share between workers"""
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        # The summary alone can never exceed the token budget
+        self.max_topics = max(1, token_budget // (SUMMARY_TOKEN_LIMIT + 2))
+        self.store = store if store is not None else MemoryStore(maxsize=max_sessions, ttl=ttl)
+
+    def add_turn(self, session_id, user_message, reply):
+        def append(conversation):
+            conversation = conversation or {"turns": [], "summary": []}
+            turns, summary = conversation["turns"], conversation["summary"]
+            if len(turns) >= self.max_turns:
+                oldest_user, _ = turns.pop(0)
+                first_sentence = SENTENCE_END.split(oldest_user.strip(), 1)[0]
+                summary.append(truncate_tokens(first_sentence, SUMMARY_TOKEN_LIMIT))
+                del summary[:-self.max_topics]
+            turns.append([user_message, reply])
+            return conversation
+
+        # Read-modify-write in one step, and the write refreshes the TTL
+        self.store.update(session_id, append)
+
+    def history(self, session_id):
+        """Summary plus the newest turns that fit the token budget, oldest first"""
+        conversation = self.store.get(session_id)
+        if conversation is None:
+            return ""
+        turns = conversation["turns"]
+        summary = conversation["summary"]
+
+        lines, used = [], 0
+        for user_message, reply in reversed(turns):
+            turn = (f"User: {truncate_tokens(user_message, TURN_TOKEN_LIMIT)}\n"
+                    f"Assistant: {truncate_tokens(reply, TURN_TOKEN_LIMIT)}")
+            cost = count_tokens(turn)
+            if used + cost > self.token_budget:
+                break
+            lines.insert(0, turn)
+            used += cost
+
+        # Rolling summary gets whatever budget is left, newest topics first
+        topics = []
+        for topic in reversed(summary):
+            cost = count_tokens(topic) + 1
+            if used + cost > self.token_budget:
+                break
+            topics.insert(0, topic)
+            used += cost
+        if topics:
+            lines.insert(0, "Earlier the user asked about: " + "; ".join(topics))
+        return "\n".join(lines)
+
+    def clear(self, session_id):
+        self.store.pop(session_id)
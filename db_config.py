@@ -0,0 +1,161 @@
+"""
+Database configuration and performance profile shared by app.py and app2.py.
+
+The primary database comes from ``DATABASE_URL`` (default
+``sqlite:///docify.db``). If ``DATABASE_REPLICA_URL`` is set it is registered
+as the ``replica`` bind, and reads wrapped in ``use_replica()`` are sent there
+by ``RoutingSession``; everything else, and any read in a session that has
+already written, goes to the primary. ``replica_reads()`` also keeps a
+browser session on the primary for a few seconds after it wrote, so users
+see their own changes despite replication lag.
+
+For SQLite every new connection is switched to WAL with synchronous=NORMAL,
+a memory-mapped read path, a larger page cache and a busy timeout. Readers
+then no longer block the writer and vice versa, and a writer waits for the
+lock instead of failing at once. Writes that still hit "database is locked"
+are retried with jittered backoff by ``run_with_busy_retry``.
+"""
+import contextlib
+import contextvars
+import os
+import random
+import time
+
+from flask import has_request_context, session as browser_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///docify.db")
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+REPLICA_BIND = "replica"
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("mmap_size", int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))),
+    ("cache_size", -int(os.getenv("SQLITE_CACHE_KB", "65536"))),  # negative = KiB
+    ("busy_timeout", BUSY_TIMEOUT_MS),
+)
+
+WRITE_RETRIES = int(os.getenv("DB_WRITE_RETRIES", "5"))
+WRITE_RETRY_BACKOFF = float(os.getenv("DB_WRITE_RETRY_BACKOFF", "0.05"))
+
+
+def normalize_url(url):
+    # Heroku-style URLs use a scheme SQLAlchemy 1.4+ no longer accepts
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for multi-threaded workers"""
+    options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "3600")),
+        "pool_pre_ping": True,
+    }
+    if uri.startswith("sqlite"):
+        # Pooled connections move between request threads
+        options["connect_args"] = {"timeout": BUSY_TIMEOUT_MS / 1000, "check_same_thread": False}
+        if ":memory:" in uri or uri.rstrip("/") == "sqlite:":
+            # In-memory databases cannot be pooled across connections
+            options = {"connect_args": options["connect_args"]}
+    return options
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def configure_engine(engine):
+    """Apply the SQLite pragmas to every new connection of engine"""
+    if engine.dialect.name == "sqlite" and not event.contains(engine, "connect", apply_sqlite_pragmas):
+        event.listen(engine, "connect", apply_sqlite_pragmas)
+        # Connections opened before the listener existed are dropped and reopened
+        engine.dispose()
+
+
+def is_busy_error(error):
+    message = str(getattr(error, "orig", error)).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+def run_with_busy_retry(session, work, retries=WRITE_RETRIES, backoff=WRITE_RETRY_BACKOFF):
+    """Run work() (which must redo the whole write, commit included) until it is not locked out"""
+    for attempt in range(retries + 1):
+        try:
+            return work()
+        except OperationalError as e:
+            session.rollback()
+            if attempt == retries or not is_busy_error(e):
+                raise
+            time.sleep(random.uniform(0, backoff * (2 ** attempt)))
+
+
+def database_config(primary=None, replica=None):
+    """Flask config for the primary database and the optional read replica"""
+    primary = normalize_url(primary or DATABASE_URL)
+    replica = normalize_url(replica if replica is not None else DATABASE_REPLICA_URL)
+    config = {
+        "SQLALCHEMY_DATABASE_URI": primary,
+        "SQLALCHEMY_ENGINE_OPTIONS": engine_options(primary),
+        "SQLALCHEMY_BINDS": {},
+    }
+    if replica:
+        config["SQLALCHEMY_BINDS"][REPLICA_BIND] = dict(engine_options(replica), url=replica)
+    return config
+
+
+_replica_reads = contextvars.ContextVar("replica_reads", default=False)
+
+
+@contextlib.contextmanager
+def use_replica(enabled=True):
+    """Send reads made inside the block to the replica, if one is configured"""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_reads():
+    """use_replica() unless the current browser session wrote in the last few seconds"""
+    last_write_at = browser_session.get("last_write_at", 0) if has_request_context() else 0
+    return use_replica(time.time() - last_write_at > READ_YOUR_WRITES_SECONDS)
+
+
+class RoutingSession(Session):
+    """Session that reads from the replica inside use_replica() until it writes"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        engines = self._db.engines
+        if (bind is None and _replica_reads.get() and REPLICA_BIND in engines
+                and engine is engines.get(None) and not self._flushing and not self.info.get("wrote")):
+            return engines[REPLICA_BIND]
+        return engine
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_written(session, flush_context):
+    # The replica may not have this session's writes yet
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _remember_write(session):
+    if session.info.get("wrote") and has_request_context():
+        browser_session["last_write_at"] = time.time()
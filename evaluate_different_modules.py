@@ -1,10 +1,12 @@
 import os
+import time
+import functools
 os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
 # Try to import dependencies with error handling
 try:
-    from vector_creator import get_vector_store
+    from vector_creator import get_vector_store, batch_similarity_search
     VECTOR_STORE_AVAILABLE = True
 except ImportError as e:
     print(f"Warning: Vector store not available: {e}")
@@ -49,9 +51,18 @@ except ImportError as e:
     print(f"Warning: python-dotenv not available: {e}")
     DOTENV_AVAILABLE = False
 
+from ollama_coustomllm import get_ollama_client
+from gemini_client import get_gemini_backend
+from prompt_builder import build_prompt
+from intent_matcher import KeywordIntentMatcher
+from faq_intents import FAQ_INTENTS, DEFAULT_REPLY
+
 # Try to get API key from multiple environment variable names
 api_key = os.getenv("API_KEY") or os.getenv("GOOGLE_API_KEY")
 
+# Whether process_query5 can actually reach Gemini instead of falling back
+GEMINI_READY = bool(GENAI_AVAILABLE and api_key and api_key.strip() and api_key != 'your_actual_google_api_key_here')
+
 if api_key and GENAI_AVAILABLE:
     genai.configure(api_key=api_key)
     print(f"Google API configured with key: {api_key[:10]}...")
@@ -70,93 +81,45 @@ if VECTOR_STORE_AVAILABLE:
         print("Vector store initialized successfully")
     except Exception as e:
         print(f"Error initializing vector store: {e}")
+        vector_store = None
         retriever = None
 else:
     print("Vector store not available, using simple FAQ responses only")
+    vector_store = None
     retriever = None
 
+# ======== Prompt Instructions ========
+GEMINI_INSTRUCTIONS = (
+    "You are a chatbot for Docify. Answer questions about the FAQ in as few words as possible. "
+    "Docify is an online platform that allows users to consult certified doctors from the comfort of their home, "
+    "whether it's a minor health concern or the need for a medical certificate. "
+    "Users may ask irrelevant questions; do not answer them. "
+    "Do not provide any medical consultation from your side. "
+    "Strictly follow the context provided to you."
+)
+
+# Triage notes precomputed for a consultation; these replace GEMINI_INSTRUCTIONS, whose
+# "no medical consultation" rule contradicts what a triage note is for
+TRIAGE_INSTRUCTIONS = (
+    "You write short triage notes for the Docify doctors who review consultation forms. "
+    "From the patient's symptoms, list the likely causes, how urgent the case looks and sensible next steps. "
+    "Do not recommend medication. Use the context provided to you where it is relevant."
+)
+TRIAGE_QUESTION = "Write the triage note for these symptoms."
+
+OLLAMA_INSTRUCTIONS = (
+    "Answer the user's question based on the retrieved information. Give a short and summarized answer. "
+    "Do not recommend any medication; ask them to fill the form and consult a doctor."
+)
+
 # ======== Simple FAQ Response Function ========
+FAQ_MATCHER = KeywordIntentMatcher(FAQ_INTENTS)
+
+
 def get_simple_faq_response(user_query):
     """Simple FAQ responses that don't require AI API"""
-    query_lower = user_query.lower()
-    
-    if "fever" in query_lower or "temperature" in query_lower or "hot" in query_lower:
-        return """I understand you have a fever. Here's some general guidance:
-
-🌡️ **For fever management:**
-- Stay hydrated with plenty of fluids
-- Rest and avoid strenuous activities
-- Monitor your temperature regularly
-- Consider over-the-counter fever reducers if appropriate
-
-⚠️ **When to seek medical attention:**
-- Fever above 103°F (39.4°C)
-- Fever lasting more than 3 days
-- Severe symptoms like difficulty breathing
-- Signs of dehydration
-
-📋 **Next steps:**
-Please fill out a consultation form on your dashboard with your specific symptoms so our doctors can provide proper medical advice. We cannot provide specific medical treatment through this chat."""
-    
-    elif "docify" in query_lower or "what is" in query_lower:
-        return """Docify Online is a platform for filling out medical certificates and consultation forms, with support from our chatbot. 
-        
-We connect you with qualified healthcare professionals 24/7 for medical consultations from the comfort of your home."""
-    
-    elif "submit" in query_lower or "consultation" in query_lower or "form" in query_lower:
-        return """To submit a consultation form:
-1. Log in to your account
-2. Go to the dashboard
-3. Fill out the form with your symptoms
-4. You can also update past submissions anytime"""
-    
-    elif "secure" in query_lower or "data" in query_lower or "privacy" in query_lower:
-        return """Yes, your data is secure! We use password hashing and store data securely in our database. 
-        User details are also exported to CSV files for backup purposes."""
-    
-    elif "support" in query_lower or "contact" in query_lower or "help" in query_lower:
-        return """You can reach our support team via:
-- This chatbot for immediate assistance
-- Email at support@docify.online
-- Through your dashboard consultation form"""
-    
-    elif "symptoms" in query_lower:
-        return """When describing symptoms, please include:
-- Detailed description of what you're experiencing
-- Duration (how long you've had the symptoms)
-- Severity level
-- Any relevant medical history"""
-    
-    elif any(greeting in query_lower for greeting in ["hi", "hello", "hey", "good morning", "good afternoon", "good evening"]):
-        return """Hello! Welcome to Docify Online. I'm here to help you with information about our medical consultation services. 
-        
-What would you like to know about our platform?"""
-    
-    elif any(health_term in query_lower for health_term in ["pain", "headache", "cough", "cold", "sick", "unwell", "symptoms"]):
-        return """I understand you're experiencing health concerns. While I can provide general information about Docify Online's services, I cannot provide specific medical advice.
-
-🏥 **For medical concerns:**
-Please fill out a consultation form on your dashboard with your specific symptoms. Our qualified doctors will review your case and provide appropriate medical guidance.
-
-📋 **How to get help:**
-1. Go to your dashboard
-2. Click "Submit Consultation Form"
-3. Describe your symptoms in detail
-4. Our medical team will respond promptly
-
-This ensures you receive proper medical attention from qualified healthcare professionals."""
-    
-    else:
-        return """I'm here to help with questions about Docify Online. You can ask me about:
-- Our medical consultation services
-- How to submit consultation forms
-- Data security and privacy
-- Contact information
-- Platform features
-
-For medical concerns, please fill out a consultation form on your dashboard to speak with qualified doctors.
-
-What would you like to know?"""
+    intent = FAQ_MATCHER.match(user_query)
+    return intent["response"] if intent else DEFAULT_REPLY
 
 # ======== Query Processor Function ========
 def process_query(user_query, symptoms=None):
@@ -169,33 +132,61 @@ def process_query(user_query, symptoms=None):
         symptoms_section = f"User Symptoms: {symptoms}\nIncorporate these symptoms into your response if relevant." if symptoms else ""
         top_docs = retriever.invoke(user_query)[:3]  # Fixed deprecated method
 
-        result = ""
-        for i, doc in enumerate(top_docs):
-            doc_text = f"Doc {i + 1}: {doc.page_content}\n" + "-" * 50 + "\n"
-            result += doc_text
+        result = format_docs(top_docs)
         print(result)
         return result if result.strip() else get_simple_faq_response(user_query)
     except Exception as e:
         print(f"Error in process_query: {e}")
         return get_simple_faq_response(user_query)
-def process_query2(user_query, symptoms=None):
-    # Prepare the symptoms section if provided
-    symptoms_section = f"User Symptoms: {symptoms}\nIncorporate these symptoms into your response if relevant." if symptoms else ""
 
-    # Retrieve the top 3 relevant documents
-    top_docs = retriever.get_relevant_documents(user_query)[:3]
+
+def retrieve_scored(user_query, k=5):
+    """(Document, L2 distance) pairs for the prompt builder; empty without a vector store"""
+    if vector_store is None:
+        return []
+    return vector_store.similarity_search_with_score(user_query, k=k)
+
+
+def format_docs(top_docs):
+    result = ""
+    for i, doc in enumerate(top_docs):
+        result += f"Doc {i + 1}: {doc.page_content}\n" + "-" * 50 + "\n"
+    return result
+
+
+def process_query_batch(items):
+    """Retrieval-only answers for many {message, symptoms} items, in order
+
+    All messages are embedded in one model call and searched with one FAISS
+    matrix query instead of one round trip per message.
+    """
+    queries = [item["message"] for item in items]
+    if vector_store is None:
+        return [get_simple_faq_response(query) for query in queries]
+    try:
+        results = batch_similarity_search(vector_store, queries, k=3)
+    except Exception as e:
+        print(f"Error in process_query_batch: {e}")
+        return [get_simple_faq_response(query) for query in queries]
+
+    replies = []
+    for query, scored_docs in zip(queries, results):
+        result = format_docs([doc for doc, _ in scored_docs])
+        replies.append(result if result.strip() else get_simple_faq_response(query))
+    return replies
+def process_query2(user_query, symptoms=None):
+    # Retrieve candidates with scores; the prompt builder packs what fits the budget
+    scored_docs = retrieve_scored(user_query)
 
     # Debug: Print the retrieved documents
     print("--- Retrieved Documents ---")
-    for i, doc in enumerate(top_docs):
-        print(f"Doc {i+1}: {doc.page_content}")
+    for i, (doc, score) in enumerate(scored_docs):
+        print(f"Doc {i+1} ({score:.3f}): {doc.page_content}")
         print("-" * 50)
 
-    # Pass the relevant documents to the chain for processing
-    from langchain_community.llms import Ollama
-    ollama = Ollama(base_url='http://localhost:11434', model="docify")
-    result=ollama(f"answer user query base on retrived information{user_query}+{top_docs} give short and summerized answer"
-                  f"do not recomand and medication ask them to fill the form and consult a doc")
+    # Generate with the shared, keep-alive Ollama client
+    prompt = build_prompt(OLLAMA_INSTRUCTIONS, user_query, scored_docs, "ollama", symptoms=symptoms)
+    result = get_ollama_client().generate(prompt)
     print(result)
     return result
 # Optional: Manual evaluation function
@@ -243,14 +234,30 @@ def process_query3(user_query, symptoms=None):
         print("Model generation error:", e)
         return "Sorry, there was an error generating a response."
 
-# Process Query
-def process_query4(user_query, symptoms=None):
+# ======== Fine-tuned flan-t5 (process_query4) ========
+# "single" retrieves and generates once; "two_pass" is the old RetrievalQA answer
+# fed into a second generation; "compare" runs both, logs them and returns single
+RAG_MODE = os.getenv("RAG_MODE", "single")
+
+FLAN_T5_INSTRUCTIONS = """You are a medical chatbot for Docify Online. Answer the user's query in a structured, clear, and concise manner.
+Use the FAQ context to inform your response and incorporate the user's symptoms if relevant.
+Understand the question and situation of the person, then answer:
+**Answer**: [Your answer here]
+**Additional Info**: [Any relevant details or suggestions]
+Do not speculate or provide unverified medical advice."""
+
+
+@functools.lru_cache(maxsize=1)
+def load_finetuned_pipeline():
+    """Load the LoRA fine-tuned flan-t5 once per process instead of on every query"""
+    from peft import PeftModel
+
     model_name = "google/flan-t5-base"
     finetuned_path = "fine_tuning/lora_flan_t5_small/finetuned"
     tokenizer = AutoTokenizer.from_pretrained(finetuned_path)
     base_model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
     model = PeftModel.from_pretrained(base_model, finetuned_path)
-    text2text_pipeline = pipeline(
+    return pipeline(
         "text2text-generation",
         model=model,
         tokenizer=tokenizer,
@@ -258,100 +265,75 @@ def process_query4(user_query, symptoms=None):
         device=-1
     )
 
-    llm = HuggingFacePipeline(pipeline=text2text_pipeline)
 
-    # RAG Setup
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5})
-    print(retriever.metadata)
-    qa_chain = RetrievalQA.from_chain_type(
+@functools.lru_cache(maxsize=1)
+def load_finetuned_qa_chain():
+    """RetrievalQA over the fine-tuned model, only needed for the two-pass mode"""
+    llm = HuggingFacePipeline(pipeline=load_finetuned_pipeline())
+    return RetrievalQA.from_chain_type(
         llm=llm,
         chain_type="stuff",
-        retriever=retriever,
+        retriever=vector_store.as_retriever(search_kwargs={"k": 5}),
         return_source_documents=True
     )
 
-    context = qa_chain({"query": user_query})['result']
-    prompt = f"""
-    You are a medical chatbot for Docify Online. Answer the user's query in a structured, clear, and concise manner.
-    Use the following FAQ context to inform your response:
-    your role is to answer information about what to do in fever
-    {context}
 
-    User Query: {user_query}
-    """
-    if symptoms:
-        prompt += f"\nUser Symptoms: {symptoms}\nPlease incorporate the symptoms into your response if relevant."
-
-    prompt += """
-    understand the question and situation of a person then answer:
-    **Answer**: [Your answer here]
-    **Additional Info**: [Any relevant details or suggestions]
-    Do not speculate or provide unverified medical advice.
-    """
+def _generate_finetuned(user_query, scored_docs, symptoms):
+    text2text_pipeline = load_finetuned_pipeline()
+    prompt = build_prompt(FLAN_T5_INSTRUCTIONS, user_query, scored_docs, "flan_t5", symptoms=symptoms,
+                          count=lambda text: len(text2text_pipeline.tokenizer.encode(text)))
+    return text2text_pipeline(prompt)[0]["generated_text"]
 
-    response = text2text_pipeline(prompt)[0]["generated_text"]
+
+def process_query4(user_query, symptoms=None, mode=None):
+    mode = mode or RAG_MODE
+    if mode == "two_pass":
+        context = load_finetuned_qa_chain()({"query": user_query})['result']
+        return _generate_finetuned(user_query, [(context, 0.0)], symptoms)
+
+    started = time.perf_counter()
+    response = _generate_finetuned(user_query, retrieve_scored(user_query), symptoms)
+    if mode == "compare":
+        single_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        two_pass_response = process_query4(user_query, symptoms, mode="two_pass")
+        print(f"[rag compare] single {single_seconds:.2f}s: {response}")
+        print(f"[rag compare] two_pass {time.perf_counter() - started:.2f}s: {two_pass_response}")
     return response
 
-def process_query5(user_query, symptom=None):
+def process_query5(user_query, symptom=None, intent=None, history=None):
     """Enhanced query processor using Google Gemini with error handling"""
     try:
         # Check if API key is available and valid
         if not api_key or api_key.strip() == '' or api_key == 'your_actual_google_api_key_here':
             print("No valid Google API key available, falling back to simple FAQ response")
             return get_simple_faq_response(user_query)
-        
-        generation_config = {
-            "temperature": 1,
-            "top_p": 0.95,
-            "top_k": 64,
-            "max_output_tokens": 15000,
-            "response_mime_type": "text/plain",
-        }
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-            },
-        ]
-        model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash",
-            generation_config=generation_config,
-        )
-        # Generate summary using Gemini model
-        if retriever is not None:
-            top_docs = retriever.invoke(user_query)[:3]  # Use invoke instead of deprecated get_relevant_documents
-        else:
-            top_docs = []
-        
-        summary = model.generate_content(contents=(
-            f"U are a chatbot for docify answer in minmum words about the faq user ask "
-            f"Docify is an online platform that allows users to consult certified doctors from the comfort of their home. Whether it's a minor health concern or the need for a medical certificate"
-            f"now user can ask unreleveant question make sure not to answer them"
-            f"do not provide any medical consultation form your side"
-            f"strictly follow the context provide to you"
-            f"query={user_query},extracted_content={top_docs}"
-        ))
-
-        return summary.text
-    
+
+        # Generate summary using the shared Gemini backend
+        scored_docs = retrieve_scored(user_query)
+        prompt = build_prompt(GEMINI_INSTRUCTIONS, user_query, scored_docs, "gemini", symptoms=symptom,
+                              history=history)
+        return get_gemini_backend().generate(prompt, intent=intent)
+
     except Exception as e:
         print(f"Error with Google API: {e}")
         print("Falling back to simple FAQ response")
         return get_simple_faq_response(user_query)
 
 
+def triage_summary(symptoms):
+    """Gemini triage note for a consultation's symptoms
+
+    Unlike process_query5 there is no FAQ fallback: errors propagate, so a
+    background job can retry instead of storing an FAQ reply as the note.
+    """
+    if not GEMINI_READY:
+        raise RuntimeError("Gemini is not configured")
+    prompt = build_prompt(TRIAGE_INSTRUCTIONS, TRIAGE_QUESTION, retrieve_scored(symptoms), "gemini",
+                          symptoms=symptoms)
+    return get_gemini_backend().generate(prompt, intent="medical")
+
+
 def manual_evaluation():
     test_queries = [
         {"query": "How do I manage a fever?", "symptoms": "Fever for 2 days, 101°F"},
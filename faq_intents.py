@@ -0,0 +1,152 @@
+"""
+Declarative table of the keyword intents answered without any model.
+
+Order is priority: when a query matches several intents, the first listed
+wins. Phrases match whole words only (see intent_matcher.py). ``category``
+is what the intent router (intent_router.py) uses to pick a backend tier.
+
+Platform FAQ phrases must be specific to Docify. Generic ones such as "what
+is" or "help" also occur in medical questions ("what is the treatment for
+malaria", "my chest hurts, please help"), which would then get a canned
+platform reply instead of reaching the LLM.
+"""
+
+FAQ_INTENTS = [
+    {
+        "name": "fever",
+        "category": "medical",
+        "phrases": ["fever", "temperature", "hot"],
+        "response": """I understand you have a fever. Here's some general guidance:
+
+🌡️ **For fever management:**
+- Stay hydrated with plenty of fluids
+- Rest and avoid strenuous activities
+- Monitor your temperature regularly
+- Consider over-the-counter fever reducers if appropriate
+
+⚠️ **When to seek medical attention:**
+- Fever above 103°F (39.4°C)
+- Fever lasting more than 3 days
+- Severe symptoms like difficulty breathing
+- Signs of dehydration
+
+📋 **Next steps:**
+Please fill out a consultation form on your dashboard with your specific symptoms so our doctors can provide proper medical advice. We cannot provide specific medical treatment through this chat.""",
+    },
+    {
+        "name": "platform_overview",
+        "category": "platform_faq",
+        "phrases": ["docify", "this platform", "your platform", "this service", "your service",
+                    "this website", "your website", "this app", "your app"],
+        "response": """Docify Online is a platform for filling out medical certificates and consultation forms, with support from our chatbot. 
+        
+We connect you with qualified healthcare professionals 24/7 for medical consultations from the comfort of your home.""",
+    },
+    {
+        "name": "submit_consultation",
+        "category": "platform_faq",
+        "phrases": ["submit", "consultation", "consultations", "form", "forms"],
+        "response": """To submit a consultation form:
+1. Log in to your account
+2. Go to the dashboard
+3. Fill out the form with your symptoms
+4. You can also update past submissions anytime""",
+    },
+    {
+        "name": "data_security",
+        "category": "platform_faq",
+        "phrases": ["secure", "security", "privacy", "my data", "personal data", "data stored",
+                    "data safe", "encrypted", "encryption"],
+        "response": """Yes, your data is secure! We use password hashing and store data securely in our database. 
+        User details are also exported to CSV files for backup purposes.""",
+    },
+    {
+        "name": "contact_support",
+        "category": "platform_faq",
+        "phrases": ["support team", "customer support", "contact support", "support email", "customer service",
+                    "help desk", "helpdesk", "contact you", "contact us", "reach you", "contact docify"],
+        "response": """You can reach our support team via:
+- This chatbot for immediate assistance
+- Email at support@docify.online
+- Through your dashboard consultation form""",
+    },
+    {
+        "name": "describe_symptoms",
+        "category": "platform_faq",
+        "phrases": ["how to describe", "how do i describe", "how should i describe", "describing symptoms",
+                    "describing my symptoms", "what should i include"],
+        "response": """When describing symptoms, please include:
+- Detailed description of what you're experiencing
+- Duration (how long you've had the symptoms)
+- Severity level
+- Any relevant medical history""",
+    },
+    {
+        "name": "greeting",
+        "category": "greeting",
+        "phrases": ["hi", "hello", "hey", "good morning", "good afternoon", "good evening"],
+        "response": """Hello! Welcome to Docify Online. I'm here to help you with information about our medical consultation services. 
+        
+What would you like to know about our platform?""",
+    },
+    {
+        "name": "health_concern",
+        "category": "medical",
+        "phrases": ["pain", "headache", "cough", "cold", "sick", "unwell", "symptoms",
+                    "diabetes", "hypertension", "blood pressure", "asthma", "depression", "migraine",
+                    "arthritis", "tuberculosis", "pcos", "thyroid", "rash", "sore throat", "nausea",
+                    "vomiting", "dizziness", "infection", "injury"],
+        "response": """I understand you're experiencing health concerns. While I can provide general information about Docify Online's services, I cannot provide specific medical advice.
+
+🏥 **For medical concerns:**
+Please fill out a consultation form on your dashboard with your specific symptoms. Our qualified doctors will review your case and provide appropriate medical guidance.
+
+📋 **How to get help:**
+1. Go to your dashboard
+2. Click "Submit Consultation Form"
+3. Describe your symptoms in detail
+4. Our medical team will respond promptly
+
+This ensures you receive proper medical attention from qualified healthcare professionals.""",
+    },
+]
+
+OUT_OF_SCOPE_INTENT = {
+    "name": "out_of_scope",
+    "category": "out_of_scope",
+    "phrases": ["weather", "movie", "movies", "song", "songs", "lyrics", "cricket", "football", "recipe",
+                "stock", "stocks", "bitcoin", "crypto", "politics", "election", "joke", "jokes",
+                "homework", "programming", "code", "coding", "game", "games"],
+    "response": """I can only help with Docify Online and general health questions. You can ask me about:
+- Our medical consultation services
+- How to submit consultation forms
+- Data security and privacy
+- Contact information""",
+}
+
+# Routing priority differs from the reply priority above: medical terms first so
+# "hi, I have a cough" is not answered as a greeting, and greetings last.
+# describe_symptoms goes before health_concern, whose "symptoms" would shadow it;
+# its phrases are questions about the form, not about the symptoms themselves.
+ROUTING_ORDER = [
+    "fever",
+    "describe_symptoms",
+    "health_concern",
+    "out_of_scope",
+    "platform_overview",
+    "submit_consultation",
+    "data_security",
+    "contact_support",
+    "greeting",
+]
+
+DEFAULT_REPLY = """I'm here to help with questions about Docify Online. You can ask me about:
+- Our medical consultation services
+- How to submit consultation forms
+- Data security and privacy
+- Contact information
+- Platform features
+
+For medical concerns, please fill out a consultation form on your dashboard to speak with qualified doctors.
+
+What would you like to know?"""
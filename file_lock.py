@@ -0,0 +1,17 @@
+"""
+Exclusive advisory lock on a lock file, shared by every process that uses the same path.
+"""
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: callers still serialize threads with their own lock
+    fcntl = None
+
+
+@contextlib.contextmanager
+def exclusive(lock_path):
+    with open(lock_path, "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
@@ -0,0 +1,109 @@
+"""
+Long-lived Gemini backend used by ``process_query5``.
+
+The ``GenerativeModel`` and the safety settings are built once and reused.
+Each call gets an output-token budget chosen by intent (short answers are
+meant to be short, and generation time grows with output length), a request
+deadline, and its token usage is added to running counters.
+"""
+import os
+import threading
+
+try:
+    import google.generativeai as genai
+    GENAI_AVAILABLE = True
+except ImportError:
+    GENAI_AVAILABLE = False
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "15"))
+
+# max_output_tokens per intent; answers are asked for "in minimum words"
+OUTPUT_TOKEN_BUDGETS = {
+    "greeting": 64,
+    "platform_faq": 256,
+    "medical": 512,
+    "default": 384,
+}
+
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": OUTPUT_TOKEN_BUDGETS["default"],
+    "response_mime_type": "text/plain",
+}
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+
+def _default_model_factory(model_name, generation_config, safety_settings):
+    return genai.GenerativeModel(
+        model_name=model_name,
+        generation_config=generation_config,
+        safety_settings=safety_settings,
+    )
+
+
+class GeminiBackend:
+    def __init__(self, model_name=GEMINI_MODEL, budgets=None, deadline=GEMINI_DEADLINE, model_factory=None):
+        self.model_name = model_name
+        self.budgets = dict(OUTPUT_TOKEN_BUDGETS, **(budgets or {}))
+        self.deadline = deadline
+        self.model_factory = model_factory or _default_model_factory
+        self._model = None
+        self._lock = threading.Lock()
+        self.usage = {"requests": 0, "prompt_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self.model_factory(self.model_name, GENERATION_CONFIG, SAFETY_SETTINGS)
+        return self._model
+
+    def budget_for(self, intent):
+        return self.budgets.get(intent or "default", self.budgets["default"])
+
+    def generate(self, prompt, intent=None, deadline=None):
+        """Generate text for prompt within the intent's output budget and the deadline"""
+        response = self.model.generate_content(
+            prompt,
+            generation_config={"max_output_tokens": self.budget_for(intent)},
+            request_options={"timeout": deadline or self.deadline},
+        )
+        self._record_usage(getattr(response, "usage_metadata", None))
+        return response.text
+
+    def _record_usage(self, usage_metadata):
+        with self._lock:
+            self.usage["requests"] += 1
+            if usage_metadata is None:
+                return
+            self.usage["prompt_tokens"] += getattr(usage_metadata, "prompt_token_count", 0) or 0
+            self.usage["output_tokens"] += getattr(usage_metadata, "candidates_token_count", 0) or 0
+            self.usage["total_tokens"] += getattr(usage_metadata, "total_token_count", 0) or 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self.usage)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_gemini_backend():
+    """Process-wide shared backend, created on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = GeminiBackend()
+    return _backend
@@ -0,0 +1,44 @@
+# Gunicorn production config: gunicorn -c gunicorn.conf.py app:app
+# The same config serves the model services, e.g. chatbot4offline_working:app
+import multiprocessing
+import os
+
+import serving
+
+# gunicorn loads this file before preload_app imports the app, so numpy/torch
+# see these thread limits when they load in the master; workers inherit them
+serving.limit_threads()
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Load models once in the master; workers inherit them copy-on-write
+preload_app = True
+
+# Recycle workers occasionally so slow leaks cannot grow unbounded; 0 disables it.
+# The jitter keeps workers from all restarting at the same moment.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = max_requests // 10
+
+
+def when_ready(server):
+    warmed = serving.preload()
+    frozen = serving.freeze()
+    server.log.info("Preloaded %s, froze %d objects; master memory: %s",
+                    warmed or "no retrievers", frozen, serving.format_usage(serving.memory_usage()))
+
+
+def post_fork(server, worker):
+    serving.cap_torch_threads()
+    # Fork the hashing processes while this worker is still single-threaded
+    from password_hashing import hashing_pool
+    hashing_pool.start()
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s memory: %s", worker.pid, serving.format_usage(serving.memory_usage()))
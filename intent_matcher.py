@@ -0,0 +1,37 @@
+"""
+Word-boundary keyword intent matcher built once from a declarative table.
+
+Each intent lists single words or multi-word phrases. Phrases are indexed by
+their first token, so matching is one pass over the query's tokens and only
+the phrases starting with each token are compared. Per-query cost depends on
+the query, not on how many intents exist. When several intents match, the
+one listed first in the table wins.
+"""
+import re
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class KeywordIntentMatcher:
+    def __init__(self, intents):
+        self.intents = list(intents)
+        self._index = {}
+        for priority, intent in enumerate(self.intents):
+            for phrase in intent["phrases"]:
+                tokens = tuple(tokenize(phrase))
+                if tokens:
+                    self._index.setdefault(tokens[0], []).append((tokens, priority, intent))
+
+    def match(self, text):
+        """Return the highest-priority intent whose phrase occurs in text, or None"""
+        tokens = tokenize(text)
+        best_priority, best = len(self.intents), None
+        for i, token in enumerate(tokens):
+            for phrase, priority, intent in self._index.get(token, ()):
+                if priority < best_priority and tuple(tokens[i:i + len(phrase)]) == phrase:
+                    best_priority, best = priority, intent
+        return best
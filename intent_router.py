@@ -0,0 +1,51 @@
+"""
+Keyword intent router in front of the chatbot backends.
+
+Classifies a query as greeting, out-of-scope, platform FAQ or medical using
+the same compiled keyword matcher as the FAQ replies (microseconds per query,
+no model call), and names the cheapest backend tier able to answer it:
+
+- greeting, out_of_scope -> "canned" reply, only for short queries: "hi, what
+  is a normal heart rate" is medical, and so is "I hurt my knee playing
+  football, what should I do"
+- platform_faq           -> "faq": the direct FAQ answer
+- medical (and anything unrecognised) -> "llm", or "retrieval" (retrieval-only
+  process_query) when no LLM is configured
+"""
+import time
+
+from faq_intents import FAQ_INTENTS, OUT_OF_SCOPE_INTENT, ROUTING_ORDER
+from intent_matcher import KeywordIntentMatcher, tokenize
+from metrics import metrics
+
+GREETING = "greeting"
+OUT_OF_SCOPE = "out_of_scope"
+PLATFORM_FAQ = "platform_faq"
+MEDICAL = "medical"
+
+CATEGORY_TIERS = {GREETING: "canned", OUT_OF_SCOPE: "canned", PLATFORM_FAQ: "faq"}
+# Longer queries that only matched a greeting carry a question the canned reply would ignore
+GREETING_MAX_TOKENS = 4
+# Off-topic keywords (football, coding, election...) also turn up in health questions;
+# only short queries are refused, longer ones go to the medical path
+OUT_OF_SCOPE_MAX_TOKENS = 6
+CANNED_MAX_TOKENS = {GREETING: GREETING_MAX_TOKENS, OUT_OF_SCOPE: OUT_OF_SCOPE_MAX_TOKENS}
+
+
+class IntentRouter:
+    def __init__(self, intents=None, order=ROUTING_ORDER):
+        by_name = {intent["name"]: intent for intent in (intents or FAQ_INTENTS + [OUT_OF_SCOPE_INTENT])}
+        self.matcher = KeywordIntentMatcher(by_name[name] for name in order)
+
+    def route(self, query, llm_available=True):
+        """Return (category, tier, matched intent or None) and record the decision"""
+        started = time.perf_counter()
+        intent = self.matcher.match(query)
+        if intent and len(tokenize(query)) > CANNED_MAX_TOKENS.get(intent["category"], float("inf")):
+            intent = None
+        category = intent["category"] if intent else MEDICAL
+        tier = CATEGORY_TIERS.get(category) or ("llm" if llm_available else "retrieval")
+        metrics.observe("router.classify_seconds", time.perf_counter() - started)
+        metrics.incr(f"router.category.{category}")
+        metrics.incr(f"router.tier.{tier}")
+        return category, tier, intent
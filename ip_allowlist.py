@@ -0,0 +1,125 @@
+"""
+Precompiled IP allowlist used by ``limit_remote_addr``.
+
+CIDR entries are parsed once into merged, sorted ``(first, last)`` integer
+ranges per IP version, and a client address is checked with one binary
+search, O(log n) in the number of entries. Recent verdicts are kept in a
+small LRU, so repeat clients cost a dict lookup.
+
+Entries come from ``ALLOWED_IPS`` plus, optionally, a file
+(``ALLOWED_IPS_FILE``, one CIDR per line, ``#`` comments). The file's mtime
+is checked at most every ``ALLOWED_IPS_RELOAD_INTERVAL`` seconds, and a
+changed file is recompiled without a restart.
+"""
+import bisect
+import ipaddress
+import os
+import threading
+import time
+
+from ttl_cache import TTLCache
+
+RELOAD_INTERVAL = float(os.getenv("ALLOWED_IPS_RELOAD_INTERVAL", "5"))
+VERDICT_CACHE_SIZE = int(os.getenv("ALLOWED_IPS_CACHE_SIZE", "4096"))
+
+
+def compile_ranges(entries):
+    """{4: (starts, ends), 6: (starts, ends)} of merged ranges; invalid entries are skipped"""
+    ranges = {4: [], 6: []}
+    for entry in entries:
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            print(f"Warning: ignoring invalid allowlist entry {entry!r}")
+            continue
+        ranges[network.version].append((int(network.network_address), int(network.broadcast_address)))
+
+    compiled = {}
+    for version, spans in ranges.items():
+        merged = []
+        for first, last in sorted(spans):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        compiled[version] = ([first for first, _ in merged], [last for _, last in merged])
+    return compiled
+
+
+def read_entries(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+
+
+class IPAllowlist:
+    def __init__(self, entries=(), path=None, reload_interval=RELOAD_INTERVAL, cache_size=VERDICT_CACHE_SIZE,
+                 clock=time.monotonic):
+        self.static_entries = entries
+        self.path = path
+        self.reload_interval = reload_interval
+        self.clock = clock
+        self._verdicts = TTLCache(maxsize=cache_size)
+        self._lock = threading.Lock()
+        self._file_entries = []
+        self._file_mtime = None
+        self._next_check = 0.0
+        self._ranges = compile_ranges(())
+        self._generation = 0
+        self._maybe_reload(force=True)
+
+    def set_static(self, entries):
+        """Replace the non-file entries (e.g. ALLOWED_IPS) and recompile"""
+        with self._lock:
+            self.static_entries = entries
+            self._compile()
+
+    def _compile(self):
+        self._ranges = compile_ranges(list(self.static_entries) + self._file_entries)
+        self._generation += 1
+        self._verdicts.clear()
+
+    def _maybe_reload(self, force=False):
+        if not force and (not self.path or self.clock() < self._next_check):
+            return
+        with self._lock:
+            self._next_check = self.clock() + self.reload_interval
+            if self.path:
+                try:
+                    mtime = os.stat(self.path).st_mtime_ns
+                    if mtime != self._file_mtime:
+                        self._file_entries = read_entries(self.path)
+                        self._file_mtime = mtime
+                        force = True
+                except OSError as e:
+                    # Keep serving the last list that could be read
+                    print(f"Warning: cannot read allowlist file {self.path}: {e}")
+            if force:
+                self._compile()
+
+    def allows(self, ip):
+        """True if ip (a string) falls in any allowed range"""
+        self._maybe_reload()
+        generation = self._generation
+        cached = self._verdicts.get(ip)
+        # A lookup racing a reload may store a verdict of the old list; its generation gives it away
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        verdict = self._lookup(ip)
+        self._verdicts.set(ip, (generation, verdict))
+        return verdict
+
+    def _lookup(self, ip):
+        ranges = self._ranges
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        starts, ends = ranges[address.version]
+        value = int(address)
+        i = bisect.bisect_right(starts, value) - 1
+        return i >= 0 and value <= ends[i]
@@ -0,0 +1,173 @@
+"""
+Persistent background job queue for work derived from a request.
+
+``enqueue(kind, payload)`` stores a job in a SQLite file and returns
+straight away. ``JOB_WORKERS`` background threads per process then run the
+handler registered for ``kind``. The file is plain ``sqlite3``, separate
+from the app database, so pending jobs survive restarts. Every worker
+process on the host can share it, because jobs are claimed inside a
+``BEGIN IMMEDIATE`` transaction.
+
+A failed job is retried with exponential backoff and jitter, up to
+``JOB_MAX_ATTEMPTS`` runs. After that it is kept with status ``failed``
+and its last error. A claimed job holds a lease of ``JOB_LEASE`` seconds.
+If its process dies mid-run, the job is claimed again once the lease
+runs out, or marked ``failed`` if that was its last attempt. Finished jobs
+are deleted.
+"""
+import atexit
+import itertools
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from background import BackgroundWorker
+from metrics import metrics
+
+WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "2"))
+BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "300"))
+LEASE = float(os.getenv("JOB_LEASE", "300"))
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status_run_at ON jobs (status, run_at);
+"""
+
+
+class JobQueue:
+    def __init__(self, path, workers=WORKERS, max_attempts=MAX_ATTEMPTS, backoff_base=BACKOFF_BASE,
+                 backoff_max=BACKOFF_MAX, lease=LEASE, poll_interval=POLL_INTERVAL, clock=time.time):
+        # Wall-clock time: run_at is compared across processes and restarts
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.clock = clock
+        self.handlers = {}
+        self._local = threading.local()
+        self._closing = False
+        self._next_worker = itertools.count()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connect().executescript(SCHEMA)
+        self.workers = [BackgroundWorker(self.run_pending, poll_interval, f"job-worker-{i}") for i in range(workers)]
+        # Registered after the workers' stop(), so it runs first: no new claims while exiting
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def register(self, kind):
+        """Decorator: handler(payload) runs jobs of this kind; raising schedules a retry"""
+        def decorator(handler):
+            self.handlers[kind] = handler
+            return handler
+        return decorator
+
+    def start(self):
+        """Start this process's worker threads, e.g. to pick up jobs left from before a restart"""
+        for worker in self.workers:
+            worker.start()
+
+    def enqueue(self, kind, payload, delay=0):
+        """Store a job and return its id; a worker picks it up shortly"""
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind {kind!r}")
+        cursor = self._connect().execute(
+            "INSERT INTO jobs (kind, payload, run_at) VALUES (?, ?, ?)",
+            (kind, json.dumps(payload), self.clock() + delay))
+        metrics.incr("jobs.enqueued")
+        if self.workers and not delay:
+            self.workers[next(self._next_worker) % len(self.workers)].wake()
+        return cursor.lastrowid
+
+    def _claim(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = self.clock()
+            while True:
+                # Running jobs whose lease ran out belong to a process that died
+                row = conn.execute(
+                    "SELECT id, kind, payload, attempts, status FROM jobs "
+                    "WHERE status IN ('pending', 'running') AND run_at <= ? ORDER BY run_at, id LIMIT 1",
+                    (now,)).fetchone()
+                if row is None or row[4] == 'pending' or row[3] < self.max_attempts:
+                    break
+                # Its last allowed run died with its process
+                conn.execute("UPDATE jobs SET status = 'failed', last_error = ? WHERE id = ?",
+                             ("lease expired on the last attempt", row[0]))
+                metrics.incr("jobs.failed")
+                print(f"Warning: job {row[0]} ({row[1]}) failed for good: lease expired on the last attempt")
+            if row is not None:
+                row = row[:4]
+                conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, run_at = ? WHERE id = ?",
+                             (now + self.lease, row[0]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def run_pending(self):
+        """Run due jobs until none are left; returns how many were run"""
+        count = 0
+        while not self._closing:
+            job = self._claim()
+            if job is None:
+                return count
+            self._run(*job)
+            count += 1
+        return count
+
+    def _run(self, job_id, kind, payload, attempts):
+        conn = self._connect()
+        started = time.perf_counter()
+        try:
+            handler = self.handlers[kind]
+            handler(json.loads(payload))
+        except Exception as e:
+            attempts += 1
+            error = f"{type(e).__name__}: {e}"
+            if attempts >= self.max_attempts:
+                conn.execute("UPDATE jobs SET status = 'failed', last_error = ? WHERE id = ?", (error, job_id))
+                metrics.incr("jobs.failed")
+                print(f"Warning: job {job_id} ({kind}) failed for good: {error}")
+            else:
+                # Jitter keeps retries of a burst of failed jobs from arriving together
+                delay = random.uniform(0.5, 1.0) * min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+                conn.execute("UPDATE jobs SET status = 'pending', last_error = ?, run_at = ? WHERE id = ?",
+                             (error, self.clock() + delay, job_id))
+                metrics.incr("jobs.retried")
+        else:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            metrics.incr("jobs.succeeded")
+        metrics.observe(f"jobs.{kind}.seconds", time.perf_counter() - started)
+
+    def counts(self):
+        """{status: number of jobs}"""
+        return dict(self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        self._closing = True
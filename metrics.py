@@ -0,0 +1,39 @@
+"""
+In-process counters, gauges and timers, exported as JSON on /metrics.
+"""
+import threading
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        """Record one duration; keeps count, total and max"""
+        with self._lock:
+            timer = self.timers.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            timer["count"] += 1
+            timer["total"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            timers = {
+                name: dict(timer, avg=timer["total"] / timer["count"] if timer["count"] else 0.0)
+                for name, timer in self.timers.items()
+            }
+            return {"counters": dict(self.counters), "gauges": dict(self.gauges), "timers": timers}
+
+
+metrics = Metrics()
@@ -0,0 +1,135 @@
+"""
+Long-lived client for the local Ollama server (model ``docify``).
+
+A single pooled HTTP session is reused for every generation, every request
+sends ``keep_alive`` so Ollama keeps the model resident between requests, and
+a semaphore caps concurrent generations to what the host can actually serve.
+"""
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class OllamaBusy(RuntimeError):
+    """Raised when every generation slot is taken and none freed up in time"""
+
+
+class OllamaClient:
+    def __init__(self, base_url=None, model=None, keep_alive=None, max_concurrent=None,
+                 queue_timeout=None, connect_timeout=2.0, read_timeout=120.0):
+        self.base_url = (base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")).rstrip("/")
+        self.model = model or os.getenv("OLLAMA_MODEL", "docify")
+        self.keep_alive = keep_alive or os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        self.max_concurrent = max_concurrent or int(os.getenv("OLLAMA_MAX_CONCURRENT", "2"))
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "30"))
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrent)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+
+    def _payload(self, prompt, stream, options):
+        payload = {"model": self.model, "prompt": prompt, "stream": stream, "keep_alive": self.keep_alive}
+        if options:
+            payload["options"] = options
+        return payload
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise OllamaBusy(f"All {self.max_concurrent} Ollama generation slots are busy")
+
+    def generate(self, prompt, **options):
+        """Blocking completion; returns the full generated text"""
+        self._acquire()
+        try:
+            response = self.session.post(f"{self.base_url}/api/generate",
+                                         json=self._payload(prompt, False, options), timeout=self.timeout)
+            response.raise_for_status()
+            return response.json().get("response", "")
+        finally:
+            self._slots.release()
+
+    def stream(self, prompt, **options):
+        """Iterator over generated text fragments as Ollama produces them
+
+        The slot is taken and the request sent before this returns, so
+        ``OllamaBusy`` and HTTP errors are raised here, before a streaming
+        response has started. The slot is held until the iterator is
+        exhausted or closed.
+        """
+        self._acquire()
+        try:
+            response = self.session.post(f"{self.base_url}/api/generate", json=self._payload(prompt, True, options),
+                                         timeout=self.timeout, stream=True)
+            response.raise_for_status()
+        except BaseException:
+            self._slots.release()
+            raise
+        return _TokenStream(response, self._slots.release)
+
+    def warm_up(self):
+        """Load the model into memory without generating anything"""
+        response = self.session.post(f"{self.base_url}/api/generate",
+                                     json={"model": self.model, "keep_alive": self.keep_alive}, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class _TokenStream:
+    """Tokens of one streamed generation; releases its slot once, when exhausted or closed"""
+
+    def __init__(self, response, release):
+        self._response = response
+        self._release = release
+        self._lines = response.iter_lines()
+        self._done = False
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            while not self._done:
+                line = next(self._lines, None)
+                if line is None:
+                    break
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                self._done = bool(chunk.get("done"))
+                if chunk.get("response"):
+                    return chunk["response"]
+        except BaseException:
+            self.close()
+            raise
+        self.close()
+        raise StopIteration
+
+    def close(self):
+        """Called by Flask/werkzeug when the response ends, including on client disconnect"""
+        if not self._closed:
+            self._closed = True
+            self._response.close()
+            self._release()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_ollama_client():
+    """Process-wide shared client, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+    return _client
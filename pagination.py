@@ -0,0 +1,67 @@
+"""
+Keyset (cursor) pagination over ``(created_at, id)``, newest first.
+
+A page is fetched with ``WHERE created_at <= :c AND (created_at < :c OR id <
+:id) ORDER BY created_at DESC, id DESC LIMIT n``. The first term is a range
+seek on the ``(user_id, created_at)`` index, and the index also gives the
+order (SQLite keeps the rowid ``id`` in every index entry). Each page
+therefore costs the same however long the history is, unlike OFFSET paging.
+Cursors are opaque URL-safe tokens naming the last row of the previous page.
+
+Rows from before ``created_at`` was required may have it NULL. They are
+paged after every dated row, by id, as a second phase with its own cursor
+form, so the dated pages keep their seekable predicate.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from sqlalchemy import or_
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created_at, row_id):
+    raw = f"{created_at.isoformat() if created_at else ''}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(created_at or None, id) from a cursor token; ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|")
+        return datetime.fromisoformat(created_at) if created_at else None, int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Requested page size clamped to 1..MAX_PAGE_SIZE"""
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+def keyset_page(query, model, limit, cursor=None):
+    """(rows, next_cursor) for the page of query after cursor; next_cursor is None on the last page"""
+    created_at, row_id = decode_cursor(cursor) if cursor else (None, None)
+    rows = []
+    if not cursor or created_at is not None:
+        dated = query.filter(model.created_at.isnot(None))
+        if cursor:
+            # The <= term is what lets the index seek; an OR at the top level would not
+            dated = query.filter(model.created_at <= created_at,
+                                 or_(model.created_at < created_at, model.id < row_id))
+        rows = dated.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        undated = query.filter(model.created_at.is_(None))
+        if cursor and created_at is None:
+            undated = undated.filter(model.id < row_id)
+        rows += undated.order_by(model.id.desc()).limit(limit + 1 - len(rows)).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
@@ -0,0 +1,149 @@
+"""
+Password hashing for the web apps and the bulk importer.
+
+One pbkdf2 hash costs about half a second of CPU. Inline in request threads,
+a burst of logins takes every gthread thread and every core, and the other
+routes starve. ``hashing_pool`` runs hashes and checks in a small process pool
+instead, so hashing never uses more than ``HASH_WORKERS`` cores per worker.
+At most ``HASH_QUEUE_LIMIT`` more requests may wait for it; beyond that
+``HashingBusy`` is raised and the route answers 503. Keep ``HASH_WORKERS +
+HASH_QUEUE_LIMIT`` below ``GUNICORN_THREADS`` so some threads stay free for
+/chatbot.
+
+The pool is started from gunicorn's ``post_fork`` and before ``app.run()``,
+while the process has a single thread, so its processes are forked. If it
+is first needed later, when other threads exist, it uses ``forkserver``
+instead, since forking a multithreaded process can copy held locks.
+
+``PASSWORD_HASH_METHOD`` selects the werkzeug method. Stored hashes made with
+other parameters are upgraded on the next successful login (``needs_rehash``).
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+from metrics import metrics
+
+HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "1"))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "2"))
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", "10"))
+
+
+class HashingBusy(RuntimeError):
+    """Every hashing slot is taken; the caller should shed the request"""
+
+
+def hash_password(password):
+    """Module-level so process pools can pickle it"""
+    return generate_password_hash(password, method=HASH_METHOD)
+
+
+def _full_method(method):
+    """Method string as werkzeug stores it, default parameters included"""
+    parts = method.split(":")
+    if parts[0] == "pbkdf2":
+        return ":".join([parts[0], parts[1] if len(parts) > 1 else "sha256",
+                         parts[2] if len(parts) > 2 else str(DEFAULT_PBKDF2_ITERATIONS)])
+    if parts[0] == "scrypt":
+        return ":".join(parts[:1] + (parts[1:] or ["32768", "8", "1"]))
+    return method
+
+
+def needs_rehash(stored_hash):
+    """True if stored_hash was made with other parameters than HASH_METHOD"""
+    return stored_hash.split("$", 1)[0] != _full_method(HASH_METHOD)
+
+
+def _mp_context():
+    # Forked workers start instantly and do not re-import the app's __main__ module,
+    # but a fork only copies the calling thread: other threads' locks could stay held
+    methods = multiprocessing.get_all_start_methods()
+    if "fork" in methods and threading.active_count() == 1:
+        return multiprocessing.get_context("fork")
+    if "forkserver" in methods:
+        return multiprocessing.get_context("forkserver")
+    return None
+
+
+def _timed(function, *args):
+    # Runs in a pool process; the wall-clock start lets the caller compute queue wait
+    started = time.time()
+    return function(*args), started, time.time()
+
+
+class HashingPool:
+    def __init__(self, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT, timeout=HASH_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_limit)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def start(self):
+        """Start the pool processes now rather than on the first hash
+
+        Called from gunicorn's post_fork and before app.run(), while the process has no other threads yet.
+        """
+        if self.workers <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Pools inherited through a fork belong to the parent
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+                for future in [self._executor.submit(time.time) for _ in range(self.workers)]:
+                    future.result()
+                self._pid = os.getpid()
+
+    def _release(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+            metrics.set_gauge("password_hash.in_flight", self._in_flight)
+        self._slots.release()
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            metrics.incr("password_hash.shed")
+            raise HashingBusy(f"{self.workers} hashing workers busy and the queue is full")
+        with self._lock:
+            self._in_flight += 1
+            metrics.set_gauge("password_hash.in_flight", self._in_flight)
+        submitted = time.time()
+        if self.workers <= 0:
+            try:
+                result, started, finished = _timed(function, *args)
+            finally:
+                self._release()
+        else:
+            try:
+                self.start()
+                future = self._executor.submit(_timed, function, *args)
+            except BaseException:
+                self._release()
+                raise
+            # A running task cannot be cancelled, so the slot is held until the pool
+            # process finishes it, even if this request stops waiting
+            future.add_done_callback(self._release)
+            try:
+                result, started, finished = future.result(self.timeout)
+            except FutureTimeout:
+                metrics.incr("password_hash.timeouts")
+                raise HashingBusy(f"Hashing did not finish within {self.timeout}s")
+        metrics.observe("password_hash.queue_wait", max(started - submitted, 0.0))
+        metrics.observe("password_hash.compute", finished - started)
+        return result
+
+    def hash(self, password):
+        return self._run(hash_password, password)
+
+    def verify(self, stored_hash, password):
+        return self._run(check_password_hash, stored_hash, password)
+
+
+hashing_pool = HashingPool()
@@ -0,0 +1,110 @@
+"""
+Progressive chatbot answers: a quick local reply now, the LLM answer later.
+
+For queries routed to the LLM, ``/chatbot`` can answer at once with the
+retrieval or FAQ reply and compute the LLM answer on a background thread.
+The client then gets the refined answer in one of two ways:
+
+- polling: the first response carries a ``request_id``, and
+  ``GET /chatbot/result/<request_id>`` returns the answer once it is ready.
+  Results are kept for ``PROGRESSIVE_RESULT_TTL`` seconds in a
+  ``shared_state`` store. The app uses a SQLite one, so a poll may reach any
+  gunicorn worker, not only the one computing the answer.
+- streaming: the response is NDJSON, with a ``"quick"`` line sent straight
+  away and a ``"final"`` line sent when the LLM answer arrives, on the same
+  connection.
+
+Background answers run on at most ``PROGRESSIVE_WORKERS`` threads per worker
+process. The model calls inside them still go through admission control.
+"""
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from shared_state import MemoryStore
+from ttl_cache import TTLCache
+
+WORKERS = int(os.getenv("PROGRESSIVE_WORKERS", "8"))
+RESULT_TTL = float(os.getenv("PROGRESSIVE_RESULT_TTL", "300"))
+STREAM_TIMEOUT = float(os.getenv("PROGRESSIVE_STREAM_TIMEOUT", "60"))
+
+
+def wants_progressive(request, data):
+    if "progressive" in request.args:
+        return request.args.get("progressive") not in ("0", "false")
+    return bool(data.get("progressive"))
+
+
+def wants_stream(request):
+    if "stream" in request.args:
+        return request.args.get("stream") not in ("0", "false")
+    return "application/x-ndjson" in request.headers.get("Accept", "")
+
+
+class ProgressiveAnswers:
+    def __init__(self, workers=WORKERS, ttl=RESULT_TTL, maxsize=10000, store=None):
+        """store defaults to an in-process MemoryStore; pass a SQLiteStore to share between workers"""
+        self.workers = workers
+        # request id -> {"owner", "done", "reply"}
+        self.store = store if store is not None else MemoryStore(maxsize=maxsize, ttl=ttl)
+        # request id -> future, for streaming from the worker that runs the answer
+        self._futures = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Created per process: with preload_app the module is imported in the gunicorn master
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix="progressive-answer")
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, owner, compute, fallback=None):
+        """Run compute() in the background; returns the request id to poll
+
+        fallback is the answer stored if compute() raises.
+        """
+        request_id = uuid.uuid4().hex
+        self.store.set(request_id, {"owner": owner, "done": False})
+
+        def run():
+            try:
+                reply = compute()
+            except Exception as e:
+                print(f"Warning: progressive answer {request_id} failed: {e}")
+                reply = fallback
+            self.store.set(request_id, {"owner": owner, "done": True, "reply": reply})
+            return reply
+
+        self._futures.set(request_id, self._pool().submit(run))
+        return request_id
+
+    def result(self, request_id, owner):
+        """(found, done, answer) for a request started by owner"""
+        entry = self.store.get(request_id)
+        if entry is None or entry["owner"] != owner:
+            return False, False, None
+        return True, entry["done"], entry.get("reply")
+
+    def stream(self, request_id, quick_reply, timeout=STREAM_TIMEOUT):
+        """NDJSON lines: the quick reply, then the final answer (the quick one again on timeout)"""
+        yield json.dumps({"stage": "quick", "reply": quick_reply, "request_id": request_id}) + "\n"
+        future = self._futures.get(request_id)
+        final = quick_reply
+        if future is not None:
+            try:
+                final = future.result(timeout)
+            except FutureTimeout:
+                pass
+        else:
+            # Evicted locally; the shared store may still have the answer
+            entry = self.store.get(request_id)
+            if entry and entry["done"]:
+                final = entry["reply"]
+        yield json.dumps({"stage": "final", "reply": final, "request_id": request_id}) + "\n"
@@ -0,0 +1,91 @@
+"""
+Token-budgeted prompt assembly shared by the RAG backends.
+
+Retrieved chunks are reduced to their ``page_content``, de-duplicated
+(splitter overlap and near-identical chunks), and packed greedily in
+retrieval-score order until the backend's input-token budget is used up.
+"""
+import os
+import re
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Input-token budget for the whole prompt, per backend
+INPUT_TOKEN_BUDGETS = {
+    "gemini": int(os.getenv("PROMPT_BUDGET_GEMINI", "1200")),
+    "ollama": int(os.getenv("PROMPT_BUDGET_OLLAMA", "800")),
+    "flan_t5": int(os.getenv("PROMPT_BUDGET_FLAN_T5", "400")),
+}
+
+# Chunks whose word 3-grams are mostly covered by already packed chunks are dropped
+DUPLICATE_COVERAGE = 0.8
+# Shortest head/tail overlap (in characters) worth trimming between chunks
+MIN_OVERLAP_CHARS = 20
+
+
+def count_tokens(text):
+    """Cheap tokenizer-free estimate: words and punctuation marks"""
+    return len(TOKEN_PATTERN.findall(text or ""))
+
+
+def _content(chunk):
+    text = getattr(chunk, "page_content", chunk)
+    return " ".join(str(text).split())
+
+
+def _shingles(text):
+    words = text.lower().split()
+    if len(words) < 3:
+        return {tuple(words)}
+    return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def _trim_overlap(text, kept):
+    """Drop a leading part of text that repeats the tail of a packed chunk"""
+    for other in kept:
+        for size in range(min(len(text), len(other)) - 1, MIN_OVERLAP_CHARS - 1, -1):
+            if other.endswith(text[:size]):
+                return text[size:].strip()
+    return text
+
+
+def pack_context(scored_chunks, budget, score_is_distance=True, count=count_tokens):
+    """Pick chunk texts by retrieval score until budget tokens are used
+
+    scored_chunks holds (Document or str, score) pairs; FAISS scores are L2
+    distances, so lower is better unless score_is_distance is False.
+    """
+    ranked = sorted(scored_chunks, key=lambda pair: pair[1], reverse=not score_is_distance)
+    kept, seen, used = [], set(), 0
+    for chunk, _ in ranked:
+        text = _content(chunk)
+        shingles = _shingles(text)
+        if not text or len(shingles & seen) >= DUPLICATE_COVERAGE * len(shingles):
+            continue
+        text = _trim_overlap(text, kept)
+        cost = count(text)
+        if not text or used + cost > budget:
+            continue
+        kept.append(text)
+        seen |= shingles
+        used += cost
+    return kept
+
+
+def build_prompt(instructions, question, scored_chunks, backend, symptoms=None, history=None,
+                 count=count_tokens):
+    """Assemble instructions, optional history/symptoms, packed context and the question"""
+    parts = [instructions.strip()]
+    if history:
+        parts.append(f"Conversation so far:\n{history}")
+    if symptoms:
+        parts.append(f"User symptoms: {symptoms}")
+    tail = f"Question: {question}"
+
+    fixed = count("\n\n".join(parts + [tail]))
+    budget = INPUT_TOKEN_BUDGETS.get(backend, INPUT_TOKEN_BUDGETS["gemini"]) - fixed
+    context = pack_context(scored_chunks, budget, count=count) if budget > 0 else []
+    if context:
+        parts.append("Context:\n" + "\n".join(f"- {text}" for text in context))
+    parts.append(tail)
+    return "\n\n".join(parts)
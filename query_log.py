@@ -0,0 +1,150 @@
+"""
+Buffered chatbot query log (``query_dataset.csv`` by default).
+
+``log()`` only puts a record on an in-memory queue, so the chat path never
+opens a file. A background worker drains the queue in batches: every
+``QUERY_LOG_FLUSH_INTERVAL`` seconds, or sooner once ``QUERY_LOG_BATCH_SIZE``
+records are waiting. Records are written as proper CSV (or NDJSON) with a
+timestamp, the user id and the answer latency. When the file grows past
+``QUERY_LOG_MAX_BYTES`` it is rotated to ``<path>.1.gz``, ``<path>.2.gz``, ...
+
+Under overload the queue sheds load instead of growing: above 80% capacity
+only one record in ``QUERY_LOG_OVERLOAD_SAMPLE`` is kept, and once it is full
+records are dropped. Both are counted on ``/metrics``.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import shutil
+import threading
+from datetime import datetime, timezone
+
+from background import BackgroundWorker
+from file_lock import exclusive
+from metrics import metrics
+
+FIELDNAMES = ["timestamp", "user_id", "latency_ms", "query"]
+
+QUERY_LOG_FORMAT = os.getenv("QUERY_LOG_FORMAT", "csv")
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "query_dataset." + QUERY_LOG_FORMAT)
+QUEUE_SIZE = int(os.getenv("QUERY_LOG_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.getenv("QUERY_LOG_BATCH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", "1"))
+MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+BACKUP_COUNT = int(os.getenv("QUERY_LOG_BACKUPS", "5"))
+OVERLOAD_SAMPLE = int(os.getenv("QUERY_LOG_OVERLOAD_SAMPLE", "10"))
+OVERLOAD_FRACTION = 0.8
+
+
+class QueryLogger:
+    def __init__(self, path=QUERY_LOG_PATH, fmt=QUERY_LOG_FORMAT, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_bytes=MAX_BYTES, backups=BACKUP_COUNT,
+                 overload_sample=OVERLOAD_SAMPLE):
+        if fmt not in ("csv", "ndjson"):
+            raise ValueError(f"Unknown query log format: {fmt!r}")
+        self.path = path
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.overload_sample = overload_sample
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._overload_size = int(queue_size * OVERLOAD_FRACTION)
+        self._overload_seen = 0
+        self._write_lock = threading.Lock()
+        self._checked_header = False
+        self.worker = BackgroundWorker(self.flush, flush_interval, name="query-log-writer")
+
+    def log(self, query, user_id=None, latency=None):
+        """Queue one record; never blocks. latency is in seconds."""
+        if self._queue.qsize() >= self._overload_size:
+            # Racy across threads, which is fine for sampling
+            self._overload_seen += 1
+            if self._overload_seen % self.overload_sample:
+                metrics.incr("query_log.sampled_out")
+                return
+        record = {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "user_id": user_id,
+            "latency_ms": round(latency * 1000, 1) if latency is not None else None,
+            "query": query,
+        }
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr("query_log.dropped")
+            return
+        if self._queue.qsize() >= self.batch_size:
+            self.worker.wake()
+        else:
+            self.worker.start()
+
+    def _drain(self):
+        records = []
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                return records
+
+    def encode(self, records, header=False):
+        if self.fmt == "ndjson":
+            return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=FIELDNAMES, lineterminator="\n")
+        if header:
+            writer.writeheader()
+        writer.writerows(records)
+        return buffer.getvalue()
+
+    def flush(self):
+        """Write every queued record; returns how many were written"""
+        with self._write_lock:
+            records = self._drain()
+            if not records:
+                return 0
+            with exclusive(self.path + ".lock"):
+                self._rotate_if_needed()
+                new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                data = self.encode(records, header=new_file and self.fmt == "csv").encode("utf-8")
+                # One append per batch; O_APPEND keeps batches from other workers whole
+                with open(self.path, "ab") as f:
+                    f.write(data)
+            metrics.incr("query_log.written", len(records))
+            return len(records)
+
+    def _rotate_if_needed(self):
+        if not os.path.exists(self.path):
+            return
+        if not self._checked_header:
+            self._checked_header = True
+            if self.fmt == "csv" and not self._has_header():
+                # Rotate away a file written in an older, header-less format
+                self._rotate()
+                return
+        if os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+
+    def _has_header(self):
+        with open(self.path, encoding="utf-8", errors="replace") as f:
+            first_line = f.readline()
+        return not first_line or first_line.rstrip("\r\n") == ",".join(FIELDNAMES)
+
+    def _rotate(self):
+        """path -> path.1.gz, path.1.gz -> path.2.gz, ... keeping self.backups files"""
+        for i in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{i}.gz"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}.gz")
+        rotated = self.path + ".rotating"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(f"{self.path}.1.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.unlink(rotated)
+        metrics.incr("query_log.rotations")
+
+    def pending(self):
+        return self._queue.qsize()
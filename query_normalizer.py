@@ -0,0 +1,162 @@
+"""
+Query normalization for cache and intent keys.
+
+``normalize()`` folds Unicode (NFKC), case and whitespace, then corrects
+misspelled words with a SymSpell-style symmetric-delete lookup against a
+dictionary built once from faq.txt and the inline FAQ intent table. Lookups
+only hash a handful of delete variants, so a query normalizes in microseconds.
+
+The FAQ dictionary is tiny, so its nearest word is often wrong for a valid
+word outside it ("swallowed" -> "allowed", "cancer" -> "cancel"). A word is
+therefore only corrected when it is not a real word: absent from the FAQ
+dictionary, from ``MEDICAL_VOCABULARY`` and from general English (``wordfreq``,
+``zipf_frequency >= KNOWN_WORD_ZIPF``). Without wordfreq installed nothing is
+corrected. The normalized text is a lookup key only: the LLM, retrieval and
+conversation history get the user's own words.
+"""
+import functools
+import os
+import re
+import unicodedata
+from collections import Counter
+
+from faq_intents import FAQ_INTENTS, OUT_OF_SCOPE_INTENT, DEFAULT_REPLY
+
+try:
+    from wordfreq import zipf_frequency
+except ImportError:
+    print("Warning: wordfreq not available, queries will not be spell-corrected")
+    zipf_frequency = None
+
+FAQ_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "faq.txt")
+
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+# Shorter words are left alone: too many valid neighbours to correct safely
+MIN_WORD_LENGTH = 5
+# Inflections of dictionary words are valid words, not typos
+INFLECTION_SUFFIXES = ("s", "es", "ed", "ing", "ly")
+# Words this long may be corrected across two edits, shorter ones across one
+TWO_EDIT_LENGTH = 8
+MAX_EDIT_DISTANCE = 2
+# Words at least this frequent in English (zipf scale, 2.0 = about once per 10M words) are real words.
+# Misspellings seen in the query log sit well below it: "certificat" 1.5, "consulation" 1.1.
+KNOWN_WORD_ZIPF = 2.0
+
+# Common query words that the FAQ corpus itself does not contain
+EXTRA_VOCABULARY = """
+summary summarize summarized summarise summarised explain explanation please thanks thank
+question questions answer answers appointment appointments schedule booking cancel refund
+register registration login password account email phone number update delete change
+doctor doctors medicine medicines medication prescription certificate certificates
+""".split()
+
+
+# Clinical terms that are too rare in general English to pass KNOWN_WORD_ZIPF
+MEDICAL_VOCABULARY = frozenset("""
+dysuria dysphagia dyspepsia dyspnoea haematuria hematuria haemoptysis hemoptysis melaena melena
+tachycardia bradycardia arrhythmias hypothyroidism hyperthyroidism hypoglycaemia hypoglycemia
+hyperglycaemia hyperglycemia paraesthesia paresthesia tinea urticaria pruritus rhinorrhoea rhinorrhea
+otalgia epistaxis syncope oedema edema myalgia arthralgia cellulitis pharyngitis tonsillitis otitis
+cystitis pyelonephritis gastroenteritis diverticulitis cholecystitis pancreatitis nephrolithiasis
+amoxicillin azithromycin cetirizine loratadine omeprazole pantoprazole metronidazole salbutamol
+""".split())
+
+
+def corpus_texts():
+    texts = [DEFAULT_REPLY, OUT_OF_SCOPE_INTENT["response"], " ".join(OUT_OF_SCOPE_INTENT["phrases"])]
+    for intent in FAQ_INTENTS:
+        texts.append(intent["response"])
+        texts.extend(intent["phrases"])
+    try:
+        with open(FAQ_PATH, encoding="utf-8") as f:
+            texts.append(f.read())
+    except OSError as e:
+        print(f"Warning: could not read {FAQ_PATH} for the spelling dictionary: {e}")
+    texts.append(" ".join(EXTRA_VOCABULARY))
+    return texts
+
+
+def _deletes(word, distance):
+    """All strings reachable from word by removing up to distance characters"""
+    results = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        results |= frontier
+    return results
+
+
+def edit_distance(a, b, limit):
+    """Damerau-Levenshtein (optimal string alignment) distance, or limit + 1 if larger"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SymSpell:
+    def __init__(self, texts, max_edit_distance=MAX_EDIT_DISTANCE):
+        self.max_edit_distance = max_edit_distance
+        self.frequencies = Counter()
+        for text in texts:
+            self.frequencies.update(WORD_PATTERN.findall(fold(text)))
+        self._deletes = {}
+        for word in self.frequencies:
+            for variant in _deletes(word, max_edit_distance):
+                self._deletes.setdefault(variant, []).append(word)
+        self.correct = functools.lru_cache(maxsize=4096)(self._correct)
+
+    def _correct(self, word):
+        """Closest dictionary word (fewest edits, then most frequent), or word itself"""
+        if len(word) < MIN_WORD_LENGTH or word in self.frequencies or is_known_word(word):
+            return word
+        for suffix in INFLECTION_SUFFIXES:
+            if word.endswith(suffix) and word[:-len(suffix)] in self.frequencies:
+                return word
+        limit = self.max_edit_distance if len(word) >= TWO_EDIT_LENGTH else 1
+        best, best_key = word, None
+        candidates = set()
+        for variant in _deletes(word, limit):
+            candidates.update(self._deletes.get(variant, ()))
+        for candidate in candidates:
+            distance = edit_distance(word, candidate, limit)
+            if distance > limit:
+                continue
+            key = (distance, -self.frequencies[candidate])
+            if best_key is None or key < best_key:
+                best, best_key = candidate, key
+        return best
+
+
+def is_known_word(word):
+    """True for real words outside the FAQ dictionary; True for everything when no vocabulary is installed"""
+    if word in MEDICAL_VOCABULARY:
+        return True
+    return zipf_frequency is None or zipf_frequency(word, "en") >= KNOWN_WORD_ZIPF
+
+
+def fold(text):
+    """Unicode, case and whitespace folding"""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+spell_checker = SymSpell(corpus_texts())
+
+
+def normalize(query):
+    """Folded query with misspelled words replaced by their dictionary spelling
+
+    Meant for cache and intent keys; pass the user's query to the models.
+    """
+    return WORD_PATTERN.sub(lambda m: spell_checker.correct(m.group(0)), fold(query))
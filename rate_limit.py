@@ -0,0 +1,167 @@
+"""
+Per-client token-bucket rate limiting for /chatbot, /chatbot/batch and /login.
+
+Every (route, client) pair has a bucket of ``capacity`` tokens that refills
+at ``rate`` tokens per second. A request takes one token; without one it is
+answered 429 with ``Retry-After`` set to the time until the next token. A
+bucket only stores its token count and the time it was last touched, and
+the refill is computed on access, so a check costs O(1).
+
+A bucket that has refilled completely is no different from a new one, so it
+can be dropped. ``MemoryBuckets`` keeps a heap of the times buckets will be
+full again and drops every bucket whose time has passed on each check, so a
+bucket that is still refilling never holds back full ones. Each check pushes
+one heap entry, so the cost stays amortized O(log n).
+
+``MemoryBuckets`` limits each worker process on its own. Set
+``RATE_LIMIT_DB`` to a SQLite file, and ``SQLiteBuckets`` shares the buckets
+between all workers on the host instead.
+"""
+import heapq
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+
+def parse_limit(text):
+    """(capacity, tokens per second) from "30/minute", or None for "off"
+
+    The capacity is the burst a client may use at once; it then gets
+    ``capacity`` requests per period.
+    """
+    text = text.strip().lower()
+    if text in ("", "off", "0"):
+        return None
+    count, _, period = text.partition("/")
+    seconds = PERIODS[period] if period in PERIODS else float(period or 1)
+    capacity = int(count)
+    return capacity, capacity / seconds
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + max(now - updated, 0.0) * rate)
+
+
+def _take(tokens, capacity, rate, cost):
+    """(tokens left, seconds to wait); the wait is 0 when the tokens were taken"""
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+
+class MemoryBuckets:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._buckets = {}  # key -> (tokens, updated, full_at)
+        self._full_at = []  # heap of (full_at, key); entries for since-updated buckets are stale
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        now = self.clock()
+        with self._lock:
+            entry = self._buckets.get(key)
+            tokens = capacity if entry is None else _refill(entry[0], entry[1], now, capacity, rate)
+            tokens, wait = _take(tokens, capacity, rate, cost)
+            full_at = now + (capacity - tokens) / rate
+            self._buckets[key] = (tokens, now, full_at)
+            heapq.heappush(self._full_at, (full_at, key))
+            self._evict(now)
+            return wait
+
+    def _evict(self, now):
+        heap = self._full_at
+        while heap and heap[0][0] <= now:
+            full_at, key = heapq.heappop(heap)
+            entry = self._buckets.get(key)
+            if entry is not None and entry[2] == full_at:
+                del self._buckets[key]
+        # Busy buckets leave stale entries behind; rebuild once they outnumber the live ones
+        if len(heap) > 2 * len(self._buckets) + 64:
+            self._full_at = [(entry[2], key) for key, entry in self._buckets.items()]
+            heapq.heapify(self._full_at)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBuckets:
+    """Buckets in a SQLite file shared by every worker process on the host"""
+
+    # Full buckets are deleted every this many checks
+    SWEEP_EVERY = 1000
+
+    def __init__(self, path, clock=time.time):
+        # Wall-clock time: monotonic clocks are not comparable between processes
+        self.path = path
+        self.clock = clock
+        self._local = threading.local()
+        self._checks = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets "
+                         "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key, capacity, rate, cost=1):
+        conn = self._connect()
+        # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = self.clock()
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, rate)
+            tokens, wait = _take(tokens, capacity, rate, cost)
+            conn.execute("INSERT OR REPLACE INTO rate_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                         (key, tokens, now, now + (capacity - tokens) / rate))
+            self._checks += 1
+            if self._checks % self.SWEEP_EVERY == 0:
+                conn.execute("DELETE FROM rate_buckets WHERE full_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0]
+
+
+class RateLimiter:
+    def __init__(self, limits, buckets=None):
+        """limits maps a route name to (capacity, tokens per second), or None for no limit"""
+        self.limits = limits
+        self.buckets = buckets if buckets is not None else MemoryBuckets()
+
+    def retry_after(self, name, client, cost=1):
+        """Take cost tokens for client on route name; 0 if allowed, else whole seconds to wait"""
+        limit = self.limits.get(name)
+        if limit is None:
+            return 0
+        capacity, rate = limit
+        # A request bigger than the burst needs, and drains, the whole bucket
+        wait = self.buckets.take(f"{name}:{client}", capacity, rate, min(cost, capacity))
+        if not wait:
+            return 0
+        metrics.incr(f"rate_limit.{name}.limited")
+        return max(1, math.ceil(wait))
+
+
+def limiter_from_env(defaults):
+    """RateLimiter with RATE_LIMIT_<NAME> overriding each default, shared through RATE_LIMIT_DB if set"""
+    limits = {name: parse_limit(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+              for name, default in defaults.items()}
+    path = os.getenv("RATE_LIMIT_DB")
+    return RateLimiter(limits, SQLiteBuckets(path) if path else MemoryBuckets())
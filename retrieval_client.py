@@ -0,0 +1,82 @@
+"""
+Client for the retrieval/chatbot microservice (chatbot3/chatbot4 on port 5003).
+
+One client is shared by all request threads of the web tier. It keeps
+connections alive in a pool, bounds connect and read time, retries only
+failures that are safe and cheap to retry, and caps how many calls can be
+in flight so a slow service cannot absorb every web worker thread.
+"""
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Upstream statuses that mean "try again shortly"
+RETRY_STATUSES = (502, 503, 504)
+
+
+class RetrievalServiceBusy(requests.RequestException):
+    """Raised when the in-flight limit is reached and no slot freed up in time"""
+
+
+class RetrievalClient:
+    def __init__(self, base_url=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff=None, max_in_flight=None, queue_timeout=None):
+        self.base_url = (base_url or os.getenv("RETRIEVAL_SERVICE_URL", "http://127.0.0.1:5003")).rstrip("/")
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(os.getenv("RETRIEVAL_CONNECT_TIMEOUT", "1.0"))
+        self.read_timeout = read_timeout if read_timeout is not None else float(os.getenv("RETRIEVAL_READ_TIMEOUT", "10"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("RETRIEVAL_MAX_RETRIES", "2"))
+        self.backoff = backoff if backoff is not None else float(os.getenv("RETRIEVAL_BACKOFF", "0.1"))
+        self.max_in_flight = max_in_flight or int(os.getenv("RETRIEVAL_MAX_IN_FLIGHT", "16"))
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv("RETRIEVAL_QUEUE_TIMEOUT", "0.5"))
+
+        self.session = requests.Session()
+        # One pooled connection per in-flight slot; urllib3 retries are off, we retry ourselves
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: spread retries from many threads instead of synchronizing them
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def post(self, path, payload):
+        """POST JSON to the service and return the decoded JSON body
+
+        Connection failures and 502/503/504 are retried with jittered backoff.
+        Read timeouts are not retried: a hung service would only be hit again.
+        An error status left after the last attempt raises requests.HTTPError,
+        so callers fall back instead of passing the error body on as a reply.
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise RetrievalServiceBusy(f"More than {self.max_in_flight} requests in flight to {self.base_url}")
+        try:
+            url = self.base_url + path
+            for attempt in range(self.max_retries + 1):
+                last_attempt = attempt == self.max_retries
+                try:
+                    response = self.session.post(url, json=payload,
+                                                 timeout=(self.connect_timeout, self.read_timeout))
+                except requests.ConnectionError:  # includes ConnectTimeout
+                    if last_attempt:
+                        raise
+                    self._sleep_before_retry(attempt)
+                    continue
+                if response.status_code in RETRY_STATUSES and not last_attempt:
+                    response.close()
+                    self._sleep_before_retry(attempt)
+                    continue
+                response.raise_for_status()
+                return response.json()
+        finally:
+            self._slots.release()
+
+    def chat(self, message, symptoms=None):
+        return self.post("/chatbot", {"message": message, "symptoms": symptoms})
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,151 @@
+"""
+Production serving helpers for running the Flask apps under gunicorn.
+
+With ``preload_app`` the vector store, embedding model and any local LLM are
+loaded once in the gunicorn master. ``freeze()`` then moves every object that
+exists at that point into the permanent GC generation, so the cyclic collector
+in the forked workers never touches (and therefore never dirties) those pages
+and they stay shared copy-on-write.
+
+Run ``python serving.py <gunicorn master pid>`` to print the measured
+RSS/PSS of every worker.
+"""
+import gc
+import os
+import sys
+
+# Thread-pool knobs read by OpenMP, MKL, OpenBLAS and numexpr when they load
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+# Modules that build a retriever at import time
+PRELOAD_MODULES = (
+    "evaluate_different_modules",
+    "chatbot",
+    "chatbot3usingllama2formollama",
+    "chatbot4offline_working",
+)
+
+
+def worker_native_threads():
+    return int(os.getenv("WORKER_NATIVE_THREADS", "1"))
+
+
+def limit_threads(num_threads=None):
+    """Cap native math-library threads per worker process
+
+    OpenMP, MKL and OpenBLAS read these variables once, when numpy/torch are
+    first imported, so this has to run before the app is imported: gunicorn.conf.py
+    calls it at import time, ahead of preload_app. torch is also capped
+    directly if it is already loaded.
+    """
+    if num_threads is None:
+        num_threads = worker_native_threads()
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(num_threads)
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    cap_torch_threads(num_threads)
+    return num_threads
+
+
+def cap_torch_threads(num_threads=None):
+    """Cap torch's intra-op pool in a forked worker; the env variables no longer apply there"""
+    if num_threads is None:
+        num_threads = worker_native_threads()
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(num_threads)
+    return num_threads
+
+
+def preload():
+    """Touch every loaded retriever once so lazy buffers exist before forking"""
+    warmed = []
+    for name in PRELOAD_MODULES:
+        module = sys.modules.get(name)
+        retriever = getattr(module, "retriever", None) if module else None
+        if retriever is None:
+            continue
+        try:
+            retriever.invoke("warm up")
+            warmed.append(name)
+        except Exception as e:
+            print(f"Warning: could not warm up retriever in {name}: {e}")
+    return warmed
+
+
+def freeze():
+    """Collect garbage once, then freeze all surviving objects for the children"""
+    gc.collect()
+    gc.freeze()
+    return gc.get_freeze_count()
+
+
+def memory_usage(pid="self"):
+    """Return Rss/Pss/shared/private memory of a process in kB (Linux only)"""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return {"rss": int(line.split()[1])}
+        except OSError:
+            return None
+        return None
+
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def format_usage(usage):
+    if not usage:
+        return "unavailable"
+    return " ".join(f"{key}={value / 1024:.1f}MB" for key, value in usage.items())
+
+
+def child_pids(pid):
+    """List direct children of a process via /proc"""
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: python serving.py <gunicorn master pid>")
+        return 2
+    master = int(argv[1])
+    print(f"master {master}: {format_usage(memory_usage(master))}")
+    workers = child_pids(master)
+    for pid in workers:
+        print(f"worker {pid}: {format_usage(memory_usage(pid))}")
+    if workers:
+        usages = [memory_usage(pid) or {} for pid in workers]
+        avg_pss = sum(u.get("pss", 0) for u in usages) / len(usages)
+        avg_private = sum(u.get("private", 0) for u in usages) / len(usages)
+        print(f"avg per worker: pss={avg_pss / 1024:.1f}MB private={avg_private / 1024:.1f}MB")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,101 @@
+"""
+Small key-value stores for per-user state that outlives one request.
+
+Under gunicorn every worker process has its own memory, and consecutive
+requests from one browser can reach different workers. State that must
+survive between requests, such as chat history, therefore goes in a
+``SQLiteStore``: JSON values with a time-to-live, in a SQLite file shared
+by all the workers on the host. ``MemoryStore`` has the same interface for
+a single process (tests, one-off scripts).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ttl_cache import TTLCache
+
+
+class MemoryStore:
+    def __init__(self, maxsize=10000, ttl=None):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def update(self, key, change):
+        """Store change(current value or None) atomically and return it"""
+        with self._lock:
+            value = change(self._cache.get(key))
+            self._cache.set(key, value)
+            return value
+
+    def pop(self, key):
+        self._cache.pop(key)
+
+
+class SQLiteStore:
+    # Expired rows are deleted every this many writes
+    SWEEP_EVERY = 500
+
+    def __init__(self, path, table, ttl, clock=time.time):
+        # Wall-clock time: expiry is compared across processes
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.clock = clock
+        self._local = threading.local()
+        self._writes = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connect().execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _read(self, conn, key):
+        row = conn.execute(f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?",
+                           (key, self.clock())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, conn, key, value):
+        now = self.clock()
+        conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                     (key, json.dumps(value), now + self.ttl))
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+
+    def get(self, key):
+        return self._read(self._connect(), key)
+
+    def set(self, key, value):
+        self._write(self._connect(), key, value)
+
+    def update(self, key, change):
+        """Store change(current value or None) atomically across processes and return it"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = change(self._read(conn, key))
+            self._write(conn, key, value)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def pop(self, key):
+        self._connect().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
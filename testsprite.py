@@ -4,17 +4,125 @@ Endpoint test suite for the Docify Flask app.
 Uses Flask's test client to verify core routes work end-to-end.
 Run: python testsprite.py
 """
+import atexit
+import io
 import json
+import numpy
 import os
+import shutil
+import sys
 import time
 import unittest
 import importlib
+import sqlite3
+import subprocess
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from datetime import datetime
 
+# Databases, chat state, jobs and exports go to a scratch directory, never the repo.
+# Pool processes that re-import this module inherit the directory through the environment.
+TEST_STATE_DIR = os.environ.get("DOCIFY_TEST_STATE_DIR")
+if not TEST_STATE_DIR:
+    TEST_STATE_DIR = os.environ["DOCIFY_TEST_STATE_DIR"] = tempfile.mkdtemp(prefix="docify-tests-")
+    # Registered first, so it runs after the app's own exit handlers
+    atexit.register(shutil.rmtree, TEST_STATE_DIR, ignore_errors=True)
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(TEST_STATE_DIR, 'docify.db')}",
+    "CHAT_STATE_DB": os.path.join(TEST_STATE_DIR, "chat_state.db"),
+    "JOB_QUEUE_DB": os.path.join(TEST_STATE_DIR, "jobs.db"),
+    "USERS_CSV_PATH": os.path.join(TEST_STATE_DIR, "users.csv"),
+    "QUERY_LOG_PATH": os.path.join(TEST_STATE_DIR, "query_dataset.csv"),
+    "QUERY_LOG_FORMAT": "csv",
+})
+os.environ.pop("DATABASE_REPLICA_URL", None)
+
+# Many tests log in from the same address; RateLimitTests install their own limiter
+for name in ("CHATBOT", "LOGIN", "LOGIN_ACCOUNT"):
+    os.environ.setdefault(f"RATE_LIMIT_{name}", "off")
+
 # Import app and DB models from the application
-from app import app, db, User, Consultation
+from app import app, db, User, Consultation, TriageSummary
 app_module = importlib.import_module('app')
+import serving
+import requests
+from retrieval_client import RetrievalClient, RetrievalServiceBusy
+from ollama_coustomllm import OllamaClient, OllamaBusy
+from gemini_client import GeminiBackend
+import prompt_builder
+from intent_matcher import KeywordIntentMatcher
+from evaluate_different_modules import get_simple_faq_response
+from intent_router import IntentRouter
+import query_normalizer
+from conversation_memory import ConversationMemory
+from shared_state import SQLiteStore
+from ttl_cache import TTLCache
+from werkzeug.security import check_password_hash
+from user_export import UserCsvExporter
+from query_log import QueryLogger
+import bulk_export
+import bulk_import
+import password_hashing
+from ip_allowlist import IPAllowlist, compile_ranges
+from admission import AdmissionController, Overloaded
+from rate_limit import MemoryBuckets, RateLimiter, SQLiteBuckets, parse_limit
+from job_queue import JobQueue
+from password_hashing import HashingPool, HashingBusy
+from werkzeug.security import generate_password_hash
+import db_config
+import pagination
+import progressive
+from sqlalchemy.exc import OperationalError
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+
+
+class StubServer:
+    """Local HTTP/1.1 server whose handler is a plain function(handler) -> (status, body)"""
+
+    def __init__(self, respond):
+        stub = self
+        self.respond = respond
+        self.client_ports = set()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                stub.client_ports.add(self.client_address[1])
+                length = int(self.headers.get("Content-Length", 0))
+                self.body = json.loads(self.rfile.read(length) or b"{}")
+                status, body = stub.respond(self)
+                payload = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                pass  # clients that time out on purpose close the socket early
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def drop_test_tables():
+    """Drop every table, once the users.csv exporter has stopped reading them"""
+    app_module.user_exporter.worker.stop()
+    db.session.remove()
+    db.drop_all()
 
 
 class AppEndpointTests(unittest.TestCase):
@@ -36,8 +144,7 @@ class AppEndpointTests(unittest.TestCase):
     def tearDownClass(cls):
         with app.app_context():
             try:
-                db.session.remove()
-                db.drop_all()
+                drop_test_tables()
             except Exception:
                 pass
 
@@ -76,6 +183,95 @@ class AppEndpointTests(unittest.TestCase):
         self.assertIsInstance(data, dict)
         self.assertIn("reply", data)
 
+    def test_chatbot_batch_returns_replies_in_order(self):
+        items = [{"message": "what is docify"}, {"message": "I have a fever", "symptoms": "fever"}]
+        r = self.client.post("/chatbot/batch", json={"items": items})
+        self.assertEqual(r.status_code, 200)
+        replies = r.get_json()["replies"]
+        self.assertEqual(len(replies), 2)
+        self.assertIn("Docify", replies[0])
+        self.assertIn("fever", replies[1])
+
+    def test_chatbot_batch_streams_ndjson(self):
+        items = [{"message": f"hello {i}"} for i in range(150)]
+        r = self.client.post("/chatbot/batch", json={"items": items})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in r.data.decode().splitlines()]
+        self.assertEqual([line["index"] for line in lines], list(range(150)))
+
+    def test_chatbot_batch_rejects_bad_items(self):
+        r = self.client.post("/chatbot/batch", json={"items": [{"symptoms": "x"}]})
+        self.assertEqual(r.status_code, 400)
+        for item in ({"message": 42}, {"message": ["fever"]}, {"message": "   "},
+                     {"message": "fever", "symptoms": {"a": 1}}):
+            r = self.client.post("/chatbot/batch", json={"items": [item]})
+            self.assertEqual(r.status_code, 400, item)
+
+    def test_chatbot_batch_is_rate_limited_per_item(self):
+        saved = app_module.rate_limiter
+        app_module.rate_limiter = RateLimiter({"chatbot_batch": (5, 1 / 60)})
+        try:
+            items = [{"message": f"hello {i}"} for i in range(3)]
+            self.assertEqual(self.client.post("/chatbot/batch", json={"items": items}).status_code, 200)
+            r = self.client.post("/chatbot/batch", json={"items": items})
+            self.assertEqual(r.status_code, 429)
+            self.assertIn("Retry-After", r.headers)
+        finally:
+            app_module.rate_limiter = saved
+
+    def test_chatbot_batch_degrades_when_retrieval_is_saturated(self):
+        saved = app_module.admission["retrieval"]
+        app_module.admission["retrieval"] = AdmissionController("batch-full", concurrency=0, queue=0,
+                                                                queue_timeout=1)
+        try:
+            r = self.client.post("/chatbot/batch", json={"items": [{"message": "what is docify"}]})
+            self.assertEqual(r.status_code, 200)
+            self.assertIn("Docify", r.get_json()["replies"][0])
+            self.assertGreaterEqual(app_module.metrics.snapshot()["counters"]["admission.batch-full.shed"], 1)
+        finally:
+            app_module.admission["retrieval"] = saved
+
+    def test_latest_symptoms_lookup_uses_index(self):
+        with app.app_context():
+            plan = db.session.execute(db.text(
+                "EXPLAIN QUERY PLAN SELECT * FROM consultation WHERE user_id = 1 ORDER BY created_at DESC LIMIT 1"
+            )).fetchall()
+        self.assertIn("ix_consultation_user_created", " ".join(str(row) for row in plan))
+
+    def test_chatbot_reads_symptoms_from_cache(self):
+        email = f"cache_{time.time()}@example.com"
+        client = app.test_client()
+        client.post("/register", data={"name": "Cache", "phone": "1", "email": email, "password": "pw"})
+        client.post("/login", data={"email": email, "password": "pw"})
+        client.post("/dashboard", data={"symptoms": "Sneezing since Monday"})
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            # Background jobs (e.g. the triage summary) may query concurrently
+            if threading.current_thread() is threading.main_thread():
+                statements.append(statement)
+
+        from sqlalchemy import event
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            client.post("/chatbot", json={"message": "hello"})
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        self.assertFalse([sql for sql in statements if "FROM consultation" in sql])
+        with app.app_context():
+            user = User.query.filter_by(email=email).first()
+        self.assertEqual(app_module.get_latest_symptoms(user.id), "Sneezing since Monday")
+
+    def test_latest_symptoms_written_by_another_worker_are_seen(self):
+        # A second store on the same file stands in for the worker that handled the write
+        other_worker = SQLiteStore(app_module.chat_state_path, "latest_symptoms", ttl=60)
+        other_worker.set("424242", ["Headache since noon"])
+        self.assertEqual(app_module.get_latest_symptoms(424242), "Headache since noon")
+
     def test_logout_clears_session(self):
         email = f"logout_{int(time.time())}@example.com"
         password = "LogoutPass!123"
@@ -138,8 +334,9 @@ class AppEndpointTests(unittest.TestCase):
             },
             follow_redirects=True,
         )
-        # Check users.csv exists and contains the email
-        users_csv = Path("users.csv")
+        # Check users.csv exists and contains the email once the exporter has caught up
+        app_module.user_exporter.flush()
+        users_csv = Path(app_module.user_exporter.path)
         self.assertTrue(users_csv.exists())
         content = users_csv.read_text(encoding="utf-8", errors="ignore")
         self.assertIn(email, content)
@@ -170,7 +367,8 @@ class AppEndpointTests(unittest.TestCase):
             data=json.dumps({"message": msg}),
             content_type="application/json",
         )
-        qfile = Path("query_dataset.csv")
+        app_module.query_logger.flush()
+        qfile = Path(app_module.query_logger.path)
         self.assertTrue(qfile.exists())
         content = qfile.read_text(encoding="utf-8", errors="ignore")
         self.assertIn(msg, content)
@@ -287,8 +485,1608 @@ class AppEndpointTests(unittest.TestCase):
         self.assertGreater(len(data["reply"]), 0)
 
 
+class BatchSimilaritySearchTests(unittest.TestCase):
+    """The vectorized path with a small numpy store standing in for FAISS and the embedder"""
+
+    class Embeddings:
+        VOCABULARY = ["fever", "cough", "rash", "docify"]
+
+        def __init__(self):
+            self.calls = []
+
+        def embed_documents(self, texts):
+            self.calls.append(list(texts))
+            return [[float(text.lower().count(word)) for word in self.VOCABULARY] for text in texts]
+
+    class Index:
+        def __init__(self, vectors):
+            self.vectors = numpy.asarray(vectors, dtype=numpy.float32)
+            self.searches = 0
+
+        def search(self, matrix, k):
+            self.searches += 1
+            distances = ((matrix[:, None, :] - self.vectors[None, :, :]) ** 2).sum(axis=2)
+            order = numpy.argsort(distances, axis=1, kind="stable")[:, :k]
+            found = numpy.take_along_axis(distances, order, axis=1)
+            # FAISS pads rows with -1 when the index has fewer than k vectors
+            pad = k - order.shape[1]
+            return (numpy.pad(found, ((0, 0), (0, pad)), constant_values=numpy.inf),
+                    numpy.pad(order, ((0, 0), (0, pad)), constant_values=-1))
+
+    class Docstore:
+        def __init__(self, docs):
+            self.docs = docs
+
+        def search(self, doc_id):
+            return self.docs[doc_id]
+
+    def make_store(self, texts):
+        from types import SimpleNamespace
+        embeddings = self.Embeddings()
+        docs = {f"doc-{i}": SimpleNamespace(page_content=text) for i, text in enumerate(texts)}
+        return SimpleNamespace(embeddings=embeddings,
+                               index=self.Index(embeddings.embed_documents(texts)),
+                               docstore=self.Docstore(docs),
+                               index_to_docstore_id={i: f"doc-{i}" for i in range(len(texts))},
+                               _normalize_L2=False)
+
+    def setUp(self):
+        self.store = self.make_store(["fever advice", "cough advice", "rash advice"])
+        self.store.embeddings.calls.clear()
+
+    def test_one_embedding_call_and_one_matrix_query(self):
+        import vector_creator
+        results = vector_creator.batch_similarity_search(self.store, ["rash", "fever", "cough cough"], k=2)
+        self.assertEqual(len(self.store.embeddings.calls), 1)
+        self.assertEqual(self.store.index.searches, 1)
+        self.assertEqual([[doc.page_content for doc, _ in docs][0] for docs in results],
+                         ["rash advice", "fever advice", "cough advice"])
+        self.assertTrue(all(len(docs) == 2 for docs in results))
+        self.assertEqual(results[1][0][1], 0.0)
+
+    def test_missing_neighbours_are_skipped(self):
+        import vector_creator
+        results = vector_creator.batch_similarity_search(self.store, ["fever"], k=5)
+        self.assertEqual(len(results[0]), 3)
+        self.assertEqual(vector_creator.batch_similarity_search(self.store, []), [])
+
+    def test_process_query_batch_answers_each_item_in_order(self):
+        import evaluate_different_modules as modules
+        saved = modules.vector_store
+        modules.vector_store = self.store
+        try:
+            replies = modules.process_query_batch([{"message": "cough"}, {"message": "rash"},
+                                                   {"message": "what is docify"}])
+        finally:
+            modules.vector_store = saved
+        self.assertEqual(len(self.store.embeddings.calls), 1)
+        self.assertTrue(replies[0].startswith("Doc 1: cough advice"))
+        self.assertTrue(replies[1].startswith("Doc 1: rash advice"))
+        self.assertEqual(len(replies), 3)
+
+
+class ServingTests(unittest.TestCase):
+    def test_memory_usage_of_current_process(self):
+        if not Path("/proc/self/status").exists():
+            self.skipTest("/proc not available")
+        usage = serving.memory_usage()
+        self.assertIsNotNone(usage)
+        self.assertGreater(usage["rss"], 0)
+
+    def test_limit_threads_sets_native_thread_env(self):
+        prev = {var: os.environ.get(var) for var in serving.THREAD_ENV_VARS}
+        try:
+            self.assertEqual(serving.limit_threads(2), 2)
+            for var in serving.THREAD_ENV_VARS:
+                self.assertEqual(os.environ[var], "2")
+        finally:
+            for var, value in prev.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+
+
+    def test_gunicorn_config_limits_threads_before_the_app_loads(self):
+        env = {k: v for k, v in os.environ.items()
+               if k not in serving.THREAD_ENV_VARS and not k.startswith("GUNICORN_")}
+        env["WORKER_NATIVE_THREADS"] = "3"
+        script = ("import runpy, os, sys; cfg = runpy.run_path('gunicorn.conf.py'); "
+                  "print(cfg['max_requests'], cfg['max_requests_jitter'], 'numpy' in sys.modules, "
+                  "*(os.environ[v] for v in %r))" % (serving.THREAD_ENV_VARS,))
+        out = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True,
+                             text=True, check=True, cwd=Path(__file__).parent).stdout.split()
+        max_requests, jitter, numpy_loaded, *limits = out
+        self.assertEqual((max_requests, jitter), ("1000", "100"))
+        self.assertEqual(numpy_loaded, "False")
+        self.assertEqual(limits, ["3"] * len(serving.THREAD_ENV_VARS))
+
+
+class RetrievalClientTests(unittest.TestCase):
+    def test_reuses_one_connection(self):
+        stub = StubServer(lambda h: (200, {"reply": h.body["message"]}))
+        client = RetrievalClient(base_url=stub.url)
+        try:
+            for i in range(5):
+                self.assertEqual(client.chat(f"q{i}")["reply"], f"q{i}")
+            self.assertEqual(len(stub.client_ports), 1)
+        finally:
+            client.close()
+            stub.close()
+
+    def test_retries_unavailable_then_succeeds(self):
+        calls = []
+
+        def respond(h):
+            calls.append(1)
+            return (503, {}) if len(calls) < 3 else (200, {"reply": "ok"})
+
+        stub = StubServer(respond)
+        client = RetrievalClient(base_url=stub.url, max_retries=2, backoff=0.001)
+        try:
+            self.assertEqual(client.chat("hi")["reply"], "ok")
+            self.assertEqual(len(calls), 3)
+        finally:
+            client.close()
+            stub.close()
+
+    def test_still_unavailable_after_retries_raises(self):
+        calls = []
+
+        def respond(h):
+            calls.append(1)
+            return 503, {"error": "overloaded"}
+
+        stub = StubServer(respond)
+        client = RetrievalClient(base_url=stub.url, max_retries=2, backoff=0.001)
+        try:
+            with self.assertRaises(requests.HTTPError):
+                client.chat("hi")
+            self.assertEqual(len(calls), 3)
+        finally:
+            client.close()
+            stub.close()
+
+    def test_read_timeout_is_not_retried(self):
+        calls = []
+
+        def respond(h):
+            calls.append(1)
+            time.sleep(0.5)
+            return 200, {"reply": "late"}
+
+        stub = StubServer(respond)
+        client = RetrievalClient(base_url=stub.url, read_timeout=0.1, max_retries=2)
+        try:
+            with self.assertRaises(requests.Timeout):
+                client.chat("hi")
+            self.assertEqual(len(calls), 1)
+        finally:
+            client.close()
+            stub.close()
+
+    def test_in_flight_limit(self):
+        release = threading.Event()
+
+        def respond(h):
+            release.wait(2)
+            return 200, {"reply": "ok"}
+
+        stub = StubServer(respond)
+        client = RetrievalClient(base_url=stub.url, max_in_flight=1, queue_timeout=0.05)
+        worker = threading.Thread(target=client.chat, args=("slow",))
+        try:
+            worker.start()
+            time.sleep(0.1)
+            with self.assertRaises(RetrievalServiceBusy):
+                client.chat("second")
+        finally:
+            release.set()
+            worker.join()
+            client.close()
+            stub.close()
+
+
+class OllamaClientTests(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+        self.release = threading.Event()
+        self.release.set()
+
+        def respond(h):
+            self.requests.append(h.body)
+            self.release.wait(2)
+            if h.body.get("stream"):
+                lines = [{"response": "Hel", "done": False}, {"response": "lo", "done": False}, {"response": "", "done": True}]
+                return 200, "".join(json.dumps(line) + "\n" for line in lines).encode()
+            return 200, {"response": "Hello", "done": True}
+
+        self.stub = StubServer(respond)
+        self.client = OllamaClient(base_url=self.stub.url, keep_alive="10m", max_concurrent=1, queue_timeout=0.05)
+
+    def tearDown(self):
+        self.release.set()
+        self.client.close()
+        self.stub.close()
+
+    def test_generate_sends_keep_alive_over_one_connection(self):
+        self.assertEqual(self.client.generate("hi"), "Hello")
+        self.assertEqual(self.client.generate("again"), "Hello")
+        self.assertEqual(self.requests[0]["keep_alive"], "10m")
+        self.assertEqual(self.requests[0]["model"], "docify")
+        self.assertEqual(len(self.stub.client_ports), 1)
+
+    def test_stream_yields_tokens(self):
+        self.assertEqual(list(self.client.stream("hi")), ["Hel", "lo"])
+        self.assertTrue(self.requests[0]["stream"])
+
+    def test_stream_takes_slot_before_iteration(self):
+        tokens = self.client.stream("hi")
+        self.assertEqual(len(self.requests), 1)  # sent before the first token is asked for
+        with self.assertRaises(OllamaBusy):
+            self.client.stream("second")
+        tokens.close()
+        self.assertEqual(list(self.client.stream("third")), ["Hel", "lo"])
+        self.assertEqual(self.client.generate("fourth"), "Hello")  # slot released after exhaustion
+
+    def test_concurrency_cap(self):
+        self.release.clear()
+        worker = threading.Thread(target=self.client.generate, args=("slow",))
+        worker.start()
+        time.sleep(0.1)
+        try:
+            with self.assertRaises(OllamaBusy):
+                self.client.generate("second")
+        finally:
+            self.release.set()
+            worker.join()
+
+
+class GeminiBackendTests(unittest.TestCase):
+    def setUp(self):
+        self.built = []
+        self.calls = []
+        test = self
+
+        class StubModel:
+            def generate_content(self, prompt, generation_config=None, request_options=None):
+                test.calls.append((prompt, generation_config, request_options))
+                usage = type("Usage", (), {"prompt_token_count": 10, "candidates_token_count": 5, "total_token_count": 15})
+                return type("Response", (), {"text": "stub answer", "usage_metadata": usage})
+
+        def factory(name, config, safety):
+            self.built.append(name)
+            return StubModel()
+
+        self.backend = GeminiBackend(model_factory=factory, deadline=3)
+
+    def test_model_is_built_once(self):
+        self.backend.generate("a")
+        self.backend.generate("b")
+        self.assertEqual(len(self.built), 1)
+
+    def test_budget_and_deadline_per_intent(self):
+        self.assertEqual(self.backend.generate("hi", intent="greeting"), "stub answer")
+        _, config, options = self.calls[0]
+        self.assertEqual(config["max_output_tokens"], self.backend.budgets["greeting"])
+        self.assertEqual(options["timeout"], 3)
+        self.backend.generate("x", intent="unknown-intent")
+        self.assertEqual(self.calls[1][1]["max_output_tokens"], self.backend.budgets["default"])
+
+    def test_usage_is_counted(self):
+        self.backend.generate("a")
+        self.backend.generate("b")
+        stats = self.backend.stats()
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["total_tokens"], 30)
+        self.assertEqual(stats["output_tokens"], 10)
+
+
+class PromptBuilderTests(unittest.TestCase):
+    class Doc:
+        def __init__(self, text):
+            self.page_content = text
+            self.metadata = {"source": "faq.txt", "secret": "METADATA"}
+
+    def test_count_tokens(self):
+        self.assertEqual(prompt_builder.count_tokens("Is my data secure?"), 5)
+
+    def test_packs_by_score_within_budget(self):
+        scored = [
+            ("far chunk about billing and payments", 0.9),
+            ("closest chunk about fever and rest", 0.1),
+            ("middle chunk about medical certificates", 0.5),
+        ]
+        packed = prompt_builder.pack_context(scored, budget=12)
+        self.assertEqual(packed, ["closest chunk about fever and rest", "middle chunk about medical certificates"])
+
+    def test_drops_duplicates_and_trims_splitter_overlap(self):
+        first = "Log in, go to the dashboard, and fill out the form with your symptoms."
+        overlapping = "fill out the form with your symptoms. You can also update past submissions."
+        scored = [(first, 0.1), (first + " ", 0.2), (overlapping, 0.3)]
+        packed = prompt_builder.pack_context(scored, budget=100)
+        self.assertEqual(packed, [first, "You can also update past submissions."])
+
+    def test_prompt_uses_page_content_only(self):
+        prompt = prompt_builder.build_prompt("Be brief.", "Is my data secure?",
+                                             [(self.Doc("Data is stored securely."), 0.2)], "gemini",
+                                             symptoms="cough")
+        self.assertIn("Data is stored securely.", prompt)
+        self.assertIn("User symptoms: cough", prompt)
+        self.assertNotIn("METADATA", prompt)
+        self.assertTrue(prompt.endswith("Question: Is my data secure?"))
+
+
+class SinglePassRagTests(unittest.TestCase):
+    def test_process_query4_generates_once(self):
+        edm = importlib.import_module("evaluate_different_modules")
+        calls = []
+
+        class StubPipeline:
+            tokenizer = type("Tok", (), {"encode": staticmethod(lambda text: text.split())})
+
+            def __call__(self, prompt):
+                calls.append(prompt)
+                return [{"generated_text": "single answer"}]
+
+        original = edm.load_finetuned_pipeline
+        edm.load_finetuned_pipeline = StubPipeline
+        try:
+            self.assertEqual(edm.process_query4("What is Docify?", "cough", mode="single"), "single answer")
+        finally:
+            edm.load_finetuned_pipeline = original
+        self.assertEqual(len(calls), 1)
+        self.assertIn("User symptoms: cough", calls[0])
+
+
+class IntentMatcherTests(unittest.TestCase):
+    def test_greeting_does_not_match_inside_words(self):
+        self.assertNotIn("Welcome to Docify", get_simple_faq_response("this is about my history"))
+        self.assertIn("Welcome to Docify", get_simple_faq_response("Hi!"))
+
+    def test_first_listed_intent_wins(self):
+        matcher = KeywordIntentMatcher([
+            {"name": "first", "phrases": ["good morning"]},
+            {"name": "second", "phrases": ["morning", "fever"]},
+        ])
+        self.assertEqual(matcher.match("Good morning, I have a fever")["name"], "first")
+        self.assertEqual(matcher.match("fever this morning")["name"], "second")
+        self.assertIsNone(matcher.match("goodmorning"))
+
+    def test_unmatched_query_gets_default_reply(self):
+        self.assertIn("What would you like to know?", get_simple_faq_response("hy"))
+
+
+class IntentRouterTests(unittest.TestCase):
+    def setUp(self):
+        self.router = IntentRouter()
+
+    def test_categories_and_tiers(self):
+        cases = {
+            "hello": ("greeting", "canned"),
+            "what's the weather today": ("out_of_scope", "canned"),
+            "is my data secure?": ("platform_faq", "faq"),
+            "hi, I have had a cough for a week": ("medical", "llm"),
+            "my stomach feels strange after lunch": ("medical", "llm"),
+        }
+        for query, expected in cases.items():
+            category, tier, _ = self.router.route(query)
+            self.assertEqual((category, tier), expected, query)
+
+    def test_generic_phrases_do_not_route_medical_questions_to_faq(self):
+        for query in ("What is the treatment for malaria?", "what is a normal heart rate",
+                      "my chest hurts, please help", "hi, what is a normal heart rate for a child?",
+                      "can you help me understand my blood test data", "who should I contact about my rash"):
+            self.assertEqual(self.router.route(query)[:2], ("medical", "llm"), query)
+
+    def test_medical_questions_with_off_topic_words_are_not_refused(self):
+        for query in ("I hurt my knee playing football, what should I do",
+                      "Can coding all night cause eye strain?",
+                      "I feel stressed about the election and cannot sleep"):
+            self.assertEqual(self.router.route(query)[:2], ("medical", "llm"), query)
+        self.assertEqual(self.router.route("tell me a joke")[0], "out_of_scope")
+
+    def test_platform_questions_still_use_faq(self):
+        cases = {
+            "What is Docify?": "platform_overview",
+            "how do I contact the support team": "contact_support",
+            "how do I describe my symptoms in the form?": "describe_symptoms",
+            "how to submit a consultation": "submit_consultation",
+            "hello there": "greeting",
+        }
+        for query, name in cases.items():
+            self.assertEqual(self.router.route(query)[2]["name"], name, query)
+
+    def test_medical_without_llm_uses_retrieval(self):
+        self.assertEqual(self.router.route("I have diabetes", llm_available=False)[1], "retrieval")
+
+    def test_classification_is_sub_millisecond(self):
+        query = "Can I get a medical certificate for my migraine and how long does it take?"
+        started = time.perf_counter()
+        for _ in range(1000):
+            self.router.route(query)
+        self.assertLess((time.perf_counter() - started) / 1000, 0.001)
+
+    def test_decisions_reported_on_metrics(self):
+        client = app.test_client()
+        client.post("/chatbot", json={"message": "good morning"})
+        snapshot = client.get("/metrics").get_json()
+        self.assertGreaterEqual(snapshot["counters"].get("router.category.greeting", 0), 1)
+        self.assertIn("router.classify_seconds", snapshot["timers"])
+
+
+class QueryNormalizerTests(unittest.TestCase):
+    def test_folds_unicode_case_and_whitespace(self):
+        self.assertEqual(query_normalizer.normalize("  Ｗhat IS\tDocify?  "), "what is docify?")
+
+    def test_corrects_typos_from_query_log(self):
+        self.assertEqual(query_normalizer.normalize("Medical certificat"), "medical certificate")
+        self.assertEqual(query_normalizer.normalize("summerized answer"), "summarized answer")
+        self.assertEqual(query_normalizer.normalize("update my consulation"), "update my consultation")
+
+    def test_leaves_known_and_short_words_alone(self):
+        for query in ["my stomach feels weird", "i need leave for 2 days", "hi"]:
+            self.assertEqual(query_normalizer.normalize(query), query)
+
+    def test_valid_words_outside_faq_vocabulary_are_kept(self):
+        for query in ["my child swallowed bleach, help", "where is the pain", "is it cancer",
+                      "fracture of the shoulder", "liver pain", "i am pregnant", "dysuria since monday"]:
+            self.assertEqual(query_normalizer.normalize(query), query)
+
+    def test_backends_and_history_get_the_raw_query(self):
+        saved = {name: getattr(app_module, name) for name in
+                 ("ADVANCED_MODULES_AVAILABLE", "GEMINI_READY", "process_query5")}
+        seen = []
+        app_module.ADVANCED_MODULES_AVAILABLE = True
+        app_module.GEMINI_READY = True
+        app_module.process_query5 = lambda query, symptoms=None, intent=None, history=None: seen.append(query) or "ok"
+        client = app.test_client()
+        try:
+            client.post("/chatbot", json={"message": "My child swalowed bleach"})
+            with client.session_transaction() as sess:
+                history = app_module.conversation_memory.history(sess["conversation_id"])
+        finally:
+            for name, value in saved.items():
+                setattr(app_module, name, value)
+        self.assertEqual(seen, ["My child swalowed bleach"])
+        self.assertIn("User: My child swalowed bleach", history)
+
+    def test_typo_still_reaches_keyword_intent(self):
+        r = app.test_client().post("/chatbot", json={"message": "Where is my consulation?"})
+        self.assertIn("To submit a consultation form", r.get_json()["reply"])
+
+
+class ConversationMemoryTests(unittest.TestCase):
+    def test_recent_turns_verbatim_older_turns_summarized(self):
+        memory = ConversationMemory(max_turns=2, token_budget=200)
+        memory.add_turn("s1", "I have a rash on my arm. It itches.", "See a dermatologist.")
+        memory.add_turn("s1", "Is my data secure?", "Yes.")
+        memory.add_turn("s1", "How do I contact support?", "Email support.")
+        history = memory.history("s1")
+        self.assertTrue(history.startswith("Earlier the user asked about: I have a rash on my arm."))
+        self.assertNotIn("It itches", history)
+        self.assertIn("User: Is my data secure?", history)
+        self.assertIn("User: How do I contact support?", history)
+        self.assertEqual(memory.history("other-session"), "")
+
+    def test_history_never_exceeds_budget(self):
+        memory = ConversationMemory(max_turns=4, token_budget=80)
+        for i in range(50):
+            memory.add_turn("s1", f"question number {i} about fevers and certificates " * 5, "long answer " * 100)
+            self.assertLessEqual(prompt_builder.count_tokens(memory.history("s1")), 80)
+
+    def test_sqlite_store_shares_history_between_processes(self):
+        now = [1000.0]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "chat_state.db")
+            # Two instances stand in for two gunicorn workers
+            first = ConversationMemory(store=SQLiteStore(path, "conversations", ttl=60, clock=lambda: now[0]))
+            second = ConversationMemory(store=SQLiteStore(path, "conversations", ttl=60, clock=lambda: now[0]))
+            first.add_turn("s1", "I have a fever.", "Rest and drink fluids.")
+            second.add_turn("s1", "It started yesterday.", "Monitor it.")
+            history = first.history("s1")
+            self.assertIn("User: I have a fever.", history)
+            self.assertIn("User: It started yesterday.", history)
+            second.clear("s1")
+            self.assertEqual(first.history("s1"), "")
+            first.add_turn("s2", "Hello", "Hi")
+            now[0] += 61
+            self.assertEqual(second.history("s2"), "")
+
+    def test_ttl_cache_expires_and_evicts(self):
+        now = [0.0]
+        cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("a"))
+        now[0] = 11
+        self.assertIsNone(cache.get("b"))
+
+    def test_chatbot_remembers_session(self):
+        client = app.test_client()
+        client.post("/chatbot", json={"message": "hello"})
+        client.post("/chatbot", json={"message": "is my data secure"})
+        with client.session_transaction() as sess:
+            conversation_id = sess["conversation_id"]
+        history = app_module.conversation_memory.history(conversation_id)
+        self.assertIn("User: hello", history)
+        self.assertIn("User: is my data secure", history)
+
+
+class DatabaseProfileTests(unittest.TestCase):
+    def test_sqlite_pragmas_applied_on_connect(self):
+        with app.app_context():
+            journal_mode = db.session.execute(db.text("PRAGMA journal_mode")).scalar()
+            synchronous = db.session.execute(db.text("PRAGMA synchronous")).scalar()
+            busy_timeout = db.session.execute(db.text("PRAGMA busy_timeout")).scalar()
+        self.assertEqual(journal_mode, "wal")
+        self.assertEqual(synchronous, 1)  # NORMAL
+        self.assertEqual(busy_timeout, db_config.BUSY_TIMEOUT_MS)
+
+    def test_engine_options_for_memory_database(self):
+        self.assertNotIn("pool_size", db_config.engine_options("sqlite://"))
+        self.assertTrue(db_config.engine_options("sqlite:///x.db")["pool_pre_ping"])
+
+    def test_busy_write_is_retried(self):
+        class Session:
+            rollbacks = 0
+
+            def rollback(self):
+                self.rollbacks += 1
+
+        attempts = []
+
+        def work():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise OperationalError("INSERT", {}, Exception("database is locked"))
+            return "saved"
+
+        session = Session()
+        self.assertEqual(db_config.run_with_busy_retry(session, work, retries=3, backoff=0), "saved")
+        self.assertEqual((len(attempts), session.rollbacks), (3, 2))
+
+    def test_other_operational_errors_are_not_retried(self):
+        def work():
+            raise OperationalError("SELECT", {}, Exception("no such table: x"))
+
+        with app.app_context(), self.assertRaises(OperationalError):
+            db_config.run_with_busy_retry(db.session, work, retries=3, backoff=0)
+
+
+class ReadReplicaTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.mkdtemp()
+        cls.flask_app = Flask("replica_test")
+        cls.flask_app.config.update(db_config.database_config(
+            f"sqlite:///{os.path.join(directory, 'primary.db')}",
+            f"sqlite:///{os.path.join(directory, 'replica.db')}",
+        ))
+        cls.flask_app.secret_key = "test"
+        cls.db = SQLAlchemy(cls.flask_app, session_options={"class_": db_config.RoutingSession})
+
+        class Note(cls.db.Model):
+            id = cls.db.Column(cls.db.Integer, primary_key=True)
+            text = cls.db.Column(cls.db.String(50))
+
+        cls.Note = Note
+        with cls.flask_app.app_context():
+            cls.db.create_all()
+            Note.__table__.create(cls.db.engines[db_config.REPLICA_BIND])
+            # The "replica" lags behind: it only ever has this row
+            with cls.db.engines[db_config.REPLICA_BIND].begin() as conn:
+                conn.execute(Note.__table__.insert(), {"text": "replicated"})
+            cls.db.session.add(Note(text="primary only"))
+            cls.db.session.commit()
+
+    def test_reads_go_to_replica_only_inside_use_replica(self):
+        with self.flask_app.app_context():
+            with db_config.use_replica():
+                self.assertEqual([n.text for n in self.Note.query.all()], ["replicated"])
+            self.assertEqual(self.Note.query.first().text, "primary only")
+
+    def test_session_reads_from_primary_after_writing(self):
+        with self.flask_app.app_context(), db_config.use_replica():
+            self.db.session.add(self.Note(text="new"))
+            self.db.session.flush()
+            self.assertEqual(self.Note.query.filter_by(text="new").count(), 1)
+            self.db.session.rollback()
+
+    def test_browser_session_stays_on_primary_after_write(self):
+        with self.flask_app.test_request_context():
+            with db_config.replica_reads():
+                self.assertEqual(self.Note.query.count(), 1)
+                self.assertEqual(self.Note.query.first().text, "replicated")
+            self.db.session.add(self.Note(text="mine"))
+            self.db.session.commit()
+            self.db.session.remove()
+            with db_config.replica_reads():
+                self.assertTrue(self.Note.query.filter_by(text="mine").first())
+
+    def test_database_config_without_replica(self):
+        config = db_config.database_config("postgres://u@h/db", "")
+        self.assertEqual(config["SQLALCHEMY_DATABASE_URI"], "postgresql://u@h/db")
+        self.assertEqual(config["SQLALCHEMY_BINDS"], {})
+
+
+class ConsultationPaginationTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            drop_test_tables()
+
+    def setUp(self):
+        self.client = app.test_client()
+        email = f"pages_{time.time()}@example.com"
+        self.client.post("/register", data={"name": "Pages", "phone": "1", "email": email, "password": "pw"})
+        self.client.post("/login", data={"email": email, "password": "pw"})
+        with app.app_context():
+            self.user_id = User.query.filter_by(email=email).first().id
+            # Ties on created_at are broken by id
+            same_time = datetime(2024, 1, 1, 12, 0, 0)
+            db.session.add_all([Consultation(user_id=self.user_id, symptoms=f"symptom {i}",
+                                             created_at=same_time if i < 10 else datetime(2024, 1, 2, 0, 0, i))
+                                for i in range(45)])
+            db.session.commit()
+
+    def fetch_all(self, limit):
+        seen, cursor, pages = [], None, 0
+        while True:
+            r = self.client.get("/api/consultations", query_string={"limit": limit, "cursor": cursor or ""})
+            self.assertEqual(r.status_code, 200)
+            body = r.get_json()
+            seen.extend(item["symptoms"] for item in body["items"])
+            pages += 1
+            cursor = body["next_cursor"]
+            if not cursor:
+                return seen, pages
+
+    def test_api_walks_every_row_once_newest_first(self):
+        seen, pages = self.fetch_all(limit=20)
+        self.assertEqual(pages, 3)
+        expected = [f"symptom {i}" for i in range(44, 9, -1)] + [f"symptom {i}" for i in range(9, -1, -1)]
+        self.assertEqual(seen, expected)
+
+    def test_api_etag_returns_304_until_data_changes(self):
+        first = self.client.get("/api/consultations")
+        etag = first.headers["ETag"]
+        again = self.client.get("/api/consultations", headers={"If-None-Match": etag})
+        self.assertEqual(again.status_code, 304)
+        self.client.post("/dashboard", data={"symptoms": "New cough"})
+        changed = self.client.get("/api/consultations", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.get_json()["items"][0]["symptoms"], "New cough")
+
+    def test_api_rejects_bad_cursor_and_anonymous_users(self):
+        self.assertEqual(self.client.get("/api/consultations?cursor=garbage").status_code, 400)
+        self.assertEqual(app.test_client().get("/api/consultations").status_code, 401)
+
+    def test_dashboard_pages_with_cursor_link(self):
+        r = self.client.get("/dashboard")
+        self.assertIn(b"symptom 44", r.data)
+        self.assertNotIn(b"symptom 5<", r.data)
+        self.assertIn(b"Older consultations", r.data)
+
+    def test_legacy_rows_without_created_at_are_paged_last(self):
+        # Tables created before created_at was required can hold NULLs
+        from sqlalchemy import Column, DateTime, Integer, create_engine
+        from sqlalchemy.orm import Session, declarative_base
+        Base = declarative_base()
+
+        class LegacyConsultation(Base):
+            __tablename__ = "legacy_consultation"
+            id = Column(Integer, primary_key=True)
+            created_at = Column(DateTime, nullable=True)
+
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        with Session(engine) as session:
+            session.add_all([LegacyConsultation(id=i, created_at=None if i % 2 else datetime(2024, 1, i))
+                             for i in range(1, 8)])
+            session.commit()
+            seen, cursor = [], None
+            while True:
+                rows, cursor = pagination.keyset_page(session.query(LegacyConsultation), LegacyConsultation, 2, cursor)
+                seen.extend(row.id for row in rows)
+                if not cursor:
+                    break
+        self.assertEqual(seen, [6, 4, 2, 7, 5, 3, 1])
+        self.assertEqual(pagination.decode_cursor(pagination.encode_cursor(None, 5)), (None, 5))
+
+    def test_cursor_pages_seek_the_created_at_index(self):
+        from sqlalchemy import event
+        plans = []
+
+        def explain(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().startswith("SELECT"):
+                raw = conn.connection.driver_connection
+                plans.extend(row[-1] for row in raw.execute("EXPLAIN QUERY PLAN " + statement, parameters))
+
+        with app.app_context():
+            cursor = pagination.encode_cursor(datetime(2024, 1, 2, 0, 0, 30), 10 ** 9)
+            event.listen(db.engine, "before_cursor_execute", explain)
+            try:
+                pagination.keyset_page(Consultation.query.filter_by(user_id=self.user_id), Consultation, 5, cursor)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", explain)
+        self.assertTrue(any("created_at<?" in plan for plan in plans), plans)
+
+
+class UserExportTests(unittest.TestCase):
+    def setUp(self):
+        self.users = []
+        self.loads = []
+        self.path = os.path.join(tempfile.mkdtemp(), "users.csv")
+
+    def load_users(self, after_id, limit):
+        self.loads.append(after_id)
+        return [u for u in self.users if u["id"] > after_id][:limit]
+
+    def add_users(self, *ids):
+        self.users.extend({"id": i, "name": f"n{i}", "phone": "1", "email": f"u{i}@example.com"} for i in ids)
+
+    def exporter(self):
+        return UserCsvExporter(self.path, self.load_users, snapshot_interval=3600)
+
+    def test_appends_only_users_above_high_water_mark(self):
+        exporter = self.exporter()
+        self.add_users(1, 2)
+        self.assertEqual(exporter.export_new(), 2)  # first run writes a snapshot
+        self.add_users(3)
+        self.loads.clear()
+        self.assertEqual(exporter.export_new(), 1)
+        self.assertNotIn(0, self.loads)  # no full reload
+        self.assertEqual(exporter.high_water_mark(), 3)
+        lines = Path(self.path).read_text().splitlines()
+        self.assertEqual(lines[0], "id,name,phone,email")
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["1", "2", "3"])
+
+    def test_resumes_from_saved_high_water_mark(self):
+        self.add_users(1, 2)
+        self.exporter().export_new()
+        self.add_users(3, 4)
+        self.assertEqual(self.exporter().export_new(), 2)
+        self.assertEqual(len(Path(self.path).read_text().splitlines()), 5)
+
+    def test_snapshot_rewrites_atomically(self):
+        self.add_users(*range(1, 2501))
+        exporter = self.exporter()
+        self.assertEqual(exporter.snapshot(), 2500)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.path))),
+                         ["users.csv", "users.csv.hwm", "users.csv.lock"])
+
+    def test_reset_table_triggers_snapshot(self):
+        self.add_users(1, 2, 3)
+        exporter = self.exporter()
+        exporter.export_new()
+        self.users = []
+        self.add_users(1)
+        exporter.export_new()
+        self.assertEqual(len(Path(self.path).read_text().splitlines()), 2)
+
+    def test_background_worker_exports_after_notify(self):
+        exporter = self.exporter()
+        self.add_users(1)
+        exporter.notify()
+        deadline = time.time() + 5
+        while exporter.high_water_mark() != 1 and time.time() < deadline:
+            time.sleep(0.01)
+        exporter.worker.stop()
+        self.assertEqual(exporter.high_water_mark(), 1)
+
+
+class QueryLogTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def logger(self, name="queries.csv", **kwargs):
+        kwargs.setdefault("fmt", name.rsplit(".", 1)[1])
+        return QueryLogger(path=os.path.join(self.directory, name), **kwargs)
+
+    def test_csv_escapes_commas_and_newlines(self):
+        import csv
+        logger = self.logger()
+        logger.log('fever, cough\nand "chills"', user_id=7, latency=0.25)
+        logger.log("hello")
+        self.assertEqual(logger.flush(), 2)
+        with open(logger.path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(rows[0]["query"], 'fever, cough\nand "chills"')
+        self.assertEqual((rows[0]["user_id"], rows[0]["latency_ms"]), ("7", "250.0"))
+        self.assertEqual(rows[1]["user_id"], "")
+
+    def test_ndjson_records(self):
+        logger = self.logger("queries.ndjson")
+        logger.log("hi", user_id=3, latency=0.001)
+        logger.flush()
+        record = json.loads(Path(logger.path).read_text().splitlines()[0])
+        self.assertEqual((record["query"], record["user_id"], record["latency_ms"]), ("hi", 3, 1.0))
+
+    def test_rotates_and_compresses(self):
+        import gzip
+        logger = self.logger(max_bytes=200, backups=2)
+        for batch in range(4):
+            for i in range(5):
+                logger.log(f"batch {batch} query {i}")
+            logger.flush()
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual(names, ["queries.csv", "queries.csv.1.gz", "queries.csv.2.gz", "queries.csv.lock"])
+        with gzip.open(os.path.join(self.directory, "queries.csv.1.gz"), "rt") as f:
+            self.assertIn("batch 2 query 4", f.read())
+
+    def test_rotates_away_headerless_legacy_file(self):
+        path = os.path.join(self.directory, "queries.csv")
+        Path(path).write_text("old query\n")
+        logger = self.logger()
+        logger.log("new query")
+        logger.flush()
+        self.assertTrue(Path(path).read_text().startswith("timestamp,user_id,latency_ms,query\n"))
+        self.assertTrue(os.path.exists(path + ".1.gz"))
+
+    def test_sheds_load_when_queue_is_full(self):
+        logger = self.logger(queue_size=10, batch_size=1000, overload_sample=2)
+        before = app_module.metrics.snapshot()["counters"]
+        for i in range(30):
+            logger.log(f"q{i}")
+        after = app_module.metrics.snapshot()["counters"]
+        self.assertEqual(logger.pending(), 10)
+        self.assertGreater(after.get("query_log.sampled_out", 0), before.get("query_log.sampled_out", 0))
+        self.assertGreater(after.get("query_log.dropped", 0), before.get("query_log.dropped", 0))
+
+    def test_log_does_not_touch_the_file(self):
+        logger = self.logger(queue_size=20000, batch_size=100000, flush_interval=3600)
+        start = time.perf_counter()
+        for i in range(10000):
+            logger.log(f"query {i}", user_id=1, latency=0.01)
+        self.assertLess((time.perf_counter() - start) / 10000, 0.001)
+        self.assertFalse(os.path.exists(logger.path))
+        logger.worker.stop()
+        self.assertEqual(len(Path(logger.path).read_text().splitlines()), 10001)
+
+
+class BulkExportTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.create_all()
+            user = User(name="Export, Tester", phone="1", email=f"export_{time.time()}@example.com", password="hash")
+            db.session.add(user)
+            db.session.flush()
+            db.session.add_all([Consultation(user_id=user.id, symptoms=f"line {i}\nwith, comma") for i in range(25)])
+            db.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            drop_test_tables()
+
+    def setUp(self):
+        self.original_token = app_module.ADMIN_TOKEN
+        app_module.ADMIN_TOKEN = "secret"
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app_module.ADMIN_TOKEN = self.original_token
+
+    def test_requires_admin_token(self):
+        self.assertEqual(self.client.get("/admin/export/users").status_code, 403)
+        r = self.client.get("/admin/export/users", headers={"X-Admin-Token": "wrong"})
+        self.assertEqual(r.status_code, 403)
+
+    def test_streams_csv_without_password_hashes(self):
+        import csv
+        r = self.client.get("/admin/export/consultations", headers={"X-Admin-Token": "secret"}, buffered=False)
+        self.assertTrue(r.is_streamed)
+        rows = list(csv.DictReader(io.StringIO(r.get_data(as_text=True))))
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[3]["symptoms"], "line 3\nwith, comma")
+        users = self.client.get("/admin/export/users", headers={"X-Admin-Token": "secret"}).get_data(as_text=True)
+        self.assertIn('"Export, Tester"', users)
+        self.assertNotIn("password", users)
+
+    def test_gzipped_ndjson(self):
+        import gzip
+        r = self.client.get("/admin/export/consultations?format=ndjson&gzip=1", headers={"X-Admin-Token": "secret"})
+        self.assertEqual(r.mimetype, "application/gzip")
+        lines = gzip.decompress(r.data).decode().splitlines()
+        self.assertEqual(json.loads(lines[0])["symptoms"], "line 0\nwith, comma")
+        self.assertEqual(len(lines), 25)
+
+    def test_rows_are_fetched_in_chunks(self):
+        with app.app_context():
+            chunks = list(bulk_export.iter_rows(db.session, app_module.EXPORT_TABLES["consultations"], chunk_size=10))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+
+    def test_cli_writes_gzip_file(self):
+        import gzip
+        output = os.path.join(tempfile.mkdtemp(), "consultations.csv.gz")
+        result = app.test_cli_runner().invoke(args=["export", "consultations", "--output", output])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with gzip.open(output, "rt", newline="") as f:
+            self.assertEqual(f.readline().strip(), "id,user_id,symptoms,created_at")
+
+
+class BulkImportTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            drop_test_tables()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.prefix = f"imp{time.time_ns()}"
+
+    def write_csv(self, name, header, rows):
+        import csv
+        path = os.path.join(self.directory, name)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        return path
+
+    def email(self, i):
+        return f"{self.prefix}_{i}@example.com"
+
+    def test_imports_users_in_batches_and_dedupes(self):
+        existing = self.email("existing")
+        with app.app_context():
+            db.session.add(User(name="Old", phone="1", email=existing, password="x"))
+            db.session.commit()
+        rows = [["User", "1", self.email(i), "", "pbkdf2:sha256:1$salt$hash"] for i in range(7)]
+        rows += [["Dup", "1", self.email(3), "", "pbkdf2:sha256:1$salt$hash"], ["Old", "1", existing, "pw", ""],
+                 ["Plain", "1", self.email("plain"), "secret", ""]]
+        path = self.write_csv("users.csv", ["name", "phone", "email", "password", "password_hash"], rows)
+        result = app.test_cli_runner().invoke(args=["import", "users", path, "--batch-size", "3", "--workers", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 8 users, skipped 2.", result.output)
+        self.assertIn("10 rows: 8 inserted, 2 skipped", result.output)
+        with app.app_context():
+            self.assertEqual(bulk_import.Checkpoint(db.session, path).load(), 0)
+        with app.app_context():
+            plain = User.query.filter_by(email=self.email("plain")).first()
+            self.assertTrue(check_password_hash(plain.password, "secret"))
+            self.assertEqual(User.query.filter(User.email.like(f"{self.prefix}%")).count(), 9)  # 8 + existing
+
+    def test_resumes_from_checkpoint(self):
+        rows = [["User", "1", self.email(i), "", "pbkdf2:sha256:1$salt$hash"] for i in range(5)]
+        path = self.write_csv("users.csv", ["name", "phone", "email", "password", "password_hash"], rows)
+        with app.app_context():
+            bulk_import.Checkpoint(db.session, path).save(3)
+            db.session.commit()
+        result = app.test_cli_runner().invoke(args=["import", "users", path, "--workers", "1"])
+        self.assertIn("Imported 2 users", result.output)
+        with app.app_context():
+            self.assertIsNone(User.query.filter_by(email=self.email(0)).first())
+            self.assertIsNotNone(User.query.filter_by(email=self.email(4)).first())
+
+    def test_unknown_hash_without_password_is_skipped(self):
+        rows = [["Bcrypt", "1", self.email("bcrypt"), "", "$2b$12$abcdefghijklmnopqrstuv"],
+                ["Rehash", "1", self.email("rehash"), "secret", "$2b$12$abcdefghijklmnopqrstuv"]]
+        path = self.write_csv("users.csv", ["name", "phone", "email", "password", "password_hash"], rows)
+        result = app.test_cli_runner().invoke(args=["import", "users", path, "--workers", "1"])
+        self.assertIn("Imported 1 users, skipped 1.", result.output)
+        with app.app_context():
+            self.assertIsNone(User.query.filter_by(email=self.email("bcrypt")).first())
+            rehashed = User.query.filter_by(email=self.email("rehash")).first()
+            self.assertTrue(check_password_hash(rehashed.password, "secret"))
+
+    def test_crash_after_a_batch_commit_does_not_duplicate_rows(self):
+        with app.app_context():
+            db.session.add(User(name="C", phone="1", email=self.email("crash"), password="x"))
+            db.session.commit()
+        path = self.write_csv("consultations.csv", ["email", "symptoms"],
+                              [[self.email("crash"), f"Symptom {i}"] for i in range(5)])
+
+        def crash(stats):
+            raise KeyboardInterrupt
+
+        with app.app_context():
+            with self.assertRaises(KeyboardInterrupt):
+                bulk_import.import_consultations(db.session, User.__table__, Consultation.__table__, path,
+                                                 batch_size=2, progress=crash)
+            db.session.rollback()
+            stats = bulk_import.import_consultations(db.session, User.__table__, Consultation.__table__, path,
+                                                     batch_size=2)
+            self.assertEqual(stats["resumed_at"], 2)
+            user = User.query.filter_by(email=self.email("crash")).first()
+            self.assertEqual(sorted(c.symptoms for c in user.consultations), [f"Symptom {i}" for i in range(5)])
+
+    def test_imports_consultations_by_email(self):
+        with app.app_context():
+            db.session.add(User(name="C", phone="1", email=self.email("c"), password="x"))
+            db.session.commit()
+        path = self.write_csv("consultations.csv", ["email", "symptoms", "created_at"], [
+            [self.email("c"), "Cough", "2024-05-01T10:00:00"],
+            [self.email("unknown"), "Fever", ""],
+        ])
+        result = app.test_cli_runner().invoke(args=["import", "consultations", path])
+        self.assertIn("Imported 1 consultations, skipped 1.", result.output)
+        with app.app_context():
+            user = User.query.filter_by(email=self.email("c")).first()
+            self.assertEqual([c.symptoms for c in user.consultations], ["Cough"])
+
+    def test_missing_columns_are_reported(self):
+        path = self.write_csv("bad.csv", ["email"], [["a@example.com"]])
+        result = app.test_cli_runner().invoke(args=["import", "users", path])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("missing columns: name, phone", result.output)
+
+
+class PasswordHashingTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            drop_test_tables()
+
+    def test_needs_rehash_when_parameters_change(self):
+        self.assertTrue(password_hashing.needs_rehash(generate_password_hash("pw", "pbkdf2:sha256:1000")))
+        self.assertFalse(password_hashing.needs_rehash(f"{password_hashing._full_method('pbkdf2:sha256')}$s$h"))
+
+    def test_pool_runs_in_other_process_and_records_metrics(self):
+        pool = HashingPool(workers=1, queue_limit=1)
+        cheap = generate_password_hash("pw", "pbkdf2:sha256:1000")
+        self.assertTrue(pool.verify(cheap, "pw"))
+        self.assertFalse(pool.verify(cheap, "nope"))
+        timers = app_module.metrics.snapshot()["timers"]
+        self.assertIn("password_hash.queue_wait", timers)
+        self.assertIn("password_hash.compute", timers)
+        pool._executor.shutdown()
+
+    def test_full_pool_sheds(self):
+        pool = HashingPool(workers=0, queue_limit=1)
+        pool._slots.acquire()
+        pool._slots.acquire()
+        with self.assertRaises(HashingBusy):
+            pool.hash("pw")
+
+    def test_timed_out_hash_keeps_its_slot_until_it_finishes(self):
+        pool = HashingPool(workers=1, queue_limit=0, timeout=0.1)
+        with self.assertRaisesRegex(HashingBusy, "did not finish"):
+            pool._run(time.sleep, 1)
+        # The sleep is still running in the pool process, so the only slot stays taken
+        with self.assertRaisesRegex(HashingBusy, "queue is full"):
+            pool._run(time.sleep, 0)
+        deadline = time.monotonic() + 10
+        while pool._in_flight and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertIsNone(pool._run(time.sleep, 0))
+        pool._executor.shutdown()
+
+    def test_pool_started_with_other_threads_does_not_fork(self):
+        done = threading.Event()
+        thread = threading.Thread(target=done.wait)
+        thread.start()
+        try:
+            self.assertNotEqual(password_hashing._mp_context().get_start_method(), "fork")
+        finally:
+            done.set()
+            thread.join()
+
+    def test_login_answers_503_when_hashing_is_saturated(self):
+        class BusyPool:
+            def verify(self, *args):
+                raise HashingBusy("busy")
+
+        email = f"busy_{time.time()}@example.com"
+        with app.app_context():
+            db.session.add(User(name="B", phone="1", email=email, password="x"))
+            db.session.commit()
+        original = app_module.hashing_pool
+        app_module.hashing_pool = BusyPool()
+        try:
+            r = app.test_client().post("/login", data={"email": email, "password": "pw"})
+        finally:
+            app_module.hashing_pool = original
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual(r.headers["Retry-After"], "2")
+
+    def test_login_upgrades_old_hash(self):
+        email = f"rehash_{time.time()}@example.com"
+        with app.app_context():
+            db.session.add(User(name="R", phone="1", email=email, password=generate_password_hash("pw", "pbkdf2:sha256:1000")))
+            db.session.commit()
+        r = app.test_client().post("/login", data={"email": email, "password": "pw"})
+        self.assertEqual(r.status_code, 302)
+        with app.app_context():
+            stored = User.query.filter_by(email=email).first().password
+        self.assertFalse(password_hashing.needs_rehash(stored))
+        self.assertTrue(check_password_hash(stored, "pw"))
+
+
+class IPAllowlistTests(unittest.TestCase):
+    def test_ranges_are_merged_and_sorted(self):
+        starts, ends = compile_ranges(["10.0.1.0/24", "10.0.0.0/24", "10.0.0.128/25", "bogus"])[4]
+        self.assertEqual((starts, ends), ([167772160], [167772671]))  # 10.0.0.0 - 10.0.1.255
+
+    def test_ipv4_ipv6_and_mapped_addresses(self):
+        allowlist = IPAllowlist(["192.168.0.0/16", "2001:db8::/32"])
+        self.assertTrue(allowlist.allows("192.168.4.2"))
+        self.assertFalse(allowlist.allows("192.169.0.1"))
+        self.assertTrue(allowlist.allows("2001:db8::1"))
+        self.assertFalse(allowlist.allows("2001:db9::1"))
+        self.assertTrue(allowlist.allows("::ffff:192.168.1.1"))
+        self.assertFalse(allowlist.allows("not-an-ip"))
+
+    def test_thousands_of_entries_match_linear_scan(self):
+        import ipaddress
+        import random
+        rng = random.Random(7)
+        entries = [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/{rng.choice([16, 24, 28])}"
+                   for _ in range(3000)]
+        networks = [ipaddress.ip_network(e, strict=False) for e in entries]
+        allowlist = IPAllowlist(entries)
+        for _ in range(300):
+            ip = ipaddress.ip_address(rng.getrandbits(32))
+            self.assertEqual(allowlist.allows(str(ip)), any(ip in n for n in networks), str(ip))
+
+    def test_file_is_reloaded_when_it_changes(self):
+        path = os.path.join(tempfile.mkdtemp(), "allow.txt")
+        Path(path).write_text("# office\n10.1.0.0/16\n")
+        now = [0.0]
+        allowlist = IPAllowlist([], path=path, reload_interval=5, clock=lambda: now[0])
+        self.assertTrue(allowlist.allows("10.1.2.3"))
+        Path(path).write_text("10.2.0.0/16\n")
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+        self.assertTrue(allowlist.allows("10.1.2.3"))  # not re-checked yet
+        now[0] = 6
+        self.assertFalse(allowlist.allows("10.1.2.3"))
+        self.assertTrue(allowlist.allows("10.2.0.1"))
+
+
+class AdmissionControlTests(unittest.TestCase):
+    def wait_until(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.005)
+
+    def test_waiter_is_shed_after_deadline(self):
+        controller = AdmissionController("t1", concurrency=1, queue=4, queue_timeout=0.1)
+        with controller.admit():
+            with self.assertRaises(Overloaded) as raised:
+                with controller.admit():
+                    pass
+        self.assertEqual(raised.exception.retry_after, 1)
+        self.assertEqual(app_module.metrics.snapshot()["counters"]["admission.t1.shed"], 1)
+        with controller.admit():  # the slot was given back
+            pass
+
+    def test_authenticated_requests_go_first(self):
+        controller = AdmissionController("t2", concurrency=1, queue=4, queue_timeout=5)
+        order = []
+
+        def request(label, priority):
+            with controller.admit(priority=priority):
+                order.append(label)
+
+        with controller.admit():
+            anonymous = threading.Thread(target=request, args=("anonymous", False))
+            anonymous.start()
+            self.wait_until(lambda: len(controller._waiting) == 1)
+            authenticated = threading.Thread(target=request, args=("authenticated", True))
+            authenticated.start()
+            self.wait_until(lambda: len(controller._waiting) == 2)
+        anonymous.join()
+        authenticated.join()
+        self.assertEqual(order, ["authenticated", "anonymous"])
+
+    def test_anonymous_requests_only_fill_half_the_queue(self):
+        controller = AdmissionController("t3", concurrency=1, queue=2, queue_timeout=0.3)
+        with controller.admit():
+            waiter = threading.Thread(target=lambda: self.assertRaises(Overloaded, controller.admit().__enter__))
+            waiter.start()
+            self.wait_until(lambda: len(controller._waiting) == 1)
+            started = time.monotonic()
+            with self.assertRaises(Overloaded):
+                with controller.admit():
+                    pass
+            self.assertLess(time.monotonic() - started, 0.1)  # shed at once, no waiting
+            self.assertEqual(app_module.metrics.snapshot()["gauges"]["admission.t3.queued"], 1)
+            waiter.join()
+
+    def test_chatbot_degrades_or_rejects_when_saturated(self):
+        saved = {name: getattr(app_module, name, None) for name in
+                 ("ADVANCED_MODULES_AVAILABLE", "process_query", "ADMISSION_OVERLOAD_MODE")}
+        saved_controller = app_module.admission["retrieval"]
+        app_module.ADVANCED_MODULES_AVAILABLE = True
+        app_module.process_query = lambda query, symptoms: "model answer"
+        app_module.admission["retrieval"] = AdmissionController("full", concurrency=0, queue=0, queue_timeout=1)
+        client = app.test_client()
+        try:
+            app_module.ADMISSION_OVERLOAD_MODE = "degrade"
+            r = client.post("/chatbot", json={"message": "I have a fever"})
+            self.assertEqual(r.status_code, 200)
+            self.assertNotEqual(r.get_json()["reply"], "model answer")
+            app_module.ADMISSION_OVERLOAD_MODE = "reject"
+            r = client.post("/chatbot", json={"message": "I have a fever"})
+            self.assertEqual(r.status_code, 503)
+            self.assertEqual(r.headers["Retry-After"], "1")
+            app_module.admission["retrieval"] = AdmissionController("free", concurrency=1, queue=0, queue_timeout=1)
+            r = client.post("/chatbot", json={"message": "I have a fever"})
+            self.assertEqual(r.get_json()["reply"], "model answer")
+        finally:
+            app_module.admission["retrieval"] = saved_controller
+            for name, value in saved.items():
+                setattr(app_module, name, value)
+
+
+class RateLimitTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            drop_test_tables()
+
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit("30/minute"), (30, 0.5))
+        self.assertEqual(parse_limit("5/10"), (5, 0.5))
+        self.assertIsNone(parse_limit("off"))
+
+    def test_bucket_refills_over_time(self):
+        now = [0.0]
+        buckets = MemoryBuckets(clock=lambda: now[0])
+        self.assertEqual([buckets.take("a", 3, 1.0) for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(buckets.take("a", 3, 1.0), 1.0)
+        self.assertEqual(buckets.take("b", 3, 1.0), 0.0)  # other clients are unaffected
+        now[0] = 1.0
+        self.assertEqual(buckets.take("a", 3, 1.0), 0.0)
+        self.assertGreater(buckets.take("a", 3, 1.0), 0.0)
+
+    def test_full_buckets_are_evicted(self):
+        now = [0.0]
+        buckets = MemoryBuckets(clock=lambda: now[0])
+        for key in ("a", "b", "c"):
+            buckets.take(key, 2, 1.0)
+        self.assertEqual(len(buckets), 3)
+        now[0] = 5.0
+        buckets.take("d", 2, 1.0)
+        self.assertEqual(len(buckets), 1)
+
+    def test_full_buckets_behind_a_refilling_one_are_evicted(self):
+        now = [0.0]
+        buckets = MemoryBuckets(clock=lambda: now[0])
+        buckets.take("drained", 10, 1.0, cost=10)  # full again at t=10
+        now[0] = 0.5
+        buckets.take("light", 2, 1.0)  # full again at t=1.5
+        now[0] = 2.0
+        buckets.take("new", 2, 1.0)
+        self.assertEqual(len(buckets), 2)  # "light" is gone although "drained" was used before it
+        now[0] = 20.0
+        for _ in range(500):
+            buckets.take("busy", 1000, 1.0)
+        self.assertLess(len(buckets._full_at), 200)  # stale heap entries are rebuilt away
+
+    def test_sqlite_buckets_are_shared(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rate.db")
+            now = [1000.0]
+            worker1 = SQLiteBuckets(path, clock=lambda: now[0])
+            worker2 = SQLiteBuckets(path, clock=lambda: now[0])
+            self.assertEqual(worker1.take("ip:1", 2, 1.0), 0.0)
+            self.assertEqual(worker2.take("ip:1", 2, 1.0), 0.0)
+            self.assertAlmostEqual(worker1.take("ip:1", 2, 1.0), 1.0)
+            now[0] += 10
+            worker2.SWEEP_EVERY = 1
+            worker2.take("ip:2", 2, 1.0)
+            self.assertEqual(len(worker1), 1)  # ip:1 was full again and swept
+
+    def test_routes_answer_429_with_retry_after(self):
+        saved = app_module.rate_limiter
+        app_module.rate_limiter = RateLimiter({"login": (2, 1 / 60), "chatbot": (1, 1 / 60)})
+        client = app.test_client()
+        try:
+            form = {"email": "nobody@example.com", "password": "wrong"}
+            self.assertEqual([client.post("/login", data=form).status_code for _ in range(2)], [302, 302])
+            r = client.post("/login", data=form)
+            self.assertEqual(r.status_code, 429)
+            self.assertEqual(r.headers["Retry-After"], "60")
+            self.assertEqual(client.get("/login").status_code, 200)  # only attempts are counted
+
+            self.assertEqual(client.post("/chatbot", json={"message": "hello"}).status_code, 200)
+            r = client.post("/chatbot", json={"message": "hello"})
+            self.assertEqual(r.status_code, 429)
+            self.assertIn("reply", r.get_json())
+            with client.session_transaction() as sess:
+                sess["user_id"] = 12345
+            self.assertEqual(client.post("/chatbot", json={"message": "hello"}).status_code, 200)
+            self.assertGreaterEqual(app_module.metrics.snapshot()["counters"]["rate_limit.chatbot.limited"], 1)
+        finally:
+            app_module.rate_limiter = saved
+
+
+    def test_login_attempts_on_one_account_are_limited_per_ip(self):
+        saved, saved_ips = app_module.rate_limiter, app_module.ALLOWED_IPS
+        app_module.rate_limiter = RateLimiter({"login": (10, 1 / 60), "login_account": (2, 1 / 60)})
+        app_module.ALLOWED_IPS = ["127.0.0.1/32", "192.0.2.7/32"]
+        client = app.test_client()
+        try:
+            form = {"email": "Target@example.com", "password": "wrong"}
+            codes = [client.post("/login", data=form).status_code for _ in range(3)]
+            self.assertEqual(codes, [302, 302, 429])
+            # Another account from the same IP still has attempts left
+            other = client.post("/login", data={"email": "other@example.com", "password": "wrong"})
+            self.assertEqual(other.status_code, 302)
+            # The owner, from their own IP, is not locked out by someone else's failures
+            owner = client.post("/login", data=form, environ_base={"REMOTE_ADDR": "192.0.2.7"})
+            self.assertEqual(owner.status_code, 302)
+        finally:
+            app_module.rate_limiter, app_module.ALLOWED_IPS = saved, saved_ips
+
+    def test_forwarded_for_is_ignored_without_trusted_proxies(self):
+        saved = app_module.rate_limiter
+        app_module.rate_limiter = RateLimiter({"chatbot": (1, 1 / 60)})
+        client = app.test_client()
+        try:
+            self.assertEqual(client.post("/chatbot", json={"message": "hello"},
+                                         headers={"X-Forwarded-For": "10.0.0.1"}).status_code, 200)
+            # A spoofed header does not buy a fresh bucket
+            r = client.post("/chatbot", json={"message": "hello"}, headers={"X-Forwarded-For": "10.0.0.2"})
+            self.assertEqual(r.status_code, 429)
+        finally:
+            app_module.rate_limiter = saved
+
+
+class ProgressiveAnswerTests(unittest.TestCase):
+    def setUp(self):
+        self.saved = {name: getattr(app_module, name) for name in
+                      ("ADVANCED_MODULES_AVAILABLE", "GEMINI_READY", "process_query", "process_query5")}
+        self.llm_done = threading.Event()
+        app_module.ADVANCED_MODULES_AVAILABLE = True
+        app_module.GEMINI_READY = True
+        app_module.process_query = lambda query, symptoms=None: "retrieval answer"
+
+        def slow_llm(query, symptoms=None, intent=None, history=None):
+            self.llm_done.wait(5)
+            return "llm answer"
+
+        app_module.process_query5 = slow_llm
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.llm_done.set()
+        for name, value in self.saved.items():
+            setattr(app_module, name, value)
+
+    def poll(self, request_id, client=None):
+        return (client or self.client).get(f"/chatbot/result/{request_id}")
+
+    def test_quick_reply_then_poll_for_llm_answer(self):
+        r = self.client.post("/chatbot", json={"message": "I have a fever", "progressive": True})
+        self.assertEqual(r.status_code, 202)
+        body = r.get_json()
+        self.assertEqual(body["reply"], "retrieval answer")
+        self.assertTrue(body["pending"])
+        r = self.poll(body["request_id"])
+        self.assertEqual(r.status_code, 202)
+        self.assertTrue(r.get_json()["pending"])
+        self.assertEqual(self.poll(body["request_id"], app.test_client()).status_code, 404)  # other session
+
+        self.llm_done.set()
+        deadline = time.time() + 5
+        while r.status_code == 202 and time.time() < deadline:
+            time.sleep(0.01)
+            r = self.poll(body["request_id"])
+        self.assertEqual(r.get_json(), {"request_id": body["request_id"], "reply": "llm answer", "pending": False})
+        self.assertEqual(self.poll("unknown").status_code, 404)
+
+    def test_streamed_progressive_answer(self):
+        self.llm_done.set()
+        r = self.client.post("/chatbot?progressive=1&stream=1", json={"message": "I have a fever"})
+        self.assertEqual(r.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+        self.assertEqual([(line["stage"], line["reply"]) for line in lines],
+                         [("quick", "retrieval answer"), ("final", "llm answer")])
+
+    def test_cheap_tiers_answer_directly(self):
+        r = self.client.post("/chatbot", json={"message": "hello", "progressive": True})
+        self.assertEqual(r.status_code, 200)
+        self.assertNotIn("request_id", r.get_json())
+
+    def test_results_are_visible_to_other_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "chat_state.db")
+            # Two instances stand in for the worker running the answer and the one polled
+            running = progressive.ProgressiveAnswers(workers=1, store=SQLiteStore(path, "progressive_results", ttl=60))
+            polled = progressive.ProgressiveAnswers(workers=1, store=SQLiteStore(path, "progressive_results", ttl=60))
+            request_id = running.submit("owner", lambda: self.llm_done.wait(5) and "llm answer")
+            self.assertEqual(polled.result(request_id, "owner"), (True, False, None))
+            self.llm_done.set()
+            running._futures.get(request_id).result(5)
+            self.assertEqual(polled.result(request_id, "owner"), (True, True, "llm answer"))
+            self.assertEqual(polled.result(request_id, "someone else"), (False, False, None))
+
+    def test_failed_answer_stores_fallback_and_stream_survives_eviction(self):
+        answers = progressive.ProgressiveAnswers(workers=1)
+        request_id = answers.submit("owner", lambda: 1 / 0, fallback="quick answer")
+        answers._futures.get(request_id).result(5)
+        self.assertEqual(answers.result(request_id, "owner"), (True, True, "quick answer"))
+        answers._futures.clear()
+        lines = [json.loads(line) for line in answers.stream(request_id, "quick answer")]
+        self.assertEqual(lines[-1]["reply"], "quick answer")
+
+
+class JobQueueTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            drop_test_tables()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "jobs.db")
+        self.now = [1000.0]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_queue(self, **kwargs):
+        queue = JobQueue(self.path, workers=0, clock=lambda: self.now[0], **kwargs)
+        queue.register("record")(self.calls.append)
+        return queue
+
+    def test_runs_jobs_and_deletes_them(self):
+        self.calls = []
+        queue = self.make_queue()
+        queue.enqueue("record", {"n": 1})
+        queue.enqueue("record", {"n": 2}, delay=5)
+        self.assertEqual(queue.run_pending(), 1)
+        self.assertEqual(self.calls, [{"n": 1}])
+        self.now[0] += 5
+        self.assertEqual(queue.run_pending(), 1)
+        self.assertEqual(queue.counts(), {})
+        with self.assertRaises(ValueError):
+            queue.enqueue("unknown", {})
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        self.calls = []
+        queue = self.make_queue(max_attempts=3, backoff_base=10)
+        failures = [RuntimeError("backend down")] * 2
+
+        @queue.register("flaky")
+        def flaky(payload):
+            if failures:
+                raise failures.pop()
+            self.calls.append(payload)
+
+        queue.enqueue("flaky", {"id": 7})
+        self.assertEqual(queue.run_pending(), 1)
+        self.assertEqual(queue.run_pending(), 0)  # waits at least half of the 10s backoff
+        self.now[0] += 10
+        self.assertEqual(queue.run_pending(), 1)
+        self.now[0] += 10
+        self.assertEqual(queue.run_pending(), 0)  # second backoff is 10-20s
+        self.now[0] += 10
+        self.assertEqual(queue.run_pending(), 1)
+        self.assertEqual(self.calls, [{"id": 7}])
+        self.assertEqual(queue.counts(), {})
+
+    def test_jobs_fail_for_good_after_max_attempts(self):
+        self.calls = []
+        queue = self.make_queue(max_attempts=2, backoff_base=1)
+        queue.register("broken")(lambda payload: 1 / 0)
+        queue.enqueue("broken", {})
+        queue.run_pending()
+        self.now[0] += 1
+        queue.run_pending()
+        self.assertEqual(queue.counts(), {"failed": 1})
+        error = sqlite3.connect(self.path).execute("SELECT last_error FROM jobs").fetchone()[0]
+        self.assertIn("ZeroDivisionError", error)
+
+    def test_pending_and_abandoned_jobs_survive_a_restart(self):
+        self.calls = []
+        crashed = self.make_queue(lease=60)
+        crashed.enqueue("record", {"n": 1})
+        crashed.enqueue("record", {"n": 2})
+        crashed._claim()  # the process dies while running job 1
+
+        restarted = self.make_queue(lease=60)
+        self.assertEqual(restarted.run_pending(), 1)
+        self.assertEqual(self.calls, [{"n": 2}])
+        self.now[0] += 60
+        self.assertEqual(restarted.run_pending(), 1)
+        self.assertEqual(self.calls, [{"n": 2}, {"n": 1}])
+
+    def test_abandoned_job_on_its_last_attempt_fails(self):
+        self.calls = []
+        crashed = self.make_queue(lease=60, max_attempts=1)
+        crashed.enqueue("record", {"n": 1})
+        crashed._claim()  # the process dies while running the job's only attempt
+
+        restarted = self.make_queue(lease=60, max_attempts=1)
+        self.now[0] += 60
+        self.assertEqual(restarted.run_pending(), 0)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(restarted.counts(), {"failed": 1})
+
+    def triage_setup(self, gemini_ready, generate=None):
+        import evaluate_different_modules as modules
+
+        class FakeGemini:
+            def generate(self, prompt, intent=None, deadline=None):
+                return generate(prompt)
+
+        queue = JobQueue(self.path, workers=0, clock=lambda: self.now[0])
+        queue.handlers = dict(app_module.job_queue.handlers)
+        patches = [(app_module, "job_queue", queue),
+                   (app_module, "ADVANCED_MODULES_AVAILABLE", True), (app_module, "GEMINI_READY", gemini_ready),
+                   (modules, "GEMINI_READY", gemini_ready), (modules, "get_gemini_backend", FakeGemini)]
+        for module, name, value in patches:
+            self.addCleanup(setattr, module, name, getattr(module, name))
+            setattr(module, name, value)
+        with app.app_context():
+            user = User(name="Jobs", phone="1", email=f"jobs_{time.time()}@example.com", password="x")
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+        r = client.post("/dashboard", data={"symptoms": "Cough for a week"})
+        self.assertEqual(r.status_code, 302)
+        return queue, client
+
+    def test_consultation_submit_queues_triage_summary(self):
+        prompts = []
+
+        def generate(prompt):
+            prompts.append(prompt)
+            return "Likely a viral cough; not urgent. See a doctor if it lasts."
+
+        queue, client = self.triage_setup(True, generate)
+        self.assertEqual(queue.counts(), {"pending": 1})
+        self.assertEqual(queue.run_pending(), 1)
+        self.assertIn("Cough for a week", prompts[0])
+        self.assertIn("triage notes", prompts[0])
+        self.assertNotIn("Do not provide any medical consultation", prompts[0])
+        items = client.get("/api/consultations").get_json()["items"]
+        self.assertEqual(items[0]["triage_summary"], "Likely a viral cough; not urgent. See a doctor if it lasts.")
+        with app.app_context():
+            self.assertEqual(TriageSummary.query.filter_by(consultation_id=items[0]["id"]).count(), 1)
+
+    def test_no_triage_job_without_gemini(self):
+        queue, _ = self.triage_setup(False, lambda prompt: self.fail("Gemini called"))
+        self.assertEqual(queue.counts(), {})
+
+    def test_gemini_errors_are_retried_not_stored(self):
+        def generate(prompt):
+            raise TimeoutError("deadline exceeded")
+
+        queue, client = self.triage_setup(True, generate)
+        self.assertEqual(queue.run_pending(), 1)
+        self.assertEqual(queue.counts(), {"pending": 1})
+        error = queue._connect().execute("SELECT last_error FROM jobs").fetchone()[0]
+        self.assertEqual(error, "TimeoutError: deadline exceeded")
+        self.assertIsNone(client.get("/api/consultations").get_json()["items"][0]["triage_summary"])
+
+
 if __name__ == "__main__":
-    suite = unittest.defaultTestLoader.loadTestsFromTestCase(AppEndpointTests)
+    suite = unittest.defaultTestLoader.loadTestsFromModule(sys.modules[__name__])
     runner = unittest.TextTestRunner(verbosity=2)
     result = runner.run(suite)
     # Exit with non-zero on failure for CI friendliness
@@ -0,0 +1,135 @@
+"""
+Incremental ``users.csv`` export, off the request path.
+
+``register()`` only wakes a background worker. The worker appends users
+whose id is above the high-water mark stored next to the CSV
+(``users.csv.hwm``), so each signup costs one small indexed query and one
+appended row however many users exist. A full snapshot is rewritten every
+``USERS_CSV_SNAPSHOT_INTERVAL`` seconds, or on demand, into a temporary file
+that is then renamed over the CSV, so readers never see a partial file.
+Every export holds an exclusive lock file, so several gunicorn workers can
+share one CSV.
+"""
+import contextlib
+import csv
+import os
+import tempfile
+import threading
+import time
+
+from background import BackgroundWorker
+from file_lock import exclusive
+
+FIELDNAMES = ["id", "name", "phone", "email"]
+SNAPSHOT_INTERVAL = float(os.getenv("USERS_CSV_SNAPSHOT_INTERVAL", "3600"))
+BATCH_SIZE = 1000
+
+
+class UserCsvExporter:
+    """load_users(after_id, limit) must return user dicts with id > after_id, ordered by id"""
+
+    def __init__(self, path, load_users, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.path = path
+        self.hwm_path = path + ".hwm"
+        self.lock_path = path + ".lock"
+        self.load_users = load_users
+        self.snapshot_interval = snapshot_interval
+        self._last_snapshot = time.monotonic()
+        self._lock = threading.Lock()
+        self.worker = BackgroundWorker(self._export, snapshot_interval, name="users-csv-export")
+
+    def notify(self):
+        """A user was added; export it in the background"""
+        self.worker.wake()
+
+    def flush(self):
+        """Export pending users now, in the calling thread"""
+        self.export_new()
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        with self._lock, exclusive(self.lock_path):
+            yield
+
+    def high_water_mark(self):
+        try:
+            with open(self.hwm_path) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return None
+
+    def _save_high_water_mark(self, last_id):
+        self._replace(self.hwm_path, lambda f: f.write(str(last_id)))
+
+    def _replace(self, path, write):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".")
+        try:
+            with os.fdopen(fd, "w", newline="") as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+
+    def _batches(self, after_id):
+        while True:
+            rows = self.load_users(after_id, BATCH_SIZE)
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1]["id"]
+
+    def _still_exists(self, last_id):
+        if last_id == 0:
+            return True
+        rows = self.load_users(last_id - 1, 1)
+        return bool(rows) and rows[0]["id"] == last_id
+
+    def export_new(self):
+        """Append users above the high-water mark; returns how many were appended"""
+        with self._exclusive():
+            last_id = self.high_water_mark()
+            if last_id is None or not os.path.exists(self.path) or not self._still_exists(last_id):
+                # First run, lost state, or a reset/rewritten table: start from a full snapshot
+                return self._snapshot()
+            appended = 0
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDNAMES, extrasaction="ignore")
+                for rows in self._batches(last_id):
+                    writer.writerows(rows)
+                    f.flush()
+                    last_id = rows[-1]["id"]
+                    self._save_high_water_mark(last_id)
+                    appended += len(rows)
+            return appended
+
+    def snapshot(self):
+        """Atomically rewrite the whole CSV; returns the number of users written"""
+        with self._exclusive():
+            return self._snapshot()
+
+    def _snapshot(self):
+        state = {"count": 0, "last_id": 0}
+
+        def write(f):
+            writer = csv.DictWriter(f, fieldnames=FIELDNAMES, extrasaction="ignore")
+            writer.writeheader()
+            for rows in self._batches(0):
+                writer.writerows(rows)
+                state["count"] += len(rows)
+                state["last_id"] = rows[-1]["id"]
+
+        self._replace(self.path, write)
+        self._save_high_water_mark(state["last_id"])
+        self._last_snapshot = time.monotonic()
+        return state["count"]
+
+    def _export(self):
+        if time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+            self.snapshot()
+        else:
+            self.export_new()
@@ -1,10 +1,8 @@
 import os
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 
 def preprocess_faq_data(file_path, chunk_size=200, chunk_overlap=50):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
 
     with open(file_path, 'r', encoding='utf-8') as file:
         faq_text = file.read()
@@ -13,6 +11,9 @@ def preprocess_faq_data(file_path, chunk_size=200, chunk_overlap=50):
 
 
 def get_vector_store(faq_file_path, index_path="faiss_index"):
+    # Imported here so batch_similarity_search works without the LangChain stack
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from langchain_community.vectorstores import FAISS
 
     embedding_model = HuggingFaceEmbeddings(
         model_name="sentence-transformers/all-MiniLM-L6-v2",
@@ -27,3 +28,29 @@ def get_vector_store(faq_file_path, index_path="faiss_index"):
         vector_store = FAISS.load_local(index_path, embedding_model, allow_dangerous_deserialization=True)
 
     return vector_store
+
+
+def batch_similarity_search(vector_store, queries, k=3):
+    """Embed all queries in one model call and search FAISS with one matrix query
+
+    Returns one list of (Document, distance) pairs per query, in query order.
+    """
+    import numpy as np
+
+    if not queries:
+        return []
+    matrix = np.asarray(vector_store.embeddings.embed_documents(list(queries)), dtype=np.float32)
+    if getattr(vector_store, "_normalize_L2", False):
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    distances, indices = vector_store.index.search(matrix, k)
+
+    results = []
+    for row_distances, row_indices in zip(distances, indices):
+        docs = []
+        for distance, index in zip(row_distances, row_indices):
+            if index == -1:
+                continue
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[index])
+            docs.append((doc, float(distance)))
+        results.append(docs)
+    return results